@@ -2,7 +2,7 @@ from __future__ import print_function
 import copy, datetime, sys
 import time
 from midca.mem import Memory
-from midca import goals, logging, trace
+from midca import goals, logging, trace, profiling
 from midca.worldsim import stateread
 import threading
 
@@ -53,9 +53,10 @@ class BaseModule:
 class MIDCA:
 
     def __init__(self, world = None, logenabled = True, logOutput = True,
-                     logMemory = True, metaEnabled = False, phaseManager = None, verbose = 2):
+                     logMemory = True, metaEnabled = False, phaseManager = None, verbose = 2,
+                     memoryClass = Memory):
         self.world = world
-        self.mem = Memory()
+        self.mem = memoryClass()
         self.phases = []
         self.metaPhases = []
         self.modules = {}
@@ -65,6 +66,7 @@ class MIDCA:
         self.phaseNum = 1
         self.metaPhaseNum = 1
         self.logger = logging.Logger(verbose=verbose)
+        self.profiler = None
         self.metaEnabled = metaEnabled
         self.mem.enableTrace() # enable always for printtrace command
         if metaEnabled:
@@ -263,6 +265,15 @@ class MIDCA:
                 if self.verbose > 0:
                     print("To use goal ordering, call initGoalGraph manually with a custom goal comparator")
 
+    def enableProfiling(self, profiler = None):
+        '''
+        Starts recording the time and memory accesses of every module, phase and cycle (see
+        midca.profiling). Returns the Profiler, which is also stored in memory.
+        '''
+        self.profiler = profiler or profiling.Profiler()
+        self.mem.enableProfiling(self.profiler)
+        return self.profiler
+
     def next_phase(self, verbose = 2, meta = False):
         phaseNum = self.phaseNum
         phases = self.phases
@@ -274,6 +285,15 @@ class MIDCA:
 
         retVal = ""
         self.phasei = (phaseNum - 1) % len(phases)
+        profiler = self.profiler
+        if profiler:
+            kind = "meta " if meta else ""
+            phaseName = phases[self.phasei].name
+            stack = "meta;" + phaseName if meta else "cycle;" + phaseName
+            moduleTime = 0.0
+            if self.phasei == 0:
+                profiler.startCycle(kind + "cycle")
+            phaseMark = profiler.mark()
         if self.phasei == 0:
             if self.logger.working: self.logger.logEvent(logging.CycleStartEvent((phaseNum - 1) / len(phases)))
         if verbose >= 2:
@@ -286,9 +306,14 @@ class MIDCA:
         while i < len(modules[phases[self.phasei]]):
             module = modules[phases[self.phasei]][i]
             if self.logger.working: print("") #self.logger.logEvent(logging.ModuleStartEvent(module))
+            if profiler: moduleMark = profiler.mark()
             try:
                 retVal = module.run((phaseNum - 1) / len(phases), verbose)
                 i += 1
+                if profiler:
+                    moduleName = phaseName + "/" + module.__class__.__name__
+                    moduleTime += profiler.record(kind + "module", moduleName, moduleMark,
+                                                  stack + ";" + module.__class__.__name__)
             except NotImplementedError:
                 if verbose >= 1:
                     print("module", module, "does not",
@@ -299,6 +324,10 @@ class MIDCA:
             if self.logger.working: self.logger.logEvent(logging.ModuleEndEvent(module))
 
         if self.logger.working: self.logger.logEvent(logging.PhaseEndEvent(phases[self.phasei].name))
+        if profiler:
+            profiler.record(kind + "phase", phaseName, phaseMark, stack, moduleTime)
+            if self.phasei == len(phases) - 1:
+                profiler.endCycle(kind + "cycle", (phaseNum - 1) / len(phases))
 
         if not meta:
             self.phaseNum += 1
@@ -322,7 +351,7 @@ class MIDCA:
         at an earlier time.
         '''
         newCopy = MIDCA(self.world, False, self.verbose)
-        newCopy.mem = Memory()
+        newCopy.mem = self.mem.__class__()
         newCopy.mem.knowledge = self.mem.knowledge.copy()
         newCopy.mem.locks = {name: threading.Lock() for name in self.mem.locks}
         newCopy.phases = list(self.phases)
@@ -331,16 +360,78 @@ class MIDCA:
         newCopy.phaseNum = self.phaseNum
         return newCopy
 
+class MidcaSnapshot:
+
+    '''
+    MIDCA as it was at one point of a MidcaHistory: its phases, modules, phase number
+    and a memory with the knowledge it had then. Like MIDCA.copy(), it is only meant to
+    be inspected, not run.
+    '''
+
+    def __init__(self, mem, phases, modules, phaseNum, world, initialized):
+        self.mem = mem
+        self.phases = phases
+        self.modules = modules
+        self.phaseNum = phaseNum
+        self.world = world
+        self.initialized = initialized
+
+class MidcaHistory:
+
+    '''
+    The states of MIDCA before each phase, recorded by PhaseManager when storeHistory is
+    True. Instead of a copy of MIDCA per phase, memory changes are recorded in a
+    MemoryJournal and the phases and modules are only stored again when they change, so
+    the history grows with what changes. history[i] rebuilds the i-th state as a
+    MidcaSnapshot; rebuilding states in order is cheap.
+    '''
+
+    def __init__(self):
+        self.journal = None
+        self.frames = [] #(phaseNum, phases, modules) per recorded state
+
+    def record(self, midca):
+        mem = midca.mem
+        if self.journal is None or mem.journal is not self.journal:
+            self.journal = mem.startJournal()
+            self.frames = []
+        self.journal.checkpoint()
+        structure = (list(midca.phases), midca.modules.copy())
+        if self.frames:
+            last = self.frames[-1]
+            if last[1] == structure[0] and last[2] == structure[1]:
+                structure = (last[1], last[2])
+        self.frames.append((midca.phaseNum, structure[0], structure[1], midca.world,
+                            midca.initialized, mem.__class__))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        phaseNum, phases, modules, world, initialized, memoryClass = self.frames[i]
+        mem = memoryClass()
+        mem.knowledge = self.journal.knowledge(i)
+        mem.locks = {name: threading.Lock() for name in mem.knowledge}
+        return MidcaSnapshot(mem, phases, modules, phaseNum, world, initialized)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
 class PhaseManager:
 
-    def __init__(self, world = None, verbose = 2, display = None, storeHistory = False, metaEnabled = False):
+    def __init__(self, world = None, verbose = 2, display = None, storeHistory = False, metaEnabled = False,
+                 memoryClass = Memory):
         # phasemanager is passed in as a self pointer for metacognitive modification
         self.verbose = verbose
-        self.midca = MIDCA(world = world, verbose = verbose, metaEnabled = metaEnabled, phaseManager=self,logenabled=False)
+        self.midca = MIDCA(world = world, verbose = verbose, metaEnabled = metaEnabled, phaseManager=self,logenabled=False,
+                           memoryClass = memoryClass)
         self.metaEnabled = metaEnabled
         self.mem = self.midca.mem
         self.storeHistory = storeHistory
-        self.history = []
+        self.history = MidcaHistory()
         self.display = display
         self.twoSevenWarning = False
         self.logger = self.midca.logger
@@ -355,6 +446,9 @@ class PhaseManager:
     def insert_phase(self, phase, phaseOrIndex):
         self.midca.insert_phase(phase, phaseOrIndex)
 
+    def enableProfiling(self, profiler = None):
+        return self.midca.enableProfiling(profiler)
+
     def append_phase(self, phase):
         self.midca.append_phase(phase)
 
@@ -400,7 +494,7 @@ class PhaseManager:
 
     def next_phase(self, verbose = 2):
         if self.storeHistory:
-            self.history.append(self.midca.copy())
+            self.history.record(self.midca)
         val = self.midca.next_phase(verbose)
         return val
 
@@ -471,6 +565,63 @@ class PhaseManager:
         for i in range(num):
             self.one_cycle_no_interface(verbose, pause, meta)
 
+    def fast_run(self, num = None, until = None, verbose = 0):
+        '''
+        Runs cycles of cognition as fast as possible, for batch experiments: num cycles,
+        or until until(mem) (checked before every cycle) returns True. The modules of
+        all phases are flattened into one list of calls, which is run once per cycle;
+        there are no pauses, history, display, log events or profiling, and verbose (0
+        by default) is only passed on to the modules. Metacognitive phases are not run.
+        Modules that do not implement run() are removed, as in next_phase(); other
+        modules must not be added or removed during the run.
+        If MIDCA is in the middle of a cycle, that cycle is finished first (and counted).
+        Returns a dict with the number of cycles run, the time they took, the cycles per
+        second and why the run stopped ("num" or "until").
+        '''
+        if num is None and until is None:
+            raise ValueError("fast_run needs a number of cycles or an until predicate")
+        if not self.midca.initialized:
+            raise Exception("MIDCA has not been initialized! Please call Midca.init() before running.")
+        midca = self.midca
+        phases = midca.phases
+        numPhases = len(phases)
+        calls = None
+        mem = self.mem
+        start = time.time()
+        cycles = 0
+        stopped = "num"
+        while num is None or cycles < num:
+            if until and until(mem):
+                stopped = "until"
+                break
+            if (midca.phaseNum - 1) % numPhases != 0:
+                while (midca.phaseNum - 1) % numPhases != 0:
+                    midca.next_phase(verbose)
+                calls = None #next_phase may have removed modules
+            else:
+                if calls is None:
+                    calls = [(phase, module) for phase in phases for module in midca.modules[phase]]
+                cycle = (midca.phaseNum - 1) / numPhases
+                i = 0
+                while i < len(calls):
+                    phase, module = calls[i]
+                    try:
+                        module.run(cycle, verbose)
+                        i += 1
+                    except NotImplementedError:
+                        if verbose >= 1:
+                            print("module", module, "does not",
+                                  "implement the run() method and",
+                                  "is therefore invalid. It will be",
+                                  "removed from MIDCA.")
+                        midca.removeModule(phase, midca.modules[phase].index(module))
+                        del calls[i]
+                midca.phaseNum += numPhases
+            cycles += 1
+        elapsed = time.time() - start
+        return {"cycles": cycles, "time": elapsed, "stopped": stopped,
+                "cyclesPerSecond": cycles / elapsed if elapsed > 0 else float("inf")}
+
     #MIDCA will call this function after the first phase. The function should take one input, which will be whatever is stored in self.midca.world.
     def set_display_function(self, function):
         self.display = function
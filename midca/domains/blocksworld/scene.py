@@ -99,13 +99,12 @@ class Scene:
                     asciisquares[-2][j] = ("              ", None)
                     asciisquares[-3][j] = ("              ", None)
 
-        toprint = ""
+        lines = []
         for i in range(len(asciisquares)-1, -1, -1):
-            for segment in asciisquares[i]:
-                toprint += segment[0]
-            toprint += "\n"
+            lines.append("".join([segment[0] for segment in asciisquares[i]]))
+            lines.append("\n")
 
-        return toprint
+        return "".join(lines)
     
 
     
\ No newline at end of file
@@ -1,6 +1,6 @@
 # This file contains helpful functions for the nbeacons domain
 
-import random
+import random, weakref
 import midca.modules.planning
 from midca.modules._plan import pyhop
 
@@ -456,116 +456,179 @@ def pyhop_tasks_from_goals(goals,pyhopState):
     
     return alltasks
 
+def _asciiheader(width):
+    return "   " + "".join([(str(i)[1] if i >= 10 else str(i)) + " " for i in range(width)]) + "\n"
+
+def _asciirow(r, row, numbered_borders = True):
+    '''
+    Returns row r of a frame as a line, with its trailing space but not its newline.
+    '''
+    line = " ".join(row) + " "
+    if numbered_borders:
+        if r < 10:
+            return str(r) + "  " + line # two spaces to make it look nicer
+        return str(r) + " " + line # only one space
+    return line
+
 def asciiframestr(frame, numbered_borders = True):
-    result = ""
+    parts = []
     if numbered_borders:
-        result +="   "
-        for i in range(len(frame)):
-            if i >= 10:
-                result += str(i)[1]+" "
-            else:
-                result += str(i)+" "
-        result+='\n'
-    r = 0
-    for row in frame:
-        if numbered_borders:
-            if r < 10:
-                result += str(r)+"  " # two spaces to make it look nicer
-            else:
-                result += str(r)+" " # only one space
-        for val in row:
-            result += val + " "
-        result += "\n"
-        r+=1
+        parts.append(_asciiheader(len(frame)))
+    for r in range(len(frame)):
+        parts.append(_asciirow(r, frame[r], numbered_borders))
+        parts.append("\n")
     # remove trailing newline
-    result = result[:len(result)-2]
-    return result   
-   
-def drawNBeaconsScene(midcastate,rtn_str=False):
+    return "".join(parts)[:-2]
+
+# SYMBOLS
+DIRT = '.'
+BEACON_UNACTIVATED = 'b'
+BEACON_ACTIVATED = 'B'
+WOOD = 'x'
+#WOOD_ON_FIRE = '*'
+AGENT = 'a'
+AGENT_WITH_UNACTIVATED_BEACON = '*'
+AGENT_WITH_ACTIVATED_BEACON = 'A'
+AGENT_WITH_WOOD = '^'
+AGENT_WITH_FIRE = '%'
+AGENT_WITH_FLARE = '#'
+FLARE = '$'
+QUICKSAND = '~'
+AGENT_WITH_QUICKSAND = '?'
+
+def _tile_xy(tile_name):
+    x, y = convert(tile_name).split(",")
+    return (int(x), int(y))
+
+class NBeaconsRenderer():
     '''
-    Takes the world state MIDCA and returns a str of an ascii
-    drawing of the nbeacons domain for visual consumption by a human
+    Draws the nbeacons scene of one world, as drawNBeaconsScene does. The frame is kept
+    between calls: only the cells of the atoms added or removed since the last render are
+    redrawn, and only their rows are joined again, so drawing every cycle costs about as
+    much as the cycle's changes. Changes to the world's objects redraw the whole frame.
     '''
-    
-    # SYMBOLS
-    DIRT = '.'
-    BEACON_UNACTIVATED = 'b'
-    BEACON_ACTIVATED = 'B'                        
-    WOOD = 'x'
-    #WOOD_ON_FIRE = '*'
-    AGENT = 'a'
-    AGENT_WITH_UNACTIVATED_BEACON = '*'
-    AGENT_WITH_ACTIVATED_BEACON = 'A'
-    AGENT_WITH_WOOD = '^'
-    AGENT_WITH_FIRE = '%'
-    AGENT_WITH_FLARE = '#'
-    FLARE = '$'
-    QUICKSAND = '~'
-    AGENT_WITH_QUICKSAND = '?'
-    
-    # convert MIDCA world to PyHop State (only doing this for code re-use
-    pyhopState = pyhop_state_from_world(midcastate)
-    #print("successfully created pyhop state from midca state")
-    # initialize the map with dirt
-    dim = pyhopState.dim['dim']
-    grid = []
-    for c in range(dim):
-        row = []
-        for r in range(dim):
-                row.append(DIRT)
-        grid.append(row)
-    
-        
-    # Add agent
-    agentstr = pyhopState.agents['Curiosity']
-    agent_x = int(agentstr.split(',')[0]) 
-    agent_y = int(agentstr.split(',')[1])
-    grid[agent_y][agent_x] = AGENT
-     
-    # now go through each attribute of the state, changing the grid
-    # ADD ALL BEACONS
-    for beaconkey in pyhopState.activated.keys():
-        beaconstr = pyhopState.beaconlocs[beaconkey]
-        x = int(beaconstr.split(",")[0]) 
-        y = int(beaconstr.split(",")[1]) 
-        
-        if pyhopState.activated[beaconkey]:
-            if pyhopState.beaconlocs[beaconkey] == pyhopState.agents['Curiosity']:
-                # Beacon is activated, with agent
-                grid[y][x] = AGENT_WITH_ACTIVATED_BEACON
+
+    def __init__(self):
+        self.last = None
+        self.text = None
+
+    def _reset(self, world):
+        self.dim = 0
+        self.beacons = set()
+        for obj in world.objects.values():
+            if obj.type.name == "BEACON":
+                self.beacons.add(obj.name)
+            elif obj.type.name == "DIM":
+                self.dim = int(obj.name)
+        self.agent = None
+        self.beaconlocs = {}
+        self.beaconsAt = {}
+        self.activated = set()
+        self.quicksand = set()
+
+    def _update(self, atom, add, dirty):
+        predname = atom.predicate.name
+        if predname == "agent-at":
+            if atom.args[0].name != NBeaconGrid.AGENT_NAME:
+                return
+            loc = _tile_xy(atom.args[1].name)
+            if add:
+                self.agent = loc
+            elif self.agent == loc:
+                self.agent = None
+            dirty.add(loc)
+        elif predname == "beacon-at":
+            beacon = atom.args[0].name
+            loc = _tile_xy(atom.args[1].name)
+            if add:
+                self.beaconlocs[beacon] = loc
+                self.beaconsAt.setdefault(loc, set()).add(beacon)
             else:
-                # Beacon is activated, no agent
-                grid[y][x] = BEACON_ACTIVATED
-        else:
-            if pyhopState.beaconlocs[beaconkey] == pyhopState.agents['Curiosity']:
-                # Beacon is activated, with agent
-                grid[y][x] = AGENT_WITH_UNACTIVATED_BEACON
+                if self.beaconlocs.get(beacon) == loc:
+                    del self.beaconlocs[beacon]
+                self.beaconsAt.get(loc, set()).discard(beacon)
+            dirty.add(loc)
+        elif predname == "activated":
+            beacon = atom.args[0].name
+            if add:
+                self.activated.add(beacon)
             else:
-                # Beacon is unactivated, no agent
-                beacon_id = ""
-                #pyhop.print_state(pyhopState)
-                for (k,v) in pyhopState.beaconlocs.items():
-                    if v == str(x)+","+str(y):
-                        beacon_id = k[1:] # remove the 'B'
-                
-                #grid[y][x] = BEACON_UNACTIVATED 
-                grid[y][x] = beacon_id
- 
-    # add in quicksand
-    for qs in pyhopState.quicksand:
-        qs_str = qs
-        x = int(qs_str.split(",")[0]) 
-        y = int(qs_str.split(",")[1])
-        
-        if pyhopState.agents['Curiosity'] == qs:
-            grid[y][x] = AGENT_WITH_QUICKSAND
+                self.activated.discard(beacon)
+            if beacon in self.beaconlocs:
+                dirty.add(self.beaconlocs[beacon])
+        elif predname == "quicksand":
+            loc = _tile_xy(atom.args[0].name)
+            if add:
+                self.quicksand.add(loc)
+            else:
+                self.quicksand.discard(loc)
+            dirty.add(loc)
+
+    def _cell(self, loc):
+        if loc in self.quicksand:
+            return AGENT_WITH_QUICKSAND if loc == self.agent else QUICKSAND
+        beacons = [b for b in self.beaconsAt.get(loc, ()) if b in self.beacons or b in self.activated]
+        if beacons:
+            beacon = max(beacons)
+            if beacon in self.activated:
+                return AGENT_WITH_ACTIVATED_BEACON if loc == self.agent else BEACON_ACTIVATED
+            return AGENT_WITH_UNACTIVATED_BEACON if loc == self.agent else beacon[1:] # remove the 'B'
+        return AGENT if loc == self.agent else DIRT
+
+    def render(self, world):
+        '''
+        Returns the drawing of world's current state.
+        '''
+        dirty = set()
+        if self.last is None or world.objects != self.last.objects:
+            self._reset(world)
+            for atom in world.atoms:
+                self._update(atom, True, dirty)
+            self.grid = [[self._cell((x, y)) for x in range(self.dim)] for y in range(self.dim)]
+            self.rows = [_asciirow(y, self.grid[y]) for y in range(self.dim)]
+            self.header = _asciiheader(self.dim)
+            self.text = None
         else:
-            grid[y][x] = QUICKSAND
-    
+            added, removed = world.atoms.diff(self.last.atoms)
+            for atom in removed:
+                self._update(atom, False, dirty)
+            for atom in added:
+                self._update(atom, True, dirty)
+            rows = set()
+            for (x, y) in dirty:
+                if 0 <= x < self.dim and 0 <= y < self.dim:
+                    cell = self._cell((x, y))
+                    if self.grid[y][x] != cell:
+                        self.grid[y][x] = cell
+                        rows.add(y)
+            for y in rows:
+                self.rows[y] = _asciirow(y, self.grid[y])
+            if rows:
+                self.text = None
+        self.last = world.copy()
+        if self.text is None:
+            # remove trailing newline
+            self.text = "".join([self.header, "\n".join(self.rows), "\n"])[:-2]
+        return self.text
+
+# one renderer per world drawn, dropped along with the world
+_renderers = weakref.WeakKeyDictionary()
+
+def drawNBeaconsScene(midcastate,rtn_str=False):
+    '''
+    Takes the world state MIDCA and returns a str of an ascii
+    drawing of the nbeacons domain for visual consumption by a human.
+    Each world keeps an NBeaconsRenderer, so drawing the same world
+    again only redraws what changed since.
+    '''
+    renderer = _renderers.get(midcastate)
+    if renderer is None:
+        renderer = _renderers[midcastate] = NBeaconsRenderer()
+    frame = renderer.render(midcastate)
     if rtn_str:
-        return asciiframestr(grid) 
+        return frame
     else:
-        print(asciiframestr(grid))
+        print(frame)
 
 
 def preferFree(goal1, goal2):
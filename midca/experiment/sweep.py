@@ -0,0 +1,177 @@
+'''
+Parallel parameter sweeps of MIDCA runs.
+
+A Sweep runs a function once for every combination of parameters in a grid (and every
+repeat), each run in a process of its own, and appends one CSV row per run to a data
+file as soon as the run finishes. Idle processes take the next waiting run, so long
+and short runs balance out over the pool. If the data file already has rows (say the
+sweep was interrupted), runs that completed are not run again.
+
+The run function takes a dict of parameters and a seed, and returns a dict of results
+(columns). It must be defined at the top level of a module so that it can be sent to
+the worker processes. If it returns a "cycles" value, the sweep reports cycles/s as
+well as runs/s. Example:
+
+    def run(params, seed):
+        myMidca = <build MIDCA, e.g. with simulator.ArsonSimulator(params["chance"], seed = seed)>
+        myMidca.init()
+        stats = myMidca.fast_run(params["cycles"])
+        return {"cycles": stats["cycles"], "score": myMidca.mem.get(myMidca.mem.DELIVERED)}
+
+    sweep = Sweep("arson", run, param_grid(chance = [0.1, 0.5], cycles = [100]),
+                  "experiments/arson.csv", repeats = 10)
+    sweep.run()
+'''
+
+from __future__ import print_function
+import csv, itertools, os, random, sys, time, traceback
+from multiprocessing import Pool, cpu_count
+from midca.experiment.experiment import Experiment
+
+def param_grid(**axes):
+    '''
+    Returns a list of dicts, one for each combination of the values given for each
+    parameter: param_grid(a = [1, 2], b = ["x"]) == [{"a": 1, "b": "x"}, {"a": 2, "b": "x"}].
+    '''
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*[axes[name] for name in names])]
+
+def _run_one(args):
+    runfunc, run_id, params, seed = args
+    random.seed(seed)
+    t0 = time.time()
+    try:
+        result = runfunc(dict(params), seed)
+        error = ""
+    except Exception:
+        result = {}
+        error = traceback.format_exc().strip().splitlines()[-1]
+    return run_id, params, seed, result, error, time.time() - t0
+
+class Sweep(Experiment):
+
+    def __init__(self, name, runfunc, grid, filename, repeats = 1, seed = 0,
+                 processes = None, isolate = True, columns = None, verbose = 1):
+        '''
+        runfunc(params, seed) is run for each dict of parameters in grid, repeats times.
+        Run ids number the runs in order, and each run gets the seed seed + run id; the
+        global random module of the worker is also seeded with it, so a run gives the
+        same results every time.
+        Results are written to filename (a .csv file). columns are the names of the
+        result columns; by default, those of the first result.
+        processes is the number of worker processes (by default, one per CPU). If
+        isolate is True, each run gets a fresh process. If it is False, workers are reused
+        for many runs, which saves starting a process and importing MIDCA for each; every
+        load_domain() builds an independent world, but run functions must not leave other
+        global state behind.
+        '''
+        Experiment.__init__(self, name)
+        if not filename.endswith(".csv"):
+            raise Exception("Tried to use output data file that is NOT a .csv file: " + filename)
+        self.runfunc = runfunc
+        self.filename = filename
+        self.processes = processes or cpu_count()
+        self.isolate = isolate
+        self.columns = columns
+        self.verbose = verbose
+        self.paramNames = sorted(set(name for params in grid for name in params))
+        for params in grid:
+            for i in range(repeats):
+                self.runs.append((self.run_count, params, seed + self.run_count))
+                self.run_count += 1
+
+    def completed(self):
+        '''
+        Returns the ids of the runs that have a row without an error in the data file.
+        '''
+        done = set()
+        if not os.path.exists(self.filename):
+            return done
+        with open(self.filename, "rb") as f:
+            for row in csv.DictReader(f):
+                if row.get("run_id") and not row.get("error"):
+                    done.add(int(row["run_id"]))
+        return done
+
+    def results(self):
+        '''
+        Returns the rows of the data file as dicts, the last one of each run, by run id.
+        '''
+        rows = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, "rb") as f:
+                for row in csv.DictReader(f):
+                    rows[int(row["run_id"])] = row
+        return [rows[run_id] for run_id in sorted(rows)]
+
+    def _header(self):
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:
+            with open(self.filename, "rb") as f:
+                return next(csv.reader(f))
+        return None
+
+    def report(self, done, total, runs, cycles, elapsed):
+        if self.verbose >= 1 and elapsed > 0:
+            print("-- " + self.name + ": " + str(done) + "/" + str(total) + " runs, " +
+                  "%.2f runs/s, %.1f cycles/s" % (runs / elapsed, cycles / elapsed), file = sys.stderr)
+
+    def run(self):
+        '''
+        Runs the runs that are not completed in the data file, appending a row for each as
+        it finishes, then calls the functions added with addDestructFunc(). Returns a dict
+        with the number of runs done and failed, the time taken and the runs/s and cycles/s.
+        '''
+        done = self.completed()
+        todo = [run for run in self.runs if run[0] not in done]
+        if self.verbose >= 1:
+            print("-- Starting " + self.name + ": " + str(len(todo)) + " of " + str(len(self.runs)) +
+                  " runs left, using " + str(self.processes) + " processes...", file = sys.stderr)
+        header = self._header()
+        writer = None
+        waiting = [] # rows of failed runs that came before the first result
+        runs = failed = cycles = 0
+        t0 = time.time()
+        pool = Pool(processes = self.processes, maxtasksperchild = 1 if self.isolate else None)
+        with open(self.filename, "ab") as f:
+            try:
+                tasks = [(self.runfunc, run_id, params, seed) for run_id, params, seed in todo]
+                for run_id, params, seed, result, error, elapsed in pool.imap_unordered(_run_one, tasks, chunksize = 1):
+                    row = dict(result, run_id = run_id, seed = seed, time = elapsed, error = error)
+                    row.update(params)
+                    runs += 1
+                    if error:
+                        failed += 1
+                        if self.verbose >= 1:
+                            print("-- run " + str(run_id) + " failed: " + error, file = sys.stderr)
+                    if writer is None:
+                        if header is None and error and self.columns is None:
+                            waiting.append(row)
+                            continue
+                        if header is None:
+                            columns = self.columns or sorted(k for k in result if k not in params)
+                            header = ["run_id", "seed"] + self.paramNames + list(columns) + ["time", "error"]
+                            csv.writer(f).writerow(header)
+                        writer = csv.DictWriter(f, header, restval = "", extrasaction = "ignore")
+                        writer.writerows(waiting)
+                        waiting = []
+                    writer.writerow(row)
+                    f.flush()
+                    try:
+                        cycles += int(result.get("cycles", 0))
+                    except (TypeError, ValueError):
+                        pass
+                    self.report(len(done) + runs, len(self.runs), runs, cycles, time.time() - t0)
+                if waiting: # every run failed
+                    header = ["run_id", "seed"] + self.paramNames + ["time", "error"]
+                    writer = csv.DictWriter(f, header, restval = "", extrasaction = "ignore")
+                    writer.writeheader()
+                    writer.writerows(waiting)
+            finally:
+                pool.close()
+                pool.join()
+        for dfunc in self.destructfuncs:
+            dfunc()
+        elapsed = time.time() - t0
+        return {"runs": runs, "failed": failed, "time": elapsed,
+                "runsPerSecond": runs / elapsed if elapsed > 0 else 0.0,
+                "cyclesPerSecond": cycles / elapsed if elapsed > 0 else 0.0}
@@ -1,15 +1,97 @@
 import copy
+import collections
 import shlex, subprocess
 
-class Goal:
+class GoalKwargs(dict):
+
+    '''
+    The read-only keyword arguments of a Goal.
+    '''
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Goal kwargs cannot be changed; use Goal.replace() to make a new goal")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (GoalKwargs, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+def _rebuild_goal(cls, args, kwargs, goalId = None):
+    goal = cls.__new__(cls)
+    goal._set(args, kwargs, goalId)
+    return goal
+
+class Goal(object):
+
+    '''
+    A goal is an immutable tuple of args plus keyword arguments, e.g.
+    Goal("A_", "B_", predicate = "on"). Goals with the same type, args and kwargs are equal
+    and have the same hash, so they can be used in sets and as dict keys; both are computed
+    once from the goal's canonical key. Use replace() to get a changed copy of a goal.
+    '''
+
+    __slots__ = ["args", "kwargs", "id", "key", "hash"]
 
     def __init__(self, *args, **kwargs):
+        self._set(args, kwargs)
+
+    #a goal's id is the id kwarg if given, otherwise unique to the goal (and kept by replace() and pickling)
+    def _set(self, args, kwargs, goalId = None):
+        kwargs = GoalKwargs(kwargs)
+        key = (args, tuple(sorted(kwargs.items(), key = lambda item: item[0])))
+        try:
+            keyHash = hash(key)
+        except TypeError:
+            #unhashable args or kwargs; equal goals still have equal reprs
+            keyHash = hash(repr(key))
+        init = object.__setattr__
+        init(self, "args", args)
+        init(self, "kwargs", kwargs)
+        init(self, "key", key)
+        init(self, "hash", keyHash)
         if 'id' in kwargs:
-            self.id = kwargs['id']
-        else:
-            self.id = hash(self)
-        self.args = args
-        self.kwargs = kwargs
+            goalId = kwargs['id']
+        elif goalId is None:
+            goalId = object.__hash__(self)
+        init(self, "id", goalId)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Goals are immutable; use Goal.replace() to make a new goal")
+
+    __delattr__ = __setattr__
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return self is other or (type(self) is type(other) and self.hash == other.hash and
+                                 self.key == other.key)
+
+    def __ne__(self, other):
+        return not self == other
+
+    #goals are immutable, so copies are the goal itself
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (_rebuild_goal, (type(self), self.args, dict(self.kwargs), self.id))
+
+    #for goals pickled before goals were immutable
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            state = state[1] or {}
+        self._set(tuple(state.get("args", ())), dict(state.get("kwargs", {})), state.get("id"))
 
     def __getitem__(self, val):
         if val in self.kwargs:
@@ -29,13 +111,26 @@ class Goal:
             return False
 
     def __setitem__(self, key, item):
+        raise TypeError("Goals are immutable; use Goal.replace() to make a new goal")
+
+    def replace(self, key, item):
+        '''
+        Returns a copy of this goal in which the arg at index key (if key is an int) or the
+        kwarg key is item. The copy keeps this goal's id unless key is "id".
+        Example:
+        Goal(A_, B_, predicate = on).replace("predicate", "stable-on")
+        would return Goal(A_, B_, predicate = stable-on)
+        '''
+        args = self.args
+        kwargs = dict(self.kwargs)
         if isinstance(key, int):
-            if key < len(self.args):
-                self.args[key] = item
+            if key < len(args):
+                args = args[:key] + (item,) + args[key + 1:]
             else:
                 raise IndexError(str(key) + " is out of range for args of " + str(self))
         else:
-            self.kwargs[key] = item
+            kwargs[key] = item
+        return _rebuild_goal(type(self), args, kwargs, self.id)
 
     def get_args(self):
         '''
@@ -85,20 +180,100 @@ class GoalNode:
         """ Nice string format for labeling the graph in the pdf drawing """
         return str(self.goal)
 
+class GoalIndex:
+
+    '''
+    An inverted index of entries stored under goals. Each goal is indexed by its number of
+    args, each (position, arg) and each (key, value) of its kwargs, so candidates(goal)
+    only returns entries whose goals share the most selective of those with the given
+    goal. The candidates are a superset of the matches; callers filter them with
+    GoalGraph.consistentGoal or GoalGraph.sameGoal. Goals must not be changed while they
+    are indexed.
+    '''
+
+    def __init__(self):
+        self.goals = {}
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.goals)
+
+    def __iter__(self):
+        return iter(self.goals)
+
+    def _features(self, goal, exact):
+        features = []
+        if exact:
+            features.append(("len", len(goal.args)))
+        for i, arg in enumerate(goal.args):
+            if exact or arg != "?":
+                features.append(("arg", i, arg))
+        for key, val in goal.kwargs.items():
+            features.append(("kw", key, val))
+        hashable = []
+        for feature in features:
+            try:
+                hash(feature)
+            except TypeError:
+                continue
+            hashable.append(feature)
+        return hashable
+
+    def add(self, entry, goal):
+        self.goals[entry] = goal
+        for feature in self._features(goal, True):
+            self.postings.setdefault(feature, set()).add(entry)
+
+    def remove(self, entry):
+        goal = self.goals.pop(entry, None)
+        if goal is None:
+            return
+        for feature in self._features(goal, True):
+            entries = self.postings.get(feature)
+            if entries is not None:
+                entries.discard(entry)
+                if not entries:
+                    del self.postings[feature]
+
+    def clear(self):
+        self.goals.clear()
+        self.postings.clear()
+
+    def candidates(self, goal, exact = False):
+        '''
+        Returns the entries that might be stored under a goal consistent with (or, if
+        exact, the same as) goal.
+        '''
+        best = None
+        for feature in self._features(goal, exact):
+            entries = self.postings.get(feature)
+            if not entries:
+                return ()
+            if best is None or len(entries) < len(best):
+                best = entries
+        if best is None:
+            return list(self.goals)
+        return list(best)
+
 class GoalGraph:
 
     '''
     A graph that maintains a partial ordering of goals. Note that, at present, cycle checking is not complete, so partial orderings can be created that would never allow a goal to be accomplished.
     The single constructor argument gives a function that takes two goals as input and should return a +/- value indicating precedence. If goal1 should be achieved before goal2, goalCompareFunction(goal1, goal2) < 0.
+    Goal nodes and the goals of stored plans are kept in GoalIndexes, so finding a goal or the plans for a set of goals only looks at nodes and plans that share args or kwargs with them. Goals should not be changed after they are added to the graph or to a stored plan.
     '''
 
     def __init__(self, goalCompareFunction = None):
         self.roots = set()
         self.cmp = goalCompareFunction
+        self.ordered = bool(self.cmp)
         if not self.cmp:
             self.cmp = lambda goal1, goal2: 0
         self.numGoals = 0
         self.plans = set()
+        self.nodeIndex = GoalIndex()
+        self.planIndex = GoalIndex()
+        self.planGoals = {}
 
     #note not symmetrical - finds goals that are specifications of current goal, but not generalizations.
     def consistentGoal(self, first, second):
@@ -111,7 +286,7 @@ class GoalGraph:
         return True
 
     def sameGoal(self, goal1, goal2):
-        return type(goal1) == type(goal2) and goal1.args == goal2.args and goal1.kwargs == goal2.kwargs
+        return goal1 == goal2
 
     def add(self, goal):
         self.insert(goal)
@@ -122,33 +297,68 @@ class GoalGraph:
             return False
         newNode = GoalNode(goal)
         self.numGoals += 1
-        if not self.roots:
-            self.roots.add(newNode)
-        for node in self._getAllNodes():
-            cmpVal = self.cmp(newNode.goal, node.goal)
-            if cmpVal < 0:
-                newNode.addChild(node)
-            elif cmpVal > 0:
-                node.addChild(newNode)
-        self.roots = {node for node in self.roots if node not in newNode.children}
+        #with no comparator, goals are unordered and need not be compared
+        if self.ordered:
+            for node in self.nodeIndex:
+                cmpVal = self.cmp(newNode.goal, node.goal)
+                if cmpVal < 0:
+                    newNode.addChild(node)
+                elif cmpVal > 0:
+                    node.addChild(newNode)
+            self.roots.difference_update(newNode.children)
+        self.nodeIndex.add(newNode, goal)
         if not newNode.parents:
             self.roots.add(newNode)
+        elif not self._reachable(newNode):
+            #the new node closed a cycle, which may cut nodes off from the roots
+            self._dropUnreachable()
         if not self.roots:
             raise ValueError("Adding a goal that creates a cycle in the graph. Now no goals can be achieved.")
         return True
 
     def _removeNode(self, delNode):
         self.numGoals -= 1
-        allNodes = self._getAllNodes()
         if delNode in self.roots:
             self.roots.remove(delNode)
-            for node in allNodes:
-                if delNode in node.parents:
-                    node.parents.remove(delNode)
-                    if not node.parents and node != delNode:
-                        self.roots.add(node)
-                if delNode in node.children:
-                    node.children.remove(delNode)
+            self.nodeIndex.remove(delNode)
+            stranded = False
+            for node in delNode.children:
+                node.parents.discard(delNode)
+                if not node.parents and node != delNode:
+                    self.roots.add(node)
+                elif not self._reachable(node):
+                    stranded = True
+            for node in delNode.parents:
+                node.children.discard(delNode)
+            if stranded:
+                self._dropUnreachable()
+
+    #whether node can be reached from a root, i.e. whether it is still in the graph.
+    def _reachable(self, node):
+        visited = set()
+        nodes = [node]
+        while nodes:
+            next = nodes.pop()
+            if next in self.roots:
+                return True
+            if next in visited:
+                continue
+            visited.add(next)
+            nodes.extend(next.parents)
+        return False
+
+    #removes nodes that can no longer be reached from a root (after a cycle was created) from the index.
+    def _dropUnreachable(self):
+        reachable = set()
+        nodes = list(self.roots)
+        while nodes:
+            next = nodes.pop()
+            if next in reachable:
+                continue
+            reachable.add(next)
+            nodes.extend(next.children)
+        for node in [node for node in self.nodeIndex if node not in reachable]:
+            self.nodeIndex.remove(node)
 
     def remove(self, goal):
         delNode = self._getGoalNode(goal)
@@ -157,7 +367,16 @@ class GoalGraph:
         self._removeNode(delNode)
 
     def addPlan(self, plan):
+        if plan in self.plans:
+            return
         self.plans.add(plan)
+        self.planGoals[plan] = tuple(plan.goals)
+        for i, goal in enumerate(self.planGoals[plan]):
+            self.planIndex.add((plan, i), goal)
+
+    def _unindexPlan(self, plan):
+        for i in range(len(self.planGoals.pop(plan, ()))):
+            self.planIndex.remove((plan, i))
 
     #removes all goals associated with given plan. Not super efficient right now, but the expectation is that the number of goals will not be huge.
     def removePlanGoals(self, plan):
@@ -167,6 +386,7 @@ class GoalGraph:
     #will raise KeyError if plan is not in plan set.
     def removePlan(self, plan):
         self.plans.remove(plan)
+        self._unindexPlan(plan)
 
     def planCurrent(self, plan, requireAllGoals = True):
         numGoalsMissed = 0
@@ -181,7 +401,21 @@ class GoalGraph:
         return True
 
     def removeOldPlans(self, requireAllGoals = True):
-        self.plans = {plan for plan in self.plans if self.planCurrent(plan, requireAllGoals)}
+        for plan in [plan for plan in self.plans if not self.planCurrent(plan, requireAllGoals)]:
+            self.removePlan(plan)
+
+    #returns {plan: number of given goals that match one of the plan's goals}, over the plans with at least one such goal. Goals match if they are the same goal (if exact) or consistent.
+    #plans are found by the goals they had when added, but matched against their current goals, since a plan's goal list may be shared with (and shortened by) other modules.
+    def _plansByGoals(self, goals, exact):
+        match = self.sameGoal if exact else self.consistentGoal
+        counts = {}
+        for goal in goals:
+            plans = {plan for (plan, i) in self.planIndex.candidates(goal, exact)}
+            plans = {plan for plan in plans
+                     if any(match(goal, planGoal) for planGoal in plan.goals)}
+            for plan in plans:
+                counts[plan] = counts.get(plan, 0) + 1
+        return counts
 
     def numMatchingGoals(self, plan, goals):
         num = 0
@@ -197,33 +431,25 @@ class GoalGraph:
 
     #returns all plan whose goalset contains any of given goals. Will return them in order of how many given goals they achieve, ties broken by minimizing extra goals. Note that this ordering may break if a plan has more than a thousand goals.
     def allMatchingPlans(self, goals):
-        matches = []
-        for plan in self.plans:
-            if self.numMatchingGoals(plan, goals) > 0:
-                matches.append(plan)
-        matches.sort(key = lambda plan: -self.numMatchingGoals(plan, goals) + len(plan.goals) * 0.001)
+        counts = self._plansByGoals(goals, True)
+        matches = list(counts)
+        matches.sort(key = lambda plan: -counts[plan] + len(plan.goals) * 0.001)
         return matches
 
     #returns a plan whose goalset contains all given goals. If more than one plan does, returns one of those with minimum extraneous goals. Ties are broken arbitrarily. If there is no candidate, returns None.
     def getMatchingPlan(self, goals):
+        goals = list(goals)
+        if goals:
+            counts = self._plansByGoals(goals, False)
+            candidates = [plan for plan in counts if counts[plan] == len(goals)]
+        else:
+            candidates = self.plans
         bestChoice = None
-        for plan in self.plans:
-            goalMissing = False
-            for goal in goals:
-                found = False
-                for planGoal in plan.goals:
-                    #print "goal is " + str([goal])
-                    if self.consistentGoal(goal, planGoal):
-                        found = True
-                        break
-                if not found:
-                    goalMissing = True
-                    break
-            if not goalMissing:
-                if not bestChoice:
-                    bestChoice = plan
-                elif len(bestChoice.goals) > len(plan.goals):
-                    bestChoice = plan
+        for plan in candidates:
+            if not bestChoice:
+                bestChoice = plan
+            elif len(bestChoice.goals) > len(plan.goals):
+                bestChoice = plan
         return bestChoice
 
     #returns the plan, if any is available, that achieves the most goals in the given goalset. If more than one does, tries to achieve the fewest extraneous goals. Ties are broken arbitrarily. Returns None if no plan is found that achieves any of the given goals.
@@ -231,16 +457,7 @@ class GoalGraph:
     def getBestPlan(self, goals):
         bestChoice = None
         bestNumAchieved = 0
-        for plan in self.plans:
-            numAchieved = 0
-            for goal in goals:
-                found = False
-                for planGoal in plan.goals:
-                    if self.consistentGoal(goal, planGoal):
-                        found = True
-                        break
-                if found:
-                    numAchieved += 1
+        for plan, numAchieved in self._plansByGoals(goals, False).items():
             #check if the current plan achieves more goals than the best so far
             if numAchieved > bestNumAchieved:
                 bestChoice = plan
@@ -251,24 +468,14 @@ class GoalGraph:
         return bestChoice
 
     def _getAllNodes(self):
-        visited = set()
-        nodes = list(self.roots)
-        while nodes:
-            next = nodes.pop(0)
-            if next in visited:
-                continue
-            else:
-                visited.add(next)
-            for child in next.children:
-                nodes.append(child)
-        return visited
+        return set(self.nodeIndex)
 
     def getAllGoals(self):
         visited = set()
         goals = []
-        nodes = list(self.roots)
+        nodes = collections.deque(self.roots)
         while nodes:
-            next = nodes.pop(0)
+            next = nodes.popleft()
             if next in visited:
                 continue
             else:
@@ -278,29 +485,21 @@ class GoalGraph:
                 nodes.append(child)
         return goals
 
-    #returns the first node such that self.consistentGoal(goal, node.goal) returns True.
+    #returns the oldest node such that self.consistentGoal(goal, node.goal) returns True.
     def _getGoalNode(self, goal):
-        visited = set()
-        nodes = list(self.roots)
-        while nodes:
-            next = nodes.pop(0)
-            if next in visited:
-                continue
-            else:
-                visited.add(next)
-            if self.consistentGoal(goal, next.goal):
-                return next
-            for child in next.children:
-                nodes.append(child)
-        return None #not in graph
+        found = None
+        for node in self.nodeIndex.candidates(goal):
+            if (not found or node.id < found.id) and self.consistentGoal(goal, node.goal):
+                found = node
+        return found #None if not in graph
 
     def getGoalAncestors(self, goal):
         node = self._getGoalNode(goal)
         if node:
             ancestors = set()
-            nodes = [node]
+            nodes = collections.deque([node])
             while nodes:
-                next = nodes.pop(0)
+                next = nodes.popleft()
                 if next in ancestors:
                     continue
                 for parent in next.parents:
@@ -311,8 +510,8 @@ class GoalGraph:
             raise ValueError("Goal not in graph")
 
     def __contains__(self, goal):
-        for _goal in self.getAllGoals():
-            if self.sameGoal(goal, _goal):
+        for node in self.nodeIndex.candidates(goal, True):
+            if self.sameGoal(goal, node.goal):
                 return True
         return False
 
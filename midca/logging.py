@@ -2,21 +2,72 @@ from __future__ import print_function
 from datetime import datetime
 import os, sys, copy
 import platform, string
+import atexit, collections, json, threading, time, weakref
+
+#buffered loggers are flushed by one shared daemon thread, and whatever they still hold is written at exit
+_loggers = weakref.WeakSet()
+_loggersLock = threading.Lock()
+_flusher = None
+
+#the loop only holds loggers while flushing them, so unused ones can still be collected
+def _flushDue():
+    now = time.time()
+    for logger in list(_loggers):
+        if now - logger.lastFlush >= logger.flushInterval:
+            logger.flush()
+
+def _flushWait():
+    return min([logger.flushInterval for logger in _loggers] or [1.0])
+
+def _flushLoop():
+    while True:
+        time.sleep(_flushWait())
+        _flushDue()
+
+def _addLogger(logger):
+    global _flusher
+    with _loggersLock:
+        _loggers.add(logger)
+        if _flusher is None:
+            _flusher = threading.Thread(target = _flushLoop, name = "MIDCA log flusher")
+            _flusher.daemon = True
+            _flusher.start()
+
+@atexit.register
+def _closeLoggers():
+    for logger in list(_loggers):
+        logger.close()
 
 class Logger:
 
     logFolderOptions = ["log", "_log"]
 
-    def __init__(self, keys = [], filesStayOpen = False, verbose=2):
+    def __init__(self, keys = [], filesStayOpen = False, verbose=2, buffered = True,
+                 flushInterval = 1.0, bufferSize = 1000, maxEvents = 10000, jsonEvents = False):
         '''
         creates a new logger for a MIDCA run. The folder where the individual log files will be stored will be named based on the current date/time. It will be placed in ./log/, which will be created if it does not exist.
 
         Keys are both the filenames of actual log files and keys that will be passed to the logger to tell it where to log things. If no keys are passed in the default key will be "log"
+
+        If buffered is True, lines are collected per key and written to the files in batches by a background thread (shared by all loggers) every flushInterval seconds, or as soon as bufferSize lines are waiting. Call flush() to write them immediately; close() (also called at exit) writes what is left. If buffered is False, every line is written as it is logged.
+
+        Only the last maxEvents events are kept in self.events (all of them if maxEvents is None). If jsonEvents is True, every event is also written to the file "events.jsonl", one JSON object per line.
         '''
         self.keys = keys
         self.filesStayOpen = filesStayOpen
         self.verbose = verbose
         self.files = None
+        self.buffered = buffered
+        self.flushInterval = flushInterval
+        self.bufferSize = bufferSize
+        self.maxEvents = maxEvents
+        self.jsonEvents = jsonEvents
+        self.jsonKey = "events.jsonl"
+        self.buffers = {}
+        self.pending = 0
+        self.bufferLock = threading.Lock()
+        self.flushLock = threading.Lock()
+        self.lastFlush = time.time()
 
     def start(self):
         '''
@@ -24,7 +75,7 @@ class Logger:
         '''
 
         this_os = platform.platform()
-        self.events = []
+        self.events = collections.deque(maxlen = self.maxEvents)
         self.defaultKey = "log"
         self.working = False
         self.startTime = datetime.now()
@@ -81,7 +132,10 @@ class Logger:
                 if self.verbose > 0: print("Logger: logging this run in " + self.thisRunDir, file = sys.stderr)
             if not self.filesStayOpen:
                 for file in self.files.values():
-                    file.close()
+                    if file:
+                        file.close()
+            if self.working and self.buffered:
+                _addLogger(self)
 
     def openFile(self, key):
         f = open(os.path.join(self.thisRunDir, key), 'a')
@@ -110,8 +164,21 @@ class Logger:
             deltaTStr = deltaTStr.lstrip(":0") + " - "
             for key in keys:
                 self._write(deltaTStr + str(event), key)
+        if self.jsonEvents:
+            self._write(self.eventJson(event), self.jsonKey)
         self.events.append(event)
 
+    def eventJson(self, event):
+        '''
+        Returns event as a line of JSON: its type, its time in seconds since the start of the run, the keys it was logged to and, if it is loggable, its text.
+        '''
+        keys = getattr(event, 'keys', [])
+        record = {"type": event.__class__.__name__,
+                  "time": (event.time - self.startTime).total_seconds(),
+                  "keys": keys if isinstance(keys, basestring) else list(keys),
+                  "text": str(event) if event.loggable else None}
+        return json.dumps(record, default = str)
+
     def log(self, val, keys = []):
         if isinstance(val, basestring):
             self._user_log(val, keys)
@@ -123,6 +190,30 @@ class Logger:
     def _write(self, txt, key):
         if not self.working:
             return
+        if self.buffered:
+            with self.bufferLock:
+                self.buffers.setdefault(key, []).append(txt)
+                self.pending += 1
+                full = self.pending >= self.bufferSize
+            if full:
+                self.flush()
+        else:
+            self._writeLines([txt], key)
+
+    def flush(self):
+        '''
+        Writes all buffered lines to their files.
+        '''
+        with self.flushLock:
+            with self.bufferLock:
+                buffers, self.buffers = self.buffers, {}
+                self.pending = 0
+                self.lastFlush = time.time()
+            for key, lines in buffers.items():
+                self._writeLines(lines, key)
+
+    def _writeLines(self, lines, key):
+        txt = "\n".join(lines)
         if key not in self.files or not self.files[key] or self.files[key].closed:
             try:
                 self.openFile(key)
@@ -139,8 +230,18 @@ class Logger:
         if self.verbose > 0: print("Logger: trying to write " + txt + " to file " + filename + "; got error " + str(e), file = sys.stderr)
 
     def close(self):
+        _loggers.discard(self)
+        if self.files is None:
+            return
+        self.flush()
         for f in self.files.values():
-            f.close()
+            if f:
+                f.close()
+
+    #a logger that is dropped without close() still writes its buffered lines
+    def __del__(self):
+        if getattr(self, "buffers", None):
+            self.flush()
 
     def logOutput(self):
         StdoutDirector(self)
@@ -1,6 +1,229 @@
 from midca.logging import Event
 from midca.trace import CogTrace
-import threading
+import copy
+import thread, threading
+import cPickle as pickle
+
+class History(object):
+
+	'''
+	A bounded, list-like history of values. Only the newest capacity values are kept, in a
+	ring buffer, so append() and indexing (e.g. history[-1]) take constant time. When a
+	value is pushed out by a newer one it is dropped or, if spill is a file name, pickled
+	to the end of that file; spilled() reads those values back, oldest first.
+	len(history) is the number of values kept and total the number ever appended.
+	'''
+
+	def __init__(self, capacity, items = (), spill = None):
+		if capacity < 1:
+			raise ValueError("History capacity must be at least 1, got " + str(capacity))
+		self.capacity = capacity
+		self.spill = spill
+		self.buffer = [None] * capacity
+		self.start = 0
+		self.size = 0
+		self.total = 0
+		self.spillFile = None
+		for item in items:
+			self.append(item)
+
+	def append(self, val):
+		if self.size < self.capacity:
+			self.buffer[(self.start + self.size) % self.capacity] = val
+			self.size += 1
+		else:
+			old = self.buffer[self.start]
+			self.buffer[self.start] = val
+			self.start = (self.start + 1) % self.capacity
+			if self.spill:
+				self._spill(old)
+		self.total += 1
+
+	def extend(self, items):
+		for item in items:
+			self.append(item)
+
+	def pop(self):
+		if not self.size:
+			raise IndexError("pop from empty history")
+		self.size -= 1
+		i = (self.start + self.size) % self.capacity
+		val = self.buffer[i]
+		self.buffer[i] = None
+		self.total -= 1
+		return val
+
+	def _index(self, i):
+		if i < 0:
+			i += self.size
+		if not 0 <= i < self.size:
+			raise IndexError("history index out of range")
+		return (self.start + i) % self.capacity
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return list(self)[i]
+		return self.buffer[self._index(i)]
+
+	def __setitem__(self, i, val):
+		self.buffer[self._index(i)] = val
+
+	def __len__(self):
+		return self.size
+
+	def __iter__(self):
+		for i in range(self.size):
+			yield self.buffer[(self.start + i) % self.capacity]
+
+	def __reversed__(self):
+		for i in range(self.size - 1, -1, -1):
+			yield self.buffer[(self.start + i) % self.capacity]
+
+	def __eq__(self, other):
+		if isinstance(other, (History, list, tuple)):
+			return list(self) == list(other)
+		return NotImplemented
+
+	def __ne__(self, other):
+		eq = self.__eq__(other)
+		return eq if eq is NotImplemented else not eq
+
+	__hash__ = None
+
+	def __str__(self):
+		return str(list(self))
+
+	__repr__ = __str__
+
+	def _spill(self, val):
+		if not self.spillFile:
+			self.spillFile = open(self.spill, "ab")
+		pickle.dump(val, self.spillFile, pickle.HIGHEST_PROTOCOL)
+		self.spillFile.flush()
+
+	def spilled(self):
+		'''
+		Yields the values that were spilled to disk, oldest first.
+		'''
+		if not self.spill:
+			return
+		try:
+			f = open(self.spill, "rb")
+		except IOError:
+			return
+		with f:
+			while True:
+				try:
+					yield pickle.load(f)
+				except EOFError:
+					return
+
+	def close(self):
+		if self.spillFile:
+			self.spillFile.close()
+			self.spillFile = None
+
+	#the open spill file is not copied; copies spill to the same file
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["spillFile"] = None
+		return state
+
+	def __deepcopy__(self, memo):
+		new = History.__new__(History)
+		new.__dict__.update(self.__getstate__())
+		new.buffer = copy.deepcopy(self.buffer, memo)
+		return new
+
+class MemoryJournal:
+
+	'''
+	A log of the changes made to a Memory, from which its knowledge at any checkpoint can
+	be rebuilt. It keeps the knowledge the memory had when the journal was started, then
+	only the changes: values stored with set() (lists are copied, since they can be
+	appended to later), values appended with add(), removals, and shallow copies of
+	values changed in place through update(), update_all() or get_and_lock()/unlock().
+	Values changed in place without going through memory are not seen.
+	Start one with Memory.startJournal().
+	'''
+
+	def __init__(self, knowledge):
+		self.base = {key: self._value(val) for key, val in knowledge.items()}
+		self.changes = [] #changes since each checkpoint, one list per checkpoint
+		self.current = []
+		self.cached = None #(checkpoint, knowledge) of the last rebuilt checkpoint
+
+	def _value(self, val):
+		if isinstance(val, (list, History)):
+			return list(val)
+		return val
+
+	def set(self, structname, val):
+		self.current.append(("set", structname, self._value(val)))
+
+	def changed(self, structname, val):
+		if not isinstance(val, (list, History)):
+			val = copy.copy(val)
+		self.set(structname, val)
+
+	def add(self, structname, val, capacity = None):
+		self.current.append(("add", structname, (val, capacity)))
+
+	def remove(self, structname):
+		self.current.append(("remove", structname, None))
+
+	def clear(self):
+		self.current.append(("clear", None, None))
+
+	def checkpoint(self):
+		'''
+		Ends the current checkpoint and returns its index.
+		'''
+		self.changes.append(self.current)
+		self.current = []
+		return len(self.changes) - 1
+
+	def __len__(self):
+		return len(self.changes)
+
+	def knowledge(self, i):
+		'''
+		Returns a new dict with the knowledge the memory had at checkpoint i. Rebuilding
+		replays the changes since the closest earlier checkpoint that was rebuilt, so going
+		through checkpoints in order costs only the changes between them.
+		'''
+		if i < 0:
+			i += len(self.changes)
+		if not 0 <= i < len(self.changes):
+			raise IndexError("journal checkpoint out of range")
+		if self.cached and self.cached[0] <= i:
+			start, knowledge = self.cached
+			knowledge = dict(knowledge)
+			start += 1
+		else:
+			start, knowledge = 0, dict(self.base)
+		for changes in self.changes[start:i + 1]:
+			for op, structname, val in changes:
+				if op == "set":
+					knowledge[structname] = val
+				elif op == "add":
+					val, capacity = val
+					old = knowledge.get(structname)
+					if structname not in knowledge:
+						new = [val]
+					elif isinstance(old, list):
+						new = old + [val] #lists are shared between rebuilt checkpoints
+					else:
+						new = [old, val]
+					if capacity:
+						new = new[-capacity:]
+					knowledge[structname] = new
+				elif op == "remove":
+					knowledge.pop(structname, None)
+				else:
+					knowledge.clear()
+		self.cached = (i, knowledge)
+		return dict(knowledge)
 
 class Memory:
 	
@@ -78,25 +301,81 @@ class Memory:
     	ACTUAL_SCORE = "__actual score"
     	EXPECTED_COST= "__expected cost"
     	ACTUAL_COST= "__actual cost"
+    	PROFILE = "__profile"
+
+	#default capacity of the STATES and ACTIONS histories
+	HISTORY_CAPACITY = 400
 
 	def __init__(self, args = {}):
 		self.knowledge = {}
-		self.update(args)
 		self.logger = None
+		self.profiler = None
+		self.journal = None
 		self.mainLock = threading.Lock() #to synchronize lock creation
 		self.locks = {} #lock for each key
+		self.histories = {} #(capacity, spill file) for each history key
 		self.logEachAccess = True
 		#MetaCognitive Variables
 		self.metaEnabled = False
 		self.myMidca = None # pointer to MIDCA object
 		self.trace = False	
+		self.declare_history(self.STATES, self.HISTORY_CAPACITY)
+		self.declare_history(self.ACTIONS, self.HISTORY_CAPACITY)
+		self.update(args)
 
-	#Handles structs with custom update methods, dict update by dict or tuple, list append, and simple assignment.
-	def _update(self, structname, val):
+	def declare_history(self, structname, capacity, spill = None):
+		'''
+		Makes structname a history key: lists added or set under it are stored as a History
+		that keeps only the newest capacity values (see History), so modules can keep
+		calling add() without trimming. If capacity is None, structname is stored as a
+		plain list again.
+		'''
+		with self._lock(structname):
+			if capacity is None:
+				self.histories.pop(structname, None)
+				if isinstance(self.knowledge.get(structname), History):
+					self.knowledge[structname] = list(self.knowledge[structname])
+			else:
+				self.histories[structname] = (capacity, spill)
+				if structname in self.knowledge:
+					val = self.knowledge[structname]
+					if isinstance(val, History):
+						val = list(val)
+					self.knowledge[structname] = self._history(structname, val)
+
+	def _history(self, structname, val):
+		'''
+		Returns val as a History if structname is a history key and val is a list.
+		'''
+		if structname in self.histories and isinstance(val, list):
+			capacity, spill = self.histories[structname]
+			return History(capacity, val, spill)
+		return val
+
+	def startJournal(self):
+		'''
+		Starts recording changes to this memory in a MemoryJournal, and returns it.
+		'''
+		self.journal = MemoryJournal(self.knowledge)
+		return self.journal
+
+	def _capacity(self, structname):
+		if structname in self.histories:
+			return self.histories[structname][0]
+		return None
+
+	def _lock(self, structname):
+		'''
+		Returns the lock that guards structname, creating it if there is none.
+		'''
 		with self.mainLock:
 			if structname not in self.locks:
 				self.locks[structname] = threading.Lock()
-		with self.locks[structname]:
+			return self.locks[structname]
+
+	#Handles structs with custom update methods, dict update by dict or tuple, list append, and simple assignment.
+	def _update(self, structname, val):
+		with self._lock(structname):
 			if not structname in self.knowledge:
 				self.knowledge[structname] = val
 			elif self.knowledge[structname].__class__.__name__ == "dict":
@@ -108,6 +387,8 @@ class Memory:
 				self.knowledge[structname].update(val) #generic update
 			else:
 				self.knowledge[structname] = val #assignment
+			if self.journal is not None:
+				self.journal.changed(structname, self.knowledge[structname])
 			self.logAccess(structname)
 
 	def add(self, structname, val):
@@ -117,24 +398,22 @@ class Memory:
 		is stored with no append method, will create a two-item list with the previously
 		stored item and val.
 		'''
-		with self.mainLock:
-			if structname not in self.locks:
-				self.locks[structname] = threading.Lock()
-		with self.locks[structname]:
+		with self._lock(structname):
 			if not structname in self.knowledge:
-				self.knowledge[structname] = [val]
+				self.knowledge[structname] = self._history(structname, [val])
 			elif hasattr(self.knowledge[structname], "append"):
 				self.knowledge[structname].append(val)
 			else:
-				self.knowledge[structname] = [self.knowledge[structname], val]
+				self.knowledge[structname] = self._history(structname, [self.knowledge[structname], val])
+			if self.journal is not None:
+				self.journal.add(structname, val, self._capacity(structname))
 			self.logAccess(structname)
 
 	def set(self, structname, val):
-		with self.mainLock:
-			if structname not in self.locks:
-				self.locks[structname] = threading.Lock()
-		with self.locks[structname]:
-			self.knowledge[structname] = val
+		with self._lock(structname):
+			self.knowledge[structname] = self._history(structname, val)
+			if self.journal is not None:
+				self.journal.set(structname, val)
 			self.logAccess(structname)
 
 	def update(self, args):
@@ -142,10 +421,7 @@ class Memory:
 			self._update(structname, val)
 
 	def update_all(self, structname, val):
-		with self.mainLock:
-			if structname not in self.locks:
-				self.locks[structname] = threading.Lock()
-		with self.locks[structname]:
+		with self._lock(structname):
 			if structname in self.knowledge and (not isinstance(self.knowledge[structname], basestring)):
 				struct = self.knowledge[structname]
 				if hasattr(struct, "__getitem__") or hasattr(struct, "__iter__"):
@@ -154,21 +430,24 @@ class Memory:
 							item.update(val)
 				elif hasattr(struct, "update"):
 					struct.update(val)
+				if self.journal is not None:
+					self.journal.changed(structname, struct)
 			self.logAccess(structname)
 
 	def remove(self, structname):
-		with self.mainLock:
-			if structname not in self.locks:
-				self.locks[structname] = threading.Lock()
-		with self.locks[structname]:
+		with self._lock(structname):
 			self.logAccess(structname)
 			if structname in self.knowledge:
 				del self.knowledge[structname]
-				del self.locks[structname]
+				self.locks.pop(structname, None)
+				if self.journal is not None:
+					self.journal.remove(structname)
 
 	def clear(self):
 		self.knowledge.clear()
 		self.locks.clear()
+		if self.journal is not None:
+			self.journal.clear()
 
 	def get(self, structname):
 		with self.mainLock:
@@ -189,6 +468,8 @@ class Memory:
 			val = self.knowledge[structname]
 			del self.knowledge[structname]
 			del self.locks[structname]
+			if self.journal is not None:
+				self.journal.remove(structname)
 			return val
 
 	def get_and_lock(self, structname):
@@ -202,6 +483,8 @@ class Memory:
 		return self.knowledge[structname]
 
 	def unlock(self, structname):
+		if self.journal is not None and structname in self.knowledge:
+			self.journal.changed(structname, self.knowledge[structname])
 		try:
 			self.locks[structname].release()
 		except KeyError:
@@ -210,7 +493,13 @@ class Memory:
 	def enableLogging(self, logger):
 		self.logger = logger
 
+	def enableProfiling(self, profiler):
+		self.profiler = profiler
+		self.set(self.PROFILE, profiler)
+
 	def logAccess(self, key):
+		if self.profiler:
+			self.profiler.memAccess(key)
 		if self.logger and self.logEachAccess:
 			self.logger.logEvent(MemAccessEvent(key))
 
@@ -224,6 +513,81 @@ class Memory:
 		if not self.trace:
 			self.trace = CogTrace()
 
+class FastMemory(Memory):
+
+	'''
+	A Memory with the same interface that does not lock plain reads and writes made by the
+	thread that owns it (the thread that created it, usually the one running the cycle).
+	get() and set() from the owner are single dict operations, which are atomic under the
+	GIL, so they skip the key's lock unless a thread holds the key through get_and_lock().
+	Accesses from any other thread (e.g. ROS callbacks), and read-modify-write operations
+	such as add(), update() and get_and_clear() from any thread, always take the key's lock,
+	so concurrent adds are never lost.
+	Select it with MIDCA(memoryClass = FastMemory) or PhaseManager(memoryClass = FastMemory).
+	'''
+
+	def __init__(self, args = {}):
+		self.owner = thread.get_ident()
+		self.held = set() #keys locked through get_and_lock()
+		Memory.__init__(self, args)
+
+	def _lock(self, structname):
+		lock = self.locks.get(structname)
+		if lock is None:
+			with self.mainLock:
+				lock = self.locks.setdefault(structname, threading.Lock())
+		return lock
+
+	def _fast(self, structname):
+		return thread.get_ident() == self.owner and structname not in self.held
+
+	def set(self, structname, val):
+		if not self._fast(structname):
+			return Memory.set(self, structname, val)
+		if self.journal is not None:
+			self.journal.set(structname, val)
+		if structname in self.histories:
+			val = self._history(structname, val)
+		self.knowledge[structname] = val
+		if self.profiler or (self.logger and self.logEachAccess):
+			self.logAccess(structname)
+
+	def get(self, structname):
+		if self._fast(structname):
+			if self.profiler or (self.logger and self.logEachAccess):
+				self.logAccess(structname)
+			return self.knowledge.get(structname)
+		with self._lock(structname):
+			self.logAccess(structname)
+			return self.knowledge.get(structname)
+
+	def get_and_clear(self, structname):
+		#the key's lock is kept, so threads waiting on it still exclude each other
+		with self._lock(structname):
+			self.logAccess(structname)
+			val = self.knowledge.pop(structname, None)
+			if self.journal is not None:
+				self.journal.remove(structname)
+			return val
+
+	def remove(self, structname):
+		with self._lock(structname):
+			self.logAccess(structname)
+			if structname in self.knowledge:
+				del self.knowledge[structname]
+				if self.journal is not None:
+					self.journal.remove(structname)
+
+	def get_and_lock(self, structname):
+		self._lock(structname).acquire()
+		self.held.add(structname)
+		self.logAccess(structname)
+		return self.knowledge.get(structname)
+
+	def unlock(self, structname):
+		self.held.discard(structname)
+		Memory.unlock(self, structname)
+
 class MemAccessEvent(Event):
 
 	def __init__(self, keyAccessed):
@@ -337,10 +337,10 @@ class MRSimpleDetect(base.BaseModule):
                 #print "Now creating the new operator"
                 #print "new op str is now: "
                 #print str(new_move_op_str)
-                worldsim_op = domainread.load_operator_str(new_move_op_str)
+                worldsim_op = domainread.load_operator_str(new_move_op_str, self.world)
                 #print "We now have worldsim op "+str(worldsim_op)
                 #print "Adding it into the world"
-                self.world.operators[worldsim_op.name] = worldsim_op    
+                self.world.add_operator(worldsim_op)
                 #print "Saving world into memory"    
                 #self.mem.add(self.mem.STATES, self.world)
                 self.already_switched_moveeast = True
@@ -0,0 +1,247 @@
+'''
+Grounding engine for the worldsim-based planners.
+
+A GroundingIndex instantiates every operator of a domain once, for every binding of
+objects that could ever make it applicable, and records which atoms each ground action
+needs to be true (or false). Predicates that no operator changes are static: their
+preconditions are resolved during grounding through the world's atom indexes instead of
+being checked again in every search node, so operators such as move(agent, start, dest)
+are only grounded for adjacent tiles.
+
+An Applicability object tracks, for one state, how many of each ground action's
+remaining preconditions are unsatisfied. The applicability of a successor state is
+derived from its parent's by updating only the counts of the actions that mention an
+atom the last action changed, so finding applicable actions costs time proportional to
+the change rather than to the space of possible bindings.
+
+Usage:
+    index = GroundingIndex(world)
+    app = index.applicability(world)
+    for action in app.applicable_actions():
+        child = world.copy()
+        child.apply(action)
+        childApp = app.successor(action, world, child)
+
+The index is only valid while the domain's operators, objects and static atoms stay the
+same; GroundingIndex.valid_for(world) checks this.
+'''
+
+import itertools
+
+class GroundingIndex:
+
+    def __init__(self, world):
+        self.operators = dict(world.operators)
+        self.objectNames = frozenset(world.objects)
+        self.static = static_predicates(world)
+        self.staticAtoms = self._static_atoms(world)
+        self.actions = []
+        #atom -> indices of the ground actions with that atom as a positive/negative precondition
+        self.positive = {}
+        self.negative = {}
+        #number of dynamic preconditions each ground action has
+        self.numPositive = []
+        for opname in sorted(self.operators):
+            for action in ground_operator(world, self.operators[opname], self.static):
+                self._add_action(action)
+
+    def _static_atoms(self, world):
+        atoms = set()
+        for predname in self.static:
+            atoms.update(world.atoms.by_predicate(predname))
+        return frozenset(atoms)
+
+    def _add_action(self, action):
+        index = len(self.actions)
+        self.actions.append(action)
+        numPositive = 0
+        for i in range(len(action.preconds)):
+            atom = action.preconds[i]
+            if atom.predicate.name in self.static:
+                continue
+            if action.prePos[i]:
+                self.positive.setdefault(atom, []).append(index)
+                numPositive += 1
+            else:
+                self.negative.setdefault(atom, []).append(index)
+        self.numPositive.append(numPositive)
+
+    def valid_for(self, world):
+        '''
+        Returns whether this index was built for the same operators, objects and static
+        atoms as world has.
+        '''
+        return self.operators == world.operators and \
+            self.objectNames == frozenset(world.objects) and \
+            self.staticAtoms == self._static_atoms(world)
+
+    def applicability(self, world):
+        '''
+        Returns the Applicability of every ground action in world.
+        '''
+        counts = list(self.numPositive)
+        for atom in world.atoms:
+            for index in self.positive.get(atom, ()):
+                counts[index] -= 1
+            for index in self.negative.get(atom, ()):
+                counts[index] += 1
+        applicable = set([index for index in range(len(counts)) if counts[index] == 0])
+        return Applicability(self, counts, applicable)
+
+    def __len__(self):
+        return len(self.actions)
+
+class Applicability:
+
+    '''
+    Unsatisfied precondition counts of every ground action of a GroundingIndex in one
+    state, plus the set of actions whose count is zero.
+    '''
+
+    def __init__(self, index, counts, applicable):
+        self.index = index
+        self.counts = counts
+        self.applicable = applicable
+
+    def applicable_actions(self):
+        '''
+        Returns the applicable ground actions, in grounding order.
+        '''
+        actions = self.index.actions
+        return [actions[i] for i in sorted(self.applicable)]
+
+    def successor(self, action, before, after):
+        '''
+        Returns the Applicability of world after, which is world before with action
+        applied. Only the atoms in action's results are examined.
+        '''
+        added = []
+        removed = []
+        for atom in set(action.results):
+            wasTrue = atom in before.atoms
+            if atom in after.atoms:
+                if not wasTrue:
+                    added.append(atom)
+            elif wasTrue:
+                removed.append(atom)
+        return self.changed(added, removed)
+
+    def changed(self, added, removed):
+        '''
+        Returns the Applicability after the atoms in added became true and the atoms in
+        removed became false.
+        '''
+        counts = list(self.counts)
+        applicable = set(self.applicable)
+        positive = self.index.positive
+        negative = self.index.negative
+        for atom in added:
+            for index in positive.get(atom, ()):
+                counts[index] -= 1
+                if counts[index] == 0:
+                    applicable.add(index)
+            for index in negative.get(atom, ()):
+                counts[index] += 1
+                applicable.discard(index)
+        for atom in removed:
+            for index in positive.get(atom, ()):
+                counts[index] += 1
+                applicable.discard(index)
+            for index in negative.get(atom, ()):
+                counts[index] -= 1
+                if counts[index] == 0:
+                    applicable.add(index)
+        return Applicability(self.index, counts, applicable)
+
+def static_predicates(world):
+    '''
+    Returns the names of the predicates that no operator in world has as a result.
+    '''
+    changed = set()
+    for operator in world.operators.values():
+        for condition in operator.resultorder:
+            changed.add(condition.atom.predicate.name)
+    return set(world.predicates) - changed
+
+def _arg_types(operator):
+    types = {}
+    for condition in operator.precondorder:
+        for i in range(len(condition.atom.args)):
+            name = condition.atom.args[i].name
+            if name not in types and condition.argtypes:
+                types[name] = condition.argtypes[i]
+    return types
+
+def _bind_static(world, conditions, binding, types):
+    '''
+    Yields every extension of binding that makes all conditions (positive, static) true
+    in world.
+    '''
+    if not conditions:
+        yield binding
+        return
+    condition = conditions[0]
+    varnames = [arg.name for arg in condition.atom.args]
+    pattern = [binding.get(name, "?") for name in varnames]
+    for atom in world.query(condition.atom.predicate.name, pattern):
+        extended = dict(binding)
+        consistent = True
+        for i in range(len(varnames)):
+            obj = world.objects.get(atom.args[i].name)
+            if obj is None or (varnames[i] in types and not obj.is_a(types[varnames[i]])):
+                consistent = False
+                break
+            bound = extended.setdefault(varnames[i], obj.name)
+            if bound != obj.name:
+                consistent = False
+                break
+        if consistent:
+            for result in _bind_static(world, conditions[1:], extended, types):
+                yield result
+
+def ground_operator(world, operator, static = None):
+    '''
+    Returns a list of the instantiations of operator (worldsim Actions with their args
+    set) that can be applicable in some state reachable by applying operators to world.
+    Positive static preconditions bind arguments through world.query, the remaining
+    arguments range over all objects of their type, and bindings that violate a static
+    precondition are dropped.
+    '''
+    if static is None:
+        static = static_predicates(world)
+    types = _arg_types(operator)
+    staticPos = []
+    staticNeg = []
+    for i in range(len(operator.precondorder)):
+        condition = operator.precondorder[i]
+        if condition.atom.predicate.name in static:
+            if operator.prePos[i]:
+                staticPos.append(condition)
+            else:
+                staticNeg.append(condition)
+    #most selective (fewest true atoms) static conditions first
+    staticPos.sort(key = lambda condition: len(world.atoms.by_predicate(condition.atom.predicate.name)))
+    candidates = {}
+    for name in operator.objnames:
+        if name in types:
+            candidates[name] = [obj.name for obj in world.get_objects_by_type(types[name])]
+        else:
+            candidates[name] = sorted(world.objects)
+    actions = []
+    for binding in _bind_static(world, staticPos, {}, types):
+        free = [name for name in operator.objnames if name not in binding]
+        for values in itertools.product(*[candidates[name] for name in free]):
+            full = dict(binding)
+            full.update(zip(free, values))
+            violated = False
+            for condition in staticNeg:
+                if world.is_true(condition.atom.predicate.name, [full[arg.name] for arg in condition.atom.args]):
+                    violated = True
+                    break
+            if violated:
+                continue
+            args = [world.objects[full[name]] for name in operator.objnames]
+            action = operator.instantiate(args)
+            action.set_args(args)
+            actions.append(action)
+    return actions
@@ -0,0 +1,185 @@
+'''
+Plan cache for the pyhop-based planners.
+
+A PlanCache remembers the plans a planner produced, keyed by the goals it planned for
+and the world state it planned from, so that a planner that is asked to plan for the
+same goals from the same state again (which happens often in long experiments, where
+plans are invalidated and the same goals replanned every few cycles) can reuse the old
+plan instead of searching again.
+
+Keys are built from strings only (goal arguments and atom names), so they are the same
+in every run and a cache can be saved to disk and loaded again to warm-start later
+runs. If predicates is given, only atoms of those predicates are part of the state key;
+the caller must make sure that atoms of other predicates do not change the plans.
+
+Usage:
+    cache = PlanCache(size = 1000, path = "plans.cache")
+    key = cache.key(goals, world)
+    plan = cache.get(key)
+    if plan is None:
+        plan = <plan for goals>
+        cache.put(key, plan)
+    ...
+    cache.flush()
+
+A cache with a path is written to it by flush() or close() (and when the process exits),
+or every saveEvery plans added, not on every put(). Each save goes through a temporary
+file of its own, so processes that share a cache file never leave a half-written file
+in its place; the last one to save wins. A file that cannot be read is ignored.
+
+Plans are stored as lists of pyhop action tuples, e.g. [("stack", "A", "B")].
+'''
+
+import atexit
+import collections
+import hashlib
+import os
+import tempfile
+import cPickle as pickle
+
+def goal_signature(goals):
+    '''
+    Returns a canonical, order-independent signature of a goal or collection of goals.
+    Goals with the same arguments and keyword arguments have the same signature,
+    whatever their ids.
+    '''
+    if not isinstance(goals, collections.Iterable):
+        goals = [goals]
+    signature = []
+    for goal in goals:
+        args = tuple([str(arg) for arg in goal.args])
+        kwargs = tuple(sorted([(str(k), str(v)) for k, v in goal.kwargs.items() if k != 'id']))
+        signature.append((args, kwargs))
+    return tuple(sorted(signature))
+
+def state_signature(world, predicates = None):
+    '''
+    Returns a digest of the atoms true in world, or only of those of the given
+    predicates. Worlds with the same (relevant) atoms have the same signature.
+    '''
+    if predicates is None:
+        keys = [atom.key for atom in world.atoms]
+    else:
+        keys = [atom.key for predicate in predicates for atom in world.atoms.by_predicate(predicate)]
+    return hashlib.sha1(repr(sorted(keys))).hexdigest()
+
+class PlanCache:
+
+    '''
+    A bounded map from (goals, state) keys to plans. When more than size plans are
+    stored, the least recently used one is evicted. hits, misses and evictions count
+    lookups that found a plan, lookups that did not, and evicted plans. If path is
+    given, the cache is loaded from that file if it exists, and written back to it by
+    flush(), when the process exits, and, if saveEvery is positive, every saveEvery
+    plans added.
+    '''
+
+    def __init__(self, size = 1000, path = None, predicates = None, saveEvery = 0):
+        self.size = size
+        self.path = path
+        self.predicates = predicates
+        self.saveEvery = saveEvery
+        self.plans = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.unsaved = 0
+        if path:
+            if os.path.exists(path):
+                self.load()
+            atexit.register(self.close)
+
+    def __len__(self):
+        return len(self.plans)
+
+    def key(self, goals, world):
+        '''
+        Returns the key for planning for goals from world, or None if world has no
+        atoms to build a key from.
+        '''
+        if not hasattr(world, "atoms"):
+            return None
+        return (goal_signature(goals), state_signature(world, self.predicates))
+
+    def get(self, key):
+        '''
+        Returns a copy of the plan stored under key, or None if there is none.
+        '''
+        if key is not None and key in self.plans:
+            self.hits += 1
+            plan = self.plans.pop(key)
+            self.plans[key] = plan
+            return list(plan)
+        self.misses += 1
+        return None
+
+    def put(self, key, plan):
+        if key is None:
+            return
+        self.plans.pop(key, None)
+        self.plans[key] = [tuple(action) for action in plan]
+        self._evict()
+        self.unsaved += 1
+        if self.path and self.saveEvery and self.unsaved >= self.saveEvery:
+            self.save()
+
+    def remove(self, key):
+        self.plans.pop(key, None)
+
+    def clear(self):
+        self.plans.clear()
+
+    def _evict(self):
+        while len(self.plans) > self.size:
+            self.plans.popitem(last = False)
+            self.evictions += 1
+
+    def flush(self):
+        '''
+        Writes the cache to its path if plans were added since it was last saved.
+        '''
+        if self.path and self.unsaved:
+            self.save()
+
+    def close(self):
+        self.flush()
+
+    def save(self, path = None):
+        '''
+        Writes the cached plans to path (by default, the cache's own path). The plans are
+        written to a new temporary file in the same directory, which then replaces the
+        file in one step, so an interrupted run or another process saving at the same
+        time leaves a complete file.
+        '''
+        path = path or self.path
+        directory, name = os.path.split(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(prefix = name + ".", suffix = ".tmp", dir = directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(self.plans.items(), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        if path == self.path:
+            self.unsaved = 0
+
+    def load(self, path = None):
+        '''
+        Adds the plans saved in path (by default, the cache's own path) to this cache.
+        Returns False, adding nothing, if the file cannot be read or is not a saved cache.
+        '''
+        try:
+            with open(path or self.path, "rb") as f:
+                items = [(key, plan) for key, plan in pickle.load(f)]
+        except Exception:
+            return False
+        for key, plan in items:
+            self.plans[key] = plan
+        self._evict()
+        return True
+
+    def stats(self):
+        return {"size": len(self.plans), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
@@ -49,6 +49,19 @@ Pyhop provides the following classes and functions:
   (a list of tasks), starting from an initial state state1, using whatever
   methods and operators you declared previously.
 
+- pyhop(state1,tasklist,undo=True) plans the same way, but instead of copying
+  the state before every operator it applies operators in place and reverts
+  them from an undo log when it backtracks. See UndoState.
+
+- pyhop_iter(state1,tasklist,max_depth=d,max_expansions=n,max_time=t) finds
+  the same plan as pyhop, but without recursion and within the given limits.
+  It returns the plan (or False) and a dict of search statistics.
+
+- pyhop(state1,tasklist,memo=table), where table is a TranspositionTable,
+  remembers which (state, tasks) subproblems failed or were solved, so they
+  are not searched again, also in later calls with the same table. pyhop_iter
+  takes the same argument.
+
 - In the above call to pyhop, you can add an optional 3rd argument called
   'verbose' that tells pyhop how much debugging printout it should provide:
 - if verbose = 0, then pyhop prints nothing;
@@ -101,7 +114,7 @@ Pyhop provides the following classes and functions:
 
 
 from __future__ import print_function
-import copy,sys, pprint
+import copy,sys, pprint, time, collections
 
 ############################################################
 # States and goals
@@ -139,6 +152,335 @@ def print_goal(goal,indent=4):
                 print(' =', val)
     else: print('False')
 
+############################################################
+# Undo logging, for planning without copying the state
+
+_MISSING = object()
+
+class UndoLog():
+    """
+    A list of reversible changes to a state. mark() returns a position in the
+    log, and undo(mark) reverts every change made since then, newest first.
+    """
+    def __init__(self):
+        self.entries = []
+
+    def mark(self):
+        return len(self.entries)
+
+    def record(self, revert, *args):
+        self.entries.append((revert, args))
+
+    def undo(self, mark):
+        entries = self.entries
+        while len(entries) > mark:
+            revert, args = entries.pop()
+            revert(*args)
+
+def _revert_attr(state, name, old):
+    if old is _MISSING:
+        del state.__dict__[name]
+    else:
+        state.__dict__[name] = old
+
+def _revert_item(d, key, old):
+    if old is _MISSING:
+        dict.__delitem__(d, key)
+    else:
+        dict.__setitem__(d, key, old)
+
+class UndoDict(dict):
+    """A dict that records its changes in an UndoLog."""
+    def __init__(self, log, items=()):
+        dict.__init__(self, items)
+        self._log = log
+
+    def __setitem__(self, key, value):
+        self._log.record(_revert_item, self, key, dict.get(self, key, _MISSING))
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        old = dict.__getitem__(self, key)
+        self._log.record(_revert_item, self, key, old)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        if key in self:
+            old = dict.__getitem__(self, key)
+            del self[key]
+            return old
+        return dict.pop(self, key, *default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._log.record(_revert_item, self, key, value)
+        return key, value
+
+    def __deepcopy__(self, memo):
+        return dict((copy.deepcopy(k, memo), copy.deepcopy(v, memo)) for k, v in self.items())
+
+def _revert_set(s, added, removed):
+    set.difference_update(s, added)
+    set.update(s, removed)
+
+class UndoSet(set):
+    """A set that records its changes in an UndoLog."""
+    def __init__(self, log, items=()):
+        set.__init__(self, items)
+        self._log = log
+
+    def _record(self, added, removed):
+        if added or removed:
+            self._log.record(_revert_set, self, added, removed)
+
+    def add(self, item):
+        if item not in self:
+            self._record((item,), ())
+            set.add(self, item)
+
+    def discard(self, item):
+        if item in self:
+            self._record((), (item,))
+            set.discard(self, item)
+
+    def remove(self, item):
+        if item not in self:
+            raise KeyError(item)
+        self.discard(item)
+
+    def pop(self):
+        item = set.pop(self)
+        self._record((), (item,))
+        return item
+
+    def clear(self):
+        self._record((), tuple(self))
+        set.clear(self)
+
+    def update(self, *others):
+        for other in others:
+            for item in other:
+                self.add(item)
+
+    def difference_update(self, *others):
+        for other in others:
+            for item in list(other):
+                self.discard(item)
+
+    def __deepcopy__(self, memo):
+        return set(copy.deepcopy(item, memo) for item in self)
+
+def _revert_list(l, old):
+    list.__setitem__(l, slice(None), old)
+
+class UndoList(list):
+    """
+    A list that records its changes in an UndoLog. Each change saves a copy
+    of the whole list, so these should be short.
+    """
+    def __init__(self, log, items=()):
+        list.__init__(self, items)
+        self._log = log
+
+    def _save(self):
+        self._log.record(_revert_list, self, list(self))
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(item, memo) for item in self]
+
+def _undo_mutator(name):
+    method = getattr(list, name)
+    def mutator(self, *args):
+        self._save()
+        return method(self, *args)
+    mutator.__name__ = name
+    return mutator
+
+for _name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', '__setslice__', '__delslice__',
+              'append', 'extend', 'insert', 'pop', 'remove', 'reverse', 'sort']:
+    if hasattr(list, _name):
+        setattr(UndoList, _name, _undo_mutator(_name))
+
+def _undoable(value, log):
+    if type(value) is dict:
+        return UndoDict(log, value)
+    if type(value) is set:
+        return UndoSet(log, value)
+    if type(value) is list:
+        return UndoList(log, value)
+    return value
+
+class UndoState(State):
+    """
+    A state whose changes are recorded in an UndoLog, so a planner can apply
+    operators to it in place and revert them when it backtracks. Assigning a
+    state variable, and changing a dict, set or list that is the value of a
+    state variable, are recorded, which covers the existing operators as they
+    are written. Containers nested inside those values are not tracked and
+    should be replaced rather than changed by operators.
+    """
+    def __init__(self, name, log):
+        self.__dict__['_log'] = log
+        self.__dict__['__name__'] = name
+
+    def __setattr__(self, name, value):
+        self._log.record(_revert_attr, self, name, self.__dict__.get(name, _MISSING))
+        self.__dict__[name] = _undoable(value, self._log)
+
+    def __delattr__(self, name):
+        self._log.record(_revert_attr, self, name, self.__dict__[name])
+        del self.__dict__[name]
+
+    def __deepcopy__(self, memo):
+        new = State(self.__name__)
+        for (name,val) in vars(self).items():
+            if name not in ('_log', '__name__'):
+                setattr(new, name, copy.deepcopy(val, memo))
+        return new
+
+def undo_state(state, log):
+    """
+    Returns an UndoState recording into log with the same variables as state,
+    which is not changed.
+    """
+    new = UndoState(getattr(state, '__name__', 'state'), log)
+    for (name,val) in vars(state).items():
+        if name not in ('_log', '__name__'):
+            new.__dict__[name] = _undoable(copy.deepcopy(val), log)
+    return new
+
+############################################################
+# Transposition table, for not searching the same subproblem twice
+
+def _freeze(value):
+    """
+    Returns a hashable value equal to the frozen forms of values equal to
+    value. States and goals (e.g. a pyhop.Goal passed as a task argument) are
+    frozen by their variables, so a goal built anew each cycle matches the
+    same subproblems. Raises TypeError if value holds something unhashable
+    that is not a State, Goal, dict, set, list or tuple.
+    """
+    if isinstance(value, (State, Goal)):
+        kind = "Goal" if isinstance(value, Goal) else "State"
+        return (kind, _freeze(dict((k, v) for k, v in vars(value).items() if k != '_log')))
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    hash(value)
+    return value
+
+class TranspositionTable():
+    """
+    Remembers the outcome of searching for a plan for a list of tasks from a
+    state: False if there is none, or the plan found, if plans is True. The
+    planner looks a subproblem up before searching it and prunes it if it is
+    known. At most size subproblems are kept; the least recently used are
+    dropped first. hits, misses and evictions count lookups that found a
+    subproblem, lookups that did not, and subproblems dropped.
+
+    A state is identified by its fingerprint() method if it has one (see
+    worldsim.World.fingerprint), and otherwise by its variables, or only by
+    the variables named in variables if that is given. The caller must make
+    sure the other variables do not matter to the methods and operators.
+    Subproblems whose state or tasks cannot be made hashable are not kept.
+    States and goals among the task arguments are compared by their
+    variables; other task arguments without a value-based hash are compared
+    by identity. The
+    table assumes the methods and operators do not change while it is in
+    use; call clear() if they do.
+    """
+    def __init__(self, size=10000, variables=None, plans=True):
+        self.size = size
+        self.variables = variables
+        self.plans = plans
+        self.table = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.table)
+
+    def clear(self):
+        self.table.clear()
+
+    def fingerprint(self, state):
+        if hasattr(state, 'fingerprint'):
+            return state.fingerprint()
+        if self.variables is not None:
+            return tuple(_freeze(getattr(state, name, None)) for name in self.variables)
+        return frozenset((name, _freeze(val)) for (name,val) in vars(state).items()
+                         if name not in ('_log', '__name__'))
+
+    def key(self, state, tasks):
+        """Returns the key of a subproblem, or None if it cannot be kept."""
+        try:
+            return (self.fingerprint(state), _freeze(tasks))
+        except TypeError:
+            return None
+
+    def get(self, key):
+        """
+        Returns False if the subproblem with this key has no plan, the rest of
+        the plan for it if one is known, or None if it is not in the table.
+        """
+        if key in self.table:
+            self.hits += 1
+            found = self.table.pop(key)
+            self.table[key] = found
+            return found
+        self.misses += 1
+        return None
+
+    def store(self, key, solution, plan):
+        """
+        Records the result of a search: solution is False or a plan that
+        extends plan, the partial plan the subproblem was searched with.
+        """
+        if key is None:
+            return
+        if solution is False:
+            found = False
+        elif self.plans:
+            found = solution[len(plan):]
+        else:
+            return
+        self.table.pop(key, None)
+        self.table[key] = found
+        if len(self.table) > self.size:
+            self.table.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {'size': len(self.table), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+def _memo_lookup(memo, state, tasks, depth, verbose):
+    """Returns the key of the subproblem and what memo knows about it."""
+    key = memo.key(state, tasks)
+    found = None
+    if key is not None:
+        found = memo.get(key)
+        if verbose>2 and found is not None:
+            print('depth {} memo returns {}'.format(depth,found))
+    return key, found
+
 ############################################################
 # Helper functions that may be useful in domain models
 
@@ -196,13 +538,21 @@ def print_methods(mlist=methods):
 ############################################################
 # The actual planner
 
-def pyhop(state,tasks,verbose=0):
+def pyhop(state,tasks,verbose=0,undo=False,memo=None):
     """
     Try to find a plan that accomplishes tasks in state. 
     If successful, return the plan. Otherwise return False.
+    If undo is True, operators are applied in place to an UndoState copy of
+    state instead of to a fresh copy each time (see seek_plan_undo).
+    If memo is a TranspositionTable, subproblems it knows are not searched
+    again, and the ones searched are added to it.
     """
     if verbose>0: print('** pyhop:\n   state = {}\n   tasks = {}'.format(state.__name__,tasks))
-    result = seek_plan(state,tasks,[],0,verbose)
+    if undo:
+        log = UndoLog()
+        result = seek_plan_undo(undo_state(state,log),tasks,[],0,log,verbose,memo)
+    else:
+        result = seek_plan(state,tasks,[],0,verbose,memo)
     if verbose>0: print('** result =',result,'\n')
     return result
 
@@ -212,17 +562,23 @@ def copy_state(state):
     except AttributeError:
         return copy.deepcopy(state)
 
-def seek_plan(state,tasks,plan,depth,verbose=0):
+def seek_plan(state,tasks,plan,depth,verbose=0,memo=None):
     """
     Workhorse for pyhop. state and tasks are as in pyhop.
     - plan is the current partial plan.
     - depth is the recursion depth, for use in debugging
     - verbose is whether to print debugging messages
+    - memo is None or a TranspositionTable
     """
     if verbose>1: print('depth {} tasks {}'.format(depth,tasks))
     if tasks == []:
         if verbose>2: print('depth {} returns plan {}'.format(depth,plan))
         return plan
+    key = None
+    if memo is not None:
+        key, found = _memo_lookup(memo,state,tasks,depth,verbose)
+        if found is not None:
+            return found if found is False else plan+found
     task1 = tasks[0]
     if task1[0] in operators:
         if verbose>2: print('depth {} action {}'.format(depth,task1))
@@ -232,8 +588,9 @@ def seek_plan(state,tasks,plan,depth,verbose=0):
             print('depth {} new state:'.format(depth))
             print_state(newstate)
         if newstate:
-            solution = seek_plan(newstate,tasks[1:],plan+[task1],depth+1,verbose)
+            solution = seek_plan(newstate,tasks[1:],plan+[task1],depth+1,verbose,memo)
             if solution != False:
+                if key is not None: memo.store(key,solution,plan)
                 return solution
     if task1[0] in methods:
         if verbose>2: print('depth {} method instance {}'.format(depth,task1))
@@ -244,8 +601,175 @@ def seek_plan(state,tasks,plan,depth,verbose=0):
             if verbose>2:
                 print('depth {} new tasks: {}'.format(depth,subtasks))
             if subtasks != False:
-                solution = seek_plan(state,subtasks+tasks[1:],plan,depth+1,verbose)
+                solution = seek_plan(state,subtasks+tasks[1:],plan,depth+1,verbose,memo)
                 if solution != False:
+                    if key is not None: memo.store(key,solution,plan)
                     return solution
+    if key is not None: memo.store(key,False,plan)
     if verbose>2: print('depth {} returns failure'.format(depth))
     return False
+
+def seek_plan_undo(state,tasks,plan,depth,log,verbose=0,memo=None):
+    """
+    Same as seek_plan, except that operators change state in place and every
+    change is recorded in log, an UndoLog; when a branch fails, its changes are
+    undone before the next one is tried. state should be an UndoState (see
+    undo_state). When a plan is found, state is left as the plan leaves it,
+    unless the end of the plan was taken from memo.
+    """
+    if verbose>1: print('depth {} tasks {}'.format(depth,tasks))
+    if tasks == []:
+        if verbose>2: print('depth {} returns plan {}'.format(depth,plan))
+        return plan
+    key = None
+    if memo is not None:
+        key, found = _memo_lookup(memo,state,tasks,depth,verbose)
+        if found is not None:
+            return found if found is False else plan+found
+    task1 = tasks[0]
+    if task1[0] in operators:
+        if verbose>2: print('depth {} action {}'.format(depth,task1))
+        operator = operators[task1[0]]
+        mark = log.mark()
+        newstate = operator(state,*task1[1:])
+        if verbose>2:
+            print('depth {} new state:'.format(depth))
+            print_state(newstate)
+        if newstate:
+            solution = seek_plan_undo(newstate,tasks[1:],plan+[task1],depth+1,log,verbose,memo)
+            if solution != False:
+                if key is not None: memo.store(key,solution,plan)
+                return solution
+        log.undo(mark)
+    if task1[0] in methods:
+        if verbose>2: print('depth {} method instance {}'.format(depth,task1))
+        relevant = methods[task1[0]]
+        for method in relevant:
+            mark = log.mark()
+            subtasks = method(state,*task1[1:])
+            # Can't just say "if subtasks:", because that's wrong if subtasks == []
+            if verbose>2:
+                print('depth {} new tasks: {}'.format(depth,subtasks))
+            if subtasks != False:
+                solution = seek_plan_undo(state,subtasks+tasks[1:],plan,depth+1,log,verbose,memo)
+                if solution != False:
+                    if key is not None: memo.store(key,solution,plan)
+                    return solution
+            log.undo(mark)
+    if key is not None: memo.store(key,False,plan)
+    if verbose>2: print('depth {} returns failure'.format(depth))
+    return False
+
+############################################################
+# Iterative planner with limits
+
+def _successors(state,task1,tasks,plan,depth,log,verbose):
+    """
+    Generates the nodes (state, tasks, plan, depth) that seek_plan would
+    recurse into for the node whose first task is task1, in the same order.
+    With an UndoLog, each node's changes to state are undone when the next
+    one is asked for.
+    """
+    if task1[0] in operators:
+        if verbose>2: print('depth {} action {}'.format(depth,task1))
+        operator = operators[task1[0]]
+        if log:
+            mark = log.mark()
+            newstate = operator(state,*task1[1:])
+        else:
+            newstate = operator(copy_state(state),*task1[1:])
+        if verbose>2:
+            print('depth {} new state:'.format(depth))
+            print_state(newstate)
+        if newstate:
+            yield (newstate,tasks[1:],plan+[task1],depth+1)
+        if log:
+            log.undo(mark)
+    if task1[0] in methods:
+        if verbose>2: print('depth {} method instance {}'.format(depth,task1))
+        for method in methods[task1[0]]:
+            if log:
+                mark = log.mark()
+            subtasks = method(state,*task1[1:])
+            # Can't just say "if subtasks:", because that's wrong if subtasks == []
+            if verbose>2:
+                print('depth {} new tasks: {}'.format(depth,subtasks))
+            if subtasks != False:
+                yield (state,subtasks+tasks[1:],plan,depth+1)
+            if log:
+                log.undo(mark)
+
+def pyhop_iter(state,tasks,verbose=0,undo=False,max_depth=None,max_expansions=None,max_time=None,memo=None):
+    """
+    Same search as pyhop, using an explicit stack instead of recursion, so
+    long plans do not run into Python's recursion limit. The search can be
+    limited:
+    - max_depth: nodes deeper than this are not expanded (as if they failed)
+    - max_expansions: the search stops after expanding this many nodes
+    - max_time: the search stops after this many seconds
+    None means no limit. Returns (plan, stats), where plan is False if no plan
+    was found, and stats is a dict with the number of nodes 'expanded', the
+    number of 'backtracks', the deepest 'depth' reached, the 'time' taken, and
+    'stopped', which names the limit that ended the search, if any
+    ('max_expansions' or 'max_time'), or is None. 'depth_cutoffs' counts the
+    nodes left unexpanded because of max_depth.
+    memo is used as in pyhop. A subproblem is only recorded as failed if the
+    limits did not cut off any part of its search.
+    """
+    if verbose>0: print('** pyhop_iter:\n   state = {}\n   tasks = {}'.format(state.__name__,tasks))
+    t0 = time.time()
+    stats = {'expanded': 0, 'backtracks': 0, 'depth': 0, 'time': 0, 'stopped': None, 'depth_cutoffs': 0}
+    log = None
+    if undo:
+        log = UndoLog()
+        state = undo_state(state,log)
+    result = False
+    stack = []
+    node = (state,tasks,[],0)
+    while True:
+        nstate, ntasks, nplan, ndepth = node
+        if verbose>1: print('depth {} tasks {}'.format(ndepth,ntasks))
+        if ntasks == []:
+            if verbose>2: print('depth {} returns plan {}'.format(ndepth,nplan))
+            result = nplan
+            break
+        key = found = None
+        if memo is not None:
+            key, found = _memo_lookup(memo,nstate,ntasks,ndepth,verbose)
+        if found is False:
+            pass
+        elif found is not None:
+            result = nplan+found
+            break
+        elif max_depth is not None and ndepth >= max_depth:
+            stats['depth_cutoffs'] += 1
+        else:
+            if max_expansions is not None and stats['expanded'] >= max_expansions:
+                stats['stopped'] = 'max_expansions'
+                break
+            if max_time is not None and time.time() - t0 >= max_time:
+                stats['stopped'] = 'max_time'
+                break
+            stats['expanded'] += 1
+            stats['depth'] = max(stats['depth'], ndepth)
+            stack.append((_successors(nstate,ntasks[0],ntasks,nplan,ndepth,log,verbose),
+                          key, nplan, stats['depth_cutoffs']))
+        node = None
+        while stack and node is None:
+            try:
+                node = next(stack[-1][0])
+            except StopIteration:
+                _, key, nplan, cutoffs = stack.pop()
+                if key is not None and cutoffs == stats['depth_cutoffs']:
+                    memo.store(key,False,nplan)
+                stats['backtracks'] += 1
+                if verbose>2: print('depth {} returns failure'.format(len(stack)))
+        if node is None:
+            break
+    if result is not False and memo is not None:
+        for _, key, nplan, cutoffs in stack:
+            if key is not None:
+                memo.store(key,result,nplan)
+    stats['time'] = time.time() - t0
+    if verbose>0: print('** result =',result,'\n')
+    return result, stats
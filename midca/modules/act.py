@@ -116,7 +116,7 @@ class SimpleAct(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
             trace.add_data("PLAN", copy.deepcopy(plan))
 
@@ -140,11 +140,6 @@ class SimpleAct(base.BaseModule):
                         # print the whole plan
                         print "Selected action", action, "from plan:\n", plan
                 self.mem.add(self.mem.ACTIONS, [action])
-                actions = self.mem.get(self.mem.ACTIONS)
-                if len(actions) > 400:
-                    actions = actions[200:] # trim off old stale actions
-                    self.mem.set(self.mem.ACTIONS, actions)
-                    #print "Trimmed off 200 old stale actions to save space"
                 plan.advance()
 
                 if trace: trace.add_data("ACTION", action)
@@ -206,7 +201,7 @@ class SimpleAct_temporary(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle, self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
             trace.add_data("PLAN", copy.deepcopy(plan))
 
@@ -230,11 +225,6 @@ class SimpleAct_temporary(base.BaseModule):
                         # print the whole plan
                         print "Selected action", action, "from plan:\n", plan
                 self.mem.add(self.mem.ACTIONS, [action])
-                actions = self.mem.get(self.mem.ACTIONS)
-                if len(actions) > 400:
-                    actions = actions[200:]  # trim off old stale actions
-                    self.mem.set(self.mem.ACTIONS, actions)
-                    # print "Trimmed off 200 old stale actions to save space"
                 plan.advance()
 
                 if trace: trace.add_data("ACTION", action)
@@ -283,7 +273,7 @@ class NBeaconsSimpleAct(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
             trace.add_data("PLAN", copy.deepcopy(plan))
 
@@ -61,7 +61,7 @@ class SimpleEval(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
 
         goals_changed = False # for trace
@@ -113,7 +113,7 @@ class SimpleEval2(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
 
         goals_changed = False # for trace
@@ -205,7 +205,7 @@ class SimpleEval_Restaurant(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
 
         goals_changed = False # for trace
@@ -271,7 +271,7 @@ class SimpleEval_construction(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
 
 	# this variable is to skip one eval phase, when the building gets completed
@@ -754,7 +754,7 @@ class NBeaconsDataRecorder:
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
 
         goals_changed = False # for trace
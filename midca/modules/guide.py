@@ -639,9 +639,9 @@ class SimpleMortarGoalGen_construction(base.BaseModule):
 	index = b[2]
 	self.curr_goal_sets = b[0]
 	for each in self.curr_goal_sets:
-		for goal in each:
+		for i, goal in enumerate(each):
 			if goal["predicate"] == "on":
-				goal["predicate"] = "stable-on"
+				each[i] = goal.replace("predicate", "stable-on")
 	print("THE BUILDINGS ARE: ")
 	print("[")
 	for i in index:
@@ -784,7 +784,7 @@ class SimpleMortarGoalGen_construction(base.BaseModule):
             # update trace
             trace.add_data("NEXT GOAL(s)", goal_set)
             trace.add_data("GOAL GRAPH", copy.deepcopy(self.mem.GOAL_GRAPH))
-	    trace.add_data("WORLD",copy.deepcopy(self.world))
+	    trace.add_data("WORLD", self.world)
         else:
             trace.add_data("NEXT GOAL", 'goals not empty; no goal chosen')
             trace.add_data("GOAL GRAPH", copy.deepcopy(self.mem.GOAL_GRAPH))
@@ -128,23 +128,13 @@ class PerfectObserver(base.BaseModule):
             raise Exception("World observation failed.")
         self.mem.add(self.mem.STATES, world)
         
-        # Memory Usage Optimization (optional, feel free to comment
-        # drop old memory states if not being used
-        # this should help with high memory costs
-        states = self.mem.get(self.mem.STATES)
-        if len(states) > 400:
-            #print "trimmed off 200 old stale states"
-            states = states[200:]
-            self.mem.set(self.mem.STATES, states)
-        # End Memory Usage Optimization
-        
         if verbose >= 1:
             print "World observed."
         
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle, self.__class__.__name__)
-            trace.add_data("WORLD",copy.deepcopy(world))
+            trace.add_data("WORLD", world)
 
 class PerfectObserverWithThief(base.BaseModule):
 
@@ -191,23 +181,13 @@ class PerfectObserverWithThief(base.BaseModule):
          			
         self.mem.add(self.mem.STATES, world) 
         
-        # Memory Usage Optimization (optional, feel free to comment
-        # drop old memory states if not being used
-        # this should help with high memory costs
-        states = self.mem.get(self.mem.STATES)
-        if len(states) > 400:
-            #print "trimmed off 200 old stale states"
-            states = states[200:]
-            self.mem.set(self.mem.STATES, states)
-        # End Memory Usage Optimization
-        
         if verbose >= 1:
             print "World observed."
         
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle, self.__class__.__name__)
-            trace.add_data("WORLD",copy.deepcopy(world))
+            trace.add_data("WORLD", world)
         
         
 
@@ -3,12 +3,14 @@ from _plan import modified_pyhop
 from midca import plans, base
 from midca.modules._plan.asynch import asynch
 from midca.modules._plan.jShop import JSHOP, JSHOP2
+from midca.modules._plan import grounding
 from midca.modules._plan.pyhop import print_state,  print_methods, print_operators
 import collections
 import traceback
 import copy
 import time
 import itertools
+import heapq
 
 
 class GenericPyhopPlanner(base.BaseModule):
@@ -21,10 +23,21 @@ class GenericPyhopPlanner(base.BaseModule):
     'declare_operators' methods as arguments. These should initialize pyhop for the
     desired planning domain. The plan_validator arg should be a method which takes a
     world state and a plan as args and returns whether the plan should be used. This will
-    only be called on old plans that are retrieved.
+    only be called on old plans that are retrieved. If undo is True, pyhop applies
+    operators to the state in place and undoes them when it backtracks, instead of
+    copying the state for every operator (see pyhop.UndoState).
+    max_depth, max_expansions and max_time (seconds) bound the planning done in each
+    cycle; if any is set, plans are found with pyhop.pyhop_iter, and the statistics of
+    the last search are kept in search_stats. None means no limit. If memo_size is set,
+    the planner keeps a pyhop.TranspositionTable of that size across cycles, so
+    subproblems that failed or were solved before are not searched again. plan_cache can
+    be a plancache.PlanCache; new plans are stored in it and reused when the same goals
+    are planned for from the same world state and plan_validator accepts them. Without a
+    plan_validator, cached plans could not be checked, so the cache is not used.
     '''
 
-    def __init__(self, declare_methods, declare_operators, declare_monitors=None, plan_validator = None):
+    def __init__(self, declare_methods, declare_operators, declare_monitors=None, plan_validator = None, undo = False,
+                 max_depth = None, max_expansions = None, max_time = None, memo_size = None, plan_cache = None):
         try:
             declare_methods()
             declare_operators()
@@ -37,6 +50,15 @@ class GenericPyhopPlanner(base.BaseModule):
             traceback.print_exc()
             self.working = False
         self.validate_plan = plan_validator
+        self.undo = undo
+        self.max_depth = max_depth
+        self.max_expansions = max_expansions
+        self.max_time = max_time
+        self.search_stats = {}
+        self.memo = None
+        if memo_size:
+            self.memo = pyhop.TranspositionTable(memo_size)
+        self.plan_cache = plan_cache
                 #note by default (no plan validator)
         #plans execute to completion unless goals change
 
@@ -78,8 +100,29 @@ class GenericPyhopPlanner(base.BaseModule):
 
         if verbose >= 2:
             print "Planning..."
+        cacheKey = None
+        useCache = self.plan_cache is not None and self.validate_plan
+        if useCache:
+            cacheKey = self.plan_cache.key(goals, state)
+            plan = self.plan_cache.get(cacheKey)
+            if plan is not None:
+                midcaPlan = plans.Plan([plans.Action(action[0], *action[1:]) for action in plan], goals)
+                if self.validate_plan(state, midcaPlan):
+                    if verbose >= 2:
+                        print "Plan found in plan cache."
+                    return plan
+                self.plan_cache.remove(cacheKey)
         try:
-            plan = pyhop.pyhop(state, [("achieve_goals", goals)], verbose = 0)
+            if self.max_depth is None and self.max_expansions is None and self.max_time is None:
+                plan = pyhop.pyhop(state, [("achieve_goals", goals)], verbose = 0, undo = self.undo,
+                                   memo = self.memo)
+            else:
+                plan, self.search_stats = pyhop.pyhop_iter(state, [("achieve_goals", goals)], verbose = 0,
+                                                           undo = self.undo, max_depth = self.max_depth,
+                                                           max_expansions = self.max_expansions,
+                                                           max_time = self.max_time, memo = self.memo)
+                if verbose >= 2:
+                    print "Search stats:", self.search_stats
             #note: MIDCA does not convert its state and goals to pyhop state and
             #goal objects. Therefore, pyhop will not print correctly if verbose is
             #set to other than 0.
@@ -87,6 +130,8 @@ class GenericPyhopPlanner(base.BaseModule):
             if verbose >= 1:
                 print "Error in planning:", traceback.format_exc(), "\n-Planning failed."
             return None
+        if useCache and (plan or plan == []):
+            self.plan_cache.put(cacheKey, plan)
         return plan
 
     def get_new_modified_plan(self, state, goals, verbose = 2):
@@ -304,7 +349,7 @@ class JSHOP2Planner(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
 
         if not goals:
@@ -429,7 +474,7 @@ class JSHOPPlanner(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
 
         if not goals:
@@ -512,6 +557,10 @@ class PyHopPlanner(base.BaseModule):
     '''
     MIDCA module that implements a python version of the SHOP hierarchical task network (HTN) planner. HTN planners require a set of user-defined methods to generate plans; these are defined in the methods python module and declared in the constructor for this class.
     Note that this module uses has several methods to translate between MIDCA's world and goal representations and those used by pyhop; these should be changed if a new domain is introduced.
+    If undo is True, pyhop applies operators to its state in place and undoes them when it backtracks instead of copying the state for every operator.
+    max_depth, max_expansions and max_time (seconds) bound the planning done in each cycle; if any is set, plans are found with pyhop.pyhop_iter, and the statistics of the last search are kept in search_stats. None means no limit.
+    If memo_size is set, the planner keeps a pyhop.TranspositionTable of that size across cycles, so subproblems that failed or were solved before are not searched again.
+    plan_cache can be a plancache.PlanCache; plans found are stored in it, and when the planner has to plan for goals it already planned for from the same world state, the stored plan is used if it is still correct. Cache hits do not count in mem.PLANNING_COUNT.
     '''
 
     pyhop_state_from_world = None
@@ -523,10 +572,25 @@ class PyHopPlanner(base.BaseModule):
                  declare_methods,
                  declare_operators,
                  extinguishers = False,
-                 mortar = False):
+                 mortar = False,
+                 undo = False,
+                 max_depth = None,
+                 max_expansions = None,
+                 max_time = None,
+                 memo_size = None,
+                 plan_cache = None):
 
         self.pyhop_state_from_world = pyhop_state_from_world
         self.pyhop_tasks_from_goals = pyhop_tasks_from_goals
+        self.plan_cache = plan_cache
+        self.undo = undo
+        self.max_depth = max_depth
+        self.max_expansions = max_expansions
+        self.max_time = max_time
+        self.search_stats = {}
+        self.memo = None
+        if memo_size:
+            self.memo = pyhop.TranspositionTable(memo_size)
 
         try:
             declare_methods()
@@ -544,6 +608,22 @@ class PyHopPlanner(base.BaseModule):
         self.mem.set(self.mem.PLANNING_COUNT, 0)
 
 
+    def get_cached_plan(self, key, world, goals, verbose = 2):
+        '''
+        Returns the pyhop plan stored in the plan cache under key, or None if there is
+        none or it is no longer correct in world.
+        '''
+        pyhopPlan = self.plan_cache.get(key)
+        if pyhopPlan is None:
+            return None
+        midcaPlan = plans.Plan([plans.Action(action[0], *list(action[1:])) for action in pyhopPlan], goals)
+        if not world.plan_correct(midcaPlan):
+            self.plan_cache.remove(key)
+            return None
+        if verbose >= 2:
+            print "Plan found in plan cache."
+        return pyhopPlan
+
     #this will require a lot more error handling, but ignoring now for debugging.
     def run(self, cycle, verbose = 2):
         world = self.mem.get(self.mem.STATES)[-1]
@@ -554,7 +634,7 @@ class PyHopPlanner(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
 
         if not goals:
@@ -596,23 +676,40 @@ class PyHopPlanner(base.BaseModule):
             #use pyhop to generate new plan
             if verbose >= 2:
                 print "Planning..."
-            try:
-                pyhopState = self.pyhop_state_from_world(world)
-            except Exception:
-                print "Could not generate a valid pyhop state from current world state. Skipping planning"
+            cacheKey = None
+            pyhopPlan = None
+            if self.plan_cache is not None:
+                cacheKey = self.plan_cache.key(goals, world)
+                pyhopPlan = self.get_cached_plan(cacheKey, world, goals, verbose)
+            if pyhopPlan is None:
+                try:
+                    pyhopState = self.pyhop_state_from_world(world)
+                except Exception:
+                    print "Could not generate a valid pyhop state from current world state. Skipping planning"
 
-            try:
-                pyhopTasks = self.pyhop_tasks_from_goals(goals,pyhopState)
-            except Exception:
-                print "Could not generate a valid pyhop task from current goal set. Skipping planning"
-            try:
-                #print_state(pyhopState)
-                # record attempt to replann
-                self.mem.set(self.mem.PLANNING_COUNT, 1+self.mem.get(self.mem.PLANNING_COUNT))
-                pyhopPlan = pyhop.pyhop(pyhopState, pyhopTasks, verbose = 0)
-            except Exception:
+                try:
+                    pyhopTasks = self.pyhop_tasks_from_goals(goals,pyhopState)
+                except Exception:
+                    print "Could not generate a valid pyhop task from current goal set. Skipping planning"
+                try:
+                    #print_state(pyhopState)
+                    # record attempt to replann
+                    self.mem.set(self.mem.PLANNING_COUNT, 1+self.mem.get(self.mem.PLANNING_COUNT))
+                    if self.max_depth is None and self.max_expansions is None and self.max_time is None:
+                        pyhopPlan = pyhop.pyhop(pyhopState, pyhopTasks, verbose = 0, undo = self.undo,
+                                                memo = self.memo)
+                    else:
+                        pyhopPlan, self.search_stats = pyhop.pyhop_iter(pyhopState, pyhopTasks, verbose = 0,
+                                                                        undo = self.undo, max_depth = self.max_depth,
+                                                                        max_expansions = self.max_expansions,
+                                                                        max_time = self.max_time, memo = self.memo)
+                        if verbose >= 2:
+                            print "Search stats:", self.search_stats
+                except Exception:
 
-                pyhopPlan = None
+                    pyhopPlan = None
+                if self.plan_cache is not None and (pyhopPlan or pyhopPlan == []):
+                    self.plan_cache.put(cacheKey, pyhopPlan)
             if not pyhopPlan and pyhopPlan != []:
                 if verbose >= 1:
                     print "Planning failed for ",
@@ -684,7 +781,7 @@ class PyHopPlanner_temporary(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
 
         if not goals:
@@ -775,6 +872,8 @@ class HSPNode():
     parent_node = [] # an HSPNode (or None for root)
     actions_taken = [] # actions taken to reach this node (these are MIDCA actions)
     depth = 0
+    applicability = None # grounding.Applicability of world, set by grounded_decompose
+    h = None # heuristic value, set by heuristic_search
 
     def __init__(self, world, parent_node, actions_taken):
         self.world = world
@@ -785,6 +884,38 @@ class HSPNode():
             self.depth = 0
         self.actions_taken = actions_taken
 
+class HSPClosedSet():
+    '''
+    The nodes expanded by the Heuristic Search Planner, indexed by the state hash of
+    their worlds, so a decomposer can check whether a state was already expanded
+    without comparing it to every expanded world. Iterating over it yields the nodes.
+    '''
+
+    def __init__(self):
+        self.nodes = {} # state hash -> nodes with that hash
+        self.size = 0
+
+    def add(self, node):
+        self.nodes.setdefault(node.world.state_hash(), []).append(node)
+        self.size += 1
+
+    def contains_world(self, world):
+        for node in self.nodes.get(world.state_hash(), ()):
+            if world.fast_equal(node.world):
+                return True
+        return False
+
+    def __contains__(self, node):
+        return self.contains_world(node.world)
+
+    def __iter__(self):
+        for nodes in self.nodes.values():
+            for node in nodes:
+                yield node
+
+    def __len__(self):
+        return self.size
+
 class HeuristicSearchPlanner(base.BaseModule):
     '''
     Heuristic Search Planner.
@@ -792,10 +923,32 @@ class HeuristicSearchPlanner(base.BaseModule):
     When initialized, this planner needs to be provided with:
     1. Heuristic function that gives some value for a state (if none give, the depth will be the value)
     2. Decomposition function, that given a node, will return the child nodes (if none given, will be Breadth First Search)
+
+    If grounded is True, run() expands nodes with grounded_decompose() instead of the
+    NBeacons-specific decomposer.
+
+    search selects how nodes are ordered by heuristic_search(), given the heuristic
+    value h(n) and depth g(n) of each node:
+    'gbfs' (default) - greedy best first, by h(n)
+    'astar' - A*, by g(n) + h(n)
+    'wastar' - weighted A*, by g(n) + weight * h(n)
+    max_nodes and max_time (seconds) bound each search; when either runs out the search
+    fails and returns no plan. None means no limit.
     '''
 
-    def __init__(self, hn=lambda n: n.get_depth(), dn=None):
+    SEARCH_MODES = ['gbfs', 'astar', 'wastar']
+
+    def __init__(self, hn=lambda n: n.get_depth(), dn=None, grounded=False, search='gbfs', weight=1.0, max_nodes=None, max_time=None):
+        if search not in self.SEARCH_MODES:
+            raise ValueError("search must be one of " + str(self.SEARCH_MODES) + ", not " + str(search))
         self.hn = hn
+        self.grounded = grounded
+        self.grounding = None
+        self.search = search
+        self.weight = weight
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.search_stats = {}
 
     def init(self, world, mem):
         self.world = world
@@ -807,7 +960,8 @@ class HeuristicSearchPlanner(base.BaseModule):
         Returns all possible operator instantiations
         Note: If the state is more than 50 or so atoms,
               this could be a slow and expensive
-              function
+              function. grounded_decompose() avoids this
+              by grounding each operator once.
         '''
 
         # need to preserve order of elements of the following lists
@@ -1085,15 +1239,39 @@ class HeuristicSearchPlanner(base.BaseModule):
                     print str(new_world)
                     print("====== But Failed:")
 
-                already_visited = False
+                if not visited.contains_world(new_world):
+                    child =  HSPNode(new_world,node,node.actions_taken+[inst_op])
+                    child_nodes.append(child)
 
-                for w in map(lambda n: n.world, visited):
-                    if new_world.equal(w):
-                        already_visited = True
+        return child_nodes
 
-                if not already_visited:
-                    child =  HSPNode(new_world.copy(),node,node.actions_taken+[inst_op])
-                    child_nodes.append(child)
+    def get_grounding(self, world):
+        '''
+        Returns a grounding.GroundingIndex for world's domain, reusing the last one
+        built while the operators, objects and static atoms are unchanged.
+        '''
+        if self.grounding is None or not self.grounding.valid_for(world):
+            self.grounding = grounding.GroundingIndex(world)
+        return self.grounding
+
+    def grounded_decompose(self, node, visited):
+        '''
+        Same children as brute_force_decompose(), but the applicable actions come from
+        a GroundingIndex built once per domain. Each node carries the precondition
+        counts of its state, which its children update incrementally.
+        '''
+        if node.applicability is None:
+            node.applicability = self.get_grounding(node.world).applicability(node.world)
+
+        child_nodes = []
+        for inst_op in node.applicability.applicable_actions():
+            new_world = node.world.copy()
+            new_world.apply(inst_op)
+
+            if not visited.contains_world(new_world):
+                child = HSPNode(new_world, node, node.actions_taken+[inst_op])
+                child.applicability = node.applicability.successor(inst_op, node.world, new_world)
+                child_nodes.append(child)
 
         return child_nodes
 
@@ -1132,19 +1310,9 @@ class HeuristicSearchPlanner(base.BaseModule):
                     print("====== On world:")
                     print str(new_world)
                     print("====== But Failed:")
-                # check to make sure its not
-                already_visited = False
-                #print "visited = "+str(visited)
-                #print "diffs with current world = "
-                #for i in map(lambda n: new_world.diff(n.world),visited):
-                #    print "  ("+str(map(str,i[0]))+","+str(map(str,i[1]))+")"
-                for w in map(lambda n: n.world, visited):
-                    if new_world.equal(w):
-                        already_visited = True
-                #print "Already Visited is "+str(already_visited)
-                # add
-                if not already_visited:
-                    child =  HSPNode(new_world.copy(),node,node.actions_taken+[inst_op])
+                # add it unless its state was already expanded
+                if not visited.contains_world(new_world):
+                    child =  HSPNode(new_world,node,node.actions_taken+[inst_op])
                     child_nodes.append(child)
                     #print "adding child node with operator "+str(inst_op.operator.name)+" and depth "+str(child.depth)
 
@@ -1317,36 +1485,76 @@ class HeuristicSearchPlanner(base.BaseModule):
 
         return new_heuristic # now return the internal function
 
-    def heuristic_search(self, goals, decompose):
+    def priority(self, node, h):
+        '''
+        Returns the value the frontier is ordered by for a node with heuristic value h,
+        according to the search mode.
+        '''
+        if self.search == 'astar':
+            return node.depth + h
+        if self.search == 'wastar':
+            return node.depth + self.weight * h
+        return h
+
+    def heuristic_search(self, goals, decompose, heuristic=None):
+        '''
+        Best first search from self.world for a state where goals are achieved. Returns
+        the list of actions that reaches it, or [] if there is none within the limits.
+
+        The frontier is a heap ordered by priority(), ties going to the node generated
+        first. Each node's heuristic value is computed once, when it is generated. Nodes
+        with a heuristic value of INFINITY or more, and nodes with an activatebeacon
+        action that is not their last action, are never added. Expanded states go into
+        an HSPClosedSet, which is passed to decompose as visited; nodes whose state
+        has already been expanded are skipped. Counts from the last search are kept in
+        self.search_stats.
+        '''
         INFINITY = 10000
-        #print "decompose is "+str(decompose)
         t0 = time.time()
         if not decompose:
-            #print "****************using built-in***************** "
             decompose = self.brute_force_decompose
+        if not heuristic:
+            heuristic = self.nbeacons_heuristic(goals,infinity=INFINITY)
 
-        Q = [HSPNode(self.world, None, [])]
-        visited = []
+        # also remove any node that has an activate beacon action that is not the last action
+        def bad_activate(n):
+            try:
+                activate_index = map(lambda a:a.operator.name,n.actions_taken).index('activatebeacon')
+                last_element_index = len(n.actions_taken) - 1
+                return activate_index == last_element_index
+            except ValueError:
+                return True
+
+        Q = []
+        generated = itertools.count()
+        def push(n):
+            h = heuristic(n)
+            # remove any node has a score >= infinity (because it's not relevant)
+            if h < INFINITY and bad_activate(n):
+                n.h = h
+                heapq.heappush(Q, (self.priority(n, h), next(generated), n))
+
+        root = HSPNode(self.world, None, [])
+        root.h = heuristic(root)
+        heapq.heappush(Q, (self.priority(root, root.h), next(generated), root))
+        visited = HSPClosedSet()
         goal_reached_node = None
         nodes_expanded = 0
-        while len(Q) != 0:
-            # print Q
-            #print "---- Q ----"
-
-            #i = 0
-            #for n in Q:
-            #    print "  Node "+str(i)+": h(n)="+str(self.nbeacons_heuristic(goals)(n))+", actions="+str(map(lambda a:a.operator.name,n.actions_taken))+", depth = "+str(n.depth)
-            #    i+=1
-
-            # take the first node off the queue
-            curr_node = Q[0]
-            if self.verbose >=2:# or we_learned_an_op:
-                print "-- len(Q): "+str(len(Q))+", "+str(nodes_expanded)+" n, a = "+str(map(lambda a:a.operator.name,curr_node.actions_taken)) + " h(n) = "+str(self.nbeacons_heuristic(goals)(curr_node))
-
-            #print "expanding node "+str(id(curr_node))+" with depth "+str(curr_node.depth)
-            #print "Expanding node with plan "+str(map(lambda a: str(a.operator.name),curr_node.actions_taken))+" and depth "+str(curr_node.depth)
-            Q = Q[1:]
-            visited.append(curr_node)
+        limit_reached = None
+        while Q:
+            curr_node = heapq.heappop(Q)[2]
+            if visited.contains_world(curr_node.world):
+                continue
+            if self.max_nodes is not None and nodes_expanded >= self.max_nodes:
+                limit_reached = "node limit of " + str(self.max_nodes)
+                break
+            if self.max_time is not None and time.time() - t0 >= self.max_time:
+                limit_reached = "time limit of " + str(self.max_time) + "s"
+                break
+            if self.verbose >=2:
+                print "-- len(Q): "+str(len(Q))+", "+str(nodes_expanded)+" n, a = "+str(map(lambda a:a.operator.name,curr_node.actions_taken)) + " h(n) = "+str(curr_node.h)
+
+            visited.add(curr_node)
             nodes_expanded+=1
             # test if goal is reached
             if curr_node.world.goals_achieved_now(goals):
@@ -1354,28 +1562,21 @@ class HeuristicSearchPlanner(base.BaseModule):
                 break
 
             # if not, get child nodes
-            Q += decompose(curr_node, visited)
-            Q = sorted(Q,key=self.nbeacons_heuristic(goals,infinity=INFINITY))
-            # now remove any node has a score >= infinity (because it's not relevant
-            Q = filter(lambda s: self.nbeacons_heuristic(goals,infinity=INFINITY)(s) < INFINITY, Q)
-            # also remove any node that has an activate beacon action that is not the last action
-            def bad_activate(n):
-                try:
-                    activate_index = map(lambda a:a.operator.name,n.actions_taken).index('activatebeacon')
-                    last_element_index = len(n.actions_taken) - 1
-                    return activate_index == last_element_index
-                except ValueError:
-                    return True
-
-            Q = filter(lambda n: bad_activate(n), Q)
+            for child in decompose(curr_node, visited):
+                push(child)
 
+        t1 = time.time()
+        self.search_stats = {'expanded': nodes_expanded, 'generated': next(generated), 'frontier': len(Q), 'time': t1-t0}
         if goal_reached_node:
-            t1 = time.time()
             timestr = '%.5f' % (t1-t0)
             if self.verbose >= 1: print "Heuristic Search Planning took "+timestr+"s"
             return goal_reached_node.actions_taken
         else:
-            if self.verbose >= 1: print "Heuristic Search failed to produce a plan"
+            if self.verbose >= 1:
+                if limit_reached:
+                    print "Heuristic Search stopped at the "+limit_reached+" without a plan"
+                else:
+                    print "Heuristic Search failed to produce a plan"
             return []
 
     def run(self, cycle, verbose = 2):
@@ -1422,7 +1623,11 @@ class HeuristicSearchPlanner(base.BaseModule):
             self.mem.set(self.mem.PLANNING_COUNT, 1+self.mem.get(self.mem.PLANNING_COUNT))
             #print "Goals are "+str(map(str,goals))
 
-            hsp_plan = self.heuristic_search(goals, decompose=self.brute_force_decompose_nbeacons)
+            if self.grounded:
+                decompose = self.grounded_decompose
+            else:
+                decompose = self.brute_force_decompose_nbeacons
+            hsp_plan = self.heuristic_search(goals, decompose=decompose)
             if self.verbose >= 1:
                 print "planning finished: "
                 for p in hsp_plan:
@@ -69,7 +69,7 @@ class PyHopPlannerBroken(base.BaseModule):
         trace = self.mem.trace
         if trace:
             trace.add_module(cycle,self.__class__.__name__)
-            trace.add_data("WORLD", copy.deepcopy(world))
+            trace.add_data("WORLD", world)
             trace.add_data("GOALS", copy.deepcopy(goals))
             trace.add_data("PLAN", None)
 
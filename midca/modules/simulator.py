@@ -88,9 +88,14 @@ class WorldChanger:
 
 class ArsonSimulator:
 
-    def __init__(self, arsonChance = 0.5, arsonStart = 10):
+    def __init__(self, arsonChance = 0.5, arsonStart = 10, seed = None):
+        '''
+        If seed is given, arson is decided by a random number generator of its own,
+        seeded with it, so runs with the same seed set the same fires.
+        '''
         self.chance = arsonChance
         self.start = arsonStart
+        self.random = random.Random(seed) if seed is not None else random
 
     def getArsonChance(self):
         return self.chance
@@ -115,9 +120,9 @@ class ArsonSimulator:
 
     def run(self, cycle, verbose = 2):
         arsonist = self.free_arsonist()
-        if arsonist and cycle > self.start and random.random() < self.chance:
+        if arsonist and cycle > self.start and self.random.random() < self.chance:
             try:
-                block = random.choice(self.get_unlit_blocks())
+                block = self.random.choice(self.get_unlit_blocks())
                 try:
                     self.world.apply_named_action("lightonfire", [arsonist, block])
                     if verbose >= 2:
@@ -163,12 +168,15 @@ class NBeaconsSimulator:
     1. beacons becoming deactivated
     '''
 
-    def __init__(self, beacon_fail_rate=0):
+    def __init__(self, beacon_fail_rate=0, seed=None):
         '''
         beacon_fail_rate is out of 100. So 100 means 100% chance, 5 means 5% chance.
         Note this is per beacon, so each beacon has the given chance of failing
+        If seed is given, failures are decided by a random number generator of its own,
+        seeded with it, so runs with the same seed fail the same beacons.
         '''
         self.beacon_fail_rate = beacon_fail_rate
+        self.random = random.Random(seed) if seed is not None else random
 
     def init(self, world, mem):
         self.mem = mem
@@ -195,7 +203,7 @@ class NBeaconsSimulator:
 
         # for each beacon, run the fail rate
         for b_id in activated_b_ids:
-            if random.choice(range(100)) < self.beacon_fail_rate:
+            if self.random.choice(range(100)) < self.beacon_fail_rate:
                 self.world.apply_named_action("deactivatebeacon", [b_id])
                 if self.verbose >= 1:
                     print "Simulating action: deactivatebeacon(" + str(b_id) + ")"
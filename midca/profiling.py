@@ -0,0 +1,201 @@
+from __future__ import print_function
+import collections, csv, json, math, os, time
+
+"""
+Timing of MIDCA cycles, phases and modules.
+
+Profiling is off unless MIDCA.enableProfiling() (or PhaseManager.enableProfiling()) is
+called, and costs nothing but a few checks per module when it is off. When it is on,
+MIDCA.next_phase records, for every module run, every phase and every cycle, the wall
+time, the CPU time and the number of memory accesses, which are also counted per memory
+key (for each module, and in total in keyAccesses). The Profiler is also stored in
+memory under Memory.PROFILE, so modules and metamodules can query it:
+
+    profiler = mem.get(mem.PROFILE)
+    profiler.stat("module", "Plan/PyHopPlanner").mean()
+    profiler.histogram("phase", "Plan")
+
+Stats are keyed by kind ("cycle", "phase" or "module", prefixed by "meta " for the
+metacognitive phases) and name (the phase name; "<phase>/<module class>" for modules).
+They can be exported with to_csv(), to_json() and to_folded(), which writes the folded
+stack format read by flamegraph.pl and speedscope.
+"""
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+def cpu_time():
+    '''
+    Returns the user + system CPU time of this process, in seconds.
+    '''
+    if resource:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+    times = os.times()
+    return times[0] + times[1]
+
+class Stat:
+
+    '''
+    Aggregated measurements of one cycle, phase or module. hist counts runs by wall time,
+    in buckets of powers of two microseconds: hist[b] is the number of runs that took
+    less than 2 ** b microseconds, but at least 2 ** (b - 1). keys counts memory accesses
+    by key; it is only kept for modules (the innermost level measured).
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.accesses = 0
+        self.keys = collections.defaultdict(int)
+        self.min = None
+        self.max = None
+        self.hist = collections.defaultdict(int)
+
+    def add(self, wall, cpu, accesses):
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.accesses += accesses
+        if self.min is None or wall < self.min:
+            self.min = wall
+        if self.max is None or wall > self.max:
+            self.max = wall
+        micros = wall * 1000000
+        bucket = int(math.floor(math.log(micros, 2))) + 1 if micros >= 1 else 0
+        self.hist[bucket] += 1
+
+    def add_keys(self, keys):
+        for key, n in keys.items():
+            self.keys[key] += n
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.wall / self.count
+
+    def as_dict(self):
+        return {"count": self.count, "wall": self.wall, "cpu": self.cpu,
+                "accesses": self.accesses, "min": self.min, "max": self.max,
+                "mean": self.mean(), "keys": {str(key): n for key, n in self.keys.items()},
+                "histogram": {str(2 ** b): n for b, n in sorted(self.hist.items())}}
+
+class Profiler:
+
+    def __init__(self, recentCycles = 1000):
+        '''
+        recentCycles is the number of (cycle, wall, cpu, accesses) records of the latest
+        cycles kept in self.cycles, besides the aggregated stats.
+        '''
+        self.stats = collections.OrderedDict()
+        self.cycles = collections.deque(maxlen = recentCycles)
+        self.folded = collections.defaultdict(float)
+        self.accesses = 0
+        self.keyAccesses = collections.defaultdict(int)
+        self.pendingKeys = collections.defaultdict(int)
+        self.cycleMarks = {}
+
+    def memAccess(self, key):
+        self.accesses += 1
+        self.keyAccesses[key] += 1
+        self.pendingKeys[key] += 1
+
+    def mark(self):
+        '''
+        Returns the current wall time, CPU time and memory access count, to pass to record().
+        Accesses by key are counted from the latest mark.
+        '''
+        self.pendingKeys = collections.defaultdict(int)
+        return (time.time(), cpu_time(), self.accesses, self.pendingKeys)
+
+    def record(self, kind, name, mark, stack = None, childTime = 0.0):
+        '''
+        Adds the time and accesses since mark to the stat of (kind, name) and returns the
+        wall time. If no mark was made after mark, the accesses by key are added too. If
+        stack is given, the wall time less childTime (the time spent in stacks under it) is
+        also added to that folded stack.
+        '''
+        wall = time.time() - mark[0]
+        stat = self.stats.get((kind, name))
+        if stat is None:
+            stat = self.stats[(kind, name)] = Stat()
+        stat.add(wall, cpu_time() - mark[1], self.accesses - mark[2])
+        if mark[3] is self.pendingKeys:
+            stat.add_keys(mark[3])
+        if stack:
+            self.folded[stack] += wall - childTime
+        return wall
+
+    def startCycle(self, kind):
+        self.cycleMarks[kind] = self.mark()
+
+    def endCycle(self, kind, cycle):
+        mark = self.cycleMarks.pop(kind, None)
+        if mark is None:
+            return
+        self.record(kind, "cycle", mark)
+        self.cycles.append((cycle, time.time() - mark[0], cpu_time() - mark[1],
+                            self.accesses - mark[2]))
+
+    def stat(self, kind, name):
+        '''
+        Returns the Stat of (kind, name), or None if it was never recorded.
+        '''
+        return self.stats.get((kind, name))
+
+    def histogram(self, kind, name):
+        '''
+        Returns [(upper bound in seconds, count)] for the wall times of (kind, name).
+        '''
+        stat = self.stats.get((kind, name))
+        if not stat:
+            return []
+        return [(2 ** b / 1000000.0, n) for b, n in sorted(stat.hist.items())]
+
+    def summary(self, kind = None):
+        '''
+        Returns [(kind, name, Stat)], slowest first, optionally only of one kind.
+        '''
+        rows = [(k, name, stat) for (k, name), stat in self.stats.items()
+                if kind is None or k == kind]
+        return sorted(rows, key = lambda row: -row[2].wall)
+
+    def clear(self):
+        self.stats.clear()
+        self.cycles.clear()
+        self.folded.clear()
+        self.keyAccesses.clear()
+        self.cycleMarks.clear()
+
+    def to_csv(self, path):
+        with open(path, "wb") as f:
+            writer = csv.writer(f)
+            writer.writerow(["kind", "name", "count", "wall", "mean", "min", "max", "cpu",
+                             "accesses"])
+            for kind, name, stat in self.summary():
+                writer.writerow([kind, name, stat.count, stat.wall, stat.mean(), stat.min,
+                                 stat.max, stat.cpu, stat.accesses])
+            #total accesses of each memory key, most accessed first
+            for key, n in sorted(self.keyAccesses.items(), key = lambda item: -item[1]):
+                writer.writerow(["key", key, "", "", "", "", "", "", n])
+
+    def to_json(self, path):
+        stats = [dict(stat.as_dict(), kind = kind, name = name)
+                 for kind, name, stat in self.summary()]
+        with open(path, "w") as f:
+            json.dump({"stats": stats, "cycles": list(self.cycles),
+                       "keys": {str(key): n for key, n in self.keyAccesses.items()}},
+                      f, indent = 1)
+
+    def to_folded(self, path):
+        '''
+        Writes one "frame;frame;frame microseconds" line per stack, as read by
+        flamegraph.pl. Stacks are cycle;phase;module, and cycle;phase for the time a phase
+        spent outside its modules.
+        '''
+        with open(path, "w") as f:
+            for stack, wall in sorted(self.folded.items()):
+                f.write(stack + " " + str(int(round(wall * 1000000))) + "\n")
@@ -0,0 +1,89 @@
+'''
+Checks interning, equality, pickling and deep copies of worldsim.Atom. Run with
+python midca/tests/test_atoms.py.
+'''
+
+import copy
+import os
+import pickle
+import unittest
+
+from midca.worldsim import domainread, stateread, worldsim
+
+BLOCKSWORLD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "domains", "blocksworld")
+
+def load_world():
+    world = domainread.load_domain(os.path.join(BLOCKSWORLD, "domains", "arsonist_extinguish.sim"))
+    stateread.apply_state_file(world, os.path.join(BLOCKSWORLD, "states", "extinguisher_state.sim"))
+    return world
+
+class AtomTest(unittest.TestCase):
+
+    def setUp(self):
+        self.world = load_world()
+        self.atom = [atom for atom in self.world.atoms if len(atom.args) == 2][0]
+
+    def test_interned(self):
+        atom = self.atom
+        again = worldsim.Atom(atom.predicate, list(atom.args))
+        self.assertTrue(again is atom)
+        self.assertTrue(atom.predicate.instantiate(atom.args) is atom)
+
+    def test_args_are_a_tuple(self):
+        self.assertTrue(isinstance(self.atom.args, tuple))
+
+    def test_wrong_args(self):
+        self.assertRaises(Exception, worldsim.Atom, self.atom.predicate, self.atom.args[:1])
+
+    def test_equal_by_names_across_worlds(self):
+        other = load_world()
+        atoms = {str(atom): atom for atom in other.atoms}
+        for atom in self.world.atoms:
+            match = atoms[str(atom)]
+            self.assertFalse(match is atom)
+            self.assertEqual(match, atom)
+            self.assertEqual(hash(match), hash(atom))
+            self.assertEqual(match.id, atom.id)
+        self.assertEqual(set(other.atoms), set(self.world.atoms))
+
+    def test_different_atoms_differ(self):
+        ids = set(atom.id for atom in self.world.atoms)
+        self.assertEqual(len(ids), len(self.world.atoms))
+
+    def test_copy(self):
+        self.assertTrue(copy.copy(self.atom) is self.atom)
+
+    def test_deepcopy(self):
+        atom = copy.deepcopy(self.atom)
+        self.assertEqual(atom, self.atom)
+        self.assertEqual(hash(atom), hash(self.atom))
+        self.assertFalse(atom.args[0] is self.atom.args[0])
+        #the copy is interned with the copied objects
+        self.assertTrue(worldsim.Atom(atom.predicate, atom.args) is atom)
+
+    def test_deepcopy_world(self):
+        world = copy.deepcopy(self.world)
+        self.assertEqual(set(world.atoms), set(self.world.atoms))
+        for atom in world.atoms:
+            for arg in atom.args:
+                self.assertTrue(world.objects[arg.name] is arg)
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            atom = pickle.loads(pickle.dumps(self.atom, protocol))
+            self.assertEqual(atom, self.atom)
+            self.assertEqual(hash(atom), hash(self.atom))
+            self.assertEqual(str(atom), str(self.atom))
+            self.assertTrue(isinstance(atom.args, tuple))
+
+    def test_pickle_world(self):
+        world = pickle.loads(pickle.dumps(self.world, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(set(world.atoms), set(self.world.atoms))
+        for atom in world.atoms:
+            for arg in atom.args:
+                self.assertTrue(world.objects[arg.name] is arg)
+            self.assertTrue(world.predicates[atom.predicate.name] is atom.predicate)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+'''
+Checks that worldsim.atomstore.AtomStore behaves like a python set of atoms through
+copies, diffs and compaction. Run with python midca/tests/test_atomstore.py.
+'''
+
+import random
+import unittest
+
+from midca.worldsim import atomstore, worldsim
+
+def make_atoms(numObjects = 12):
+    objType = worldsim.Type("obj", [])
+    objects = [objType.instantiate("o" + str(i)) for i in range(numObjects)]
+    on = worldsim.Predicate("on", ["x", "y"], [objType, objType])
+    clear = worldsim.Predicate("clear", ["x"], [objType])
+    atoms = [worldsim.Atom(clear, [obj]) for obj in objects]
+    atoms += [worldsim.Atom(on, [a, b]) for a in objects for b in objects if a is not b]
+    return atoms
+
+class AtomStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.atoms = make_atoms()
+        self.random = random.Random(0)
+
+    def assertSame(self, store, atoms):
+        self.assertEqual(set(store), atoms)
+        self.assertEqual(len(store), len(atoms))
+        for atom in self.atoms:
+            self.assertEqual(atom in store, atom in atoms)
+        self.assertEqual(store.state_hash(), atomstore.AtomStore(atoms).state_hash())
+
+    def change(self, store, atoms, num):
+        for i in range(num):
+            atom = self.random.choice(self.atoms)
+            if self.random.random() < 0.5:
+                store.add(atom)
+                atoms.add(atom)
+            else:
+                store.discard(atom)
+                atoms.discard(atom)
+
+    def test_changes_match_set(self):
+        atoms = set(self.atoms[:40])
+        store = atomstore.AtomStore(atoms)
+        self.change(store, atoms, 2000)
+        self.assertSame(store, atoms)
+
+    def test_copies_are_independent(self):
+        atoms = set(self.atoms[:60])
+        store = atomstore.AtomStore(atoms)
+        history = []
+        for i in range(30):
+            history.append((store.copy(), set(atoms)))
+            self.change(store, atoms, 20)
+        self.assertSame(store, atoms)
+        for copy, expected in history:
+            self.assertSame(copy, expected)
+        #changing a copy leaves the store it was copied from alone
+        copy, expected = history[5]
+        self.change(copy, expected, 200)
+        self.assertSame(copy, expected)
+        self.assertSame(store, atoms)
+
+    def test_copy_does_not_compact(self):
+        store = atomstore.AtomStore(self.atoms[:10])
+        for atom in self.atoms[10:10 + atomstore.COMPACT_MIN + 2]:
+            store.add(atom)
+        base = store._base
+        store.copy()
+        self.assertTrue(store._base is base)
+
+    def test_diff(self):
+        atoms = set(self.atoms[:50])
+        store = atomstore.AtomStore(atoms)
+        for i in range(20):
+            before, beforeAtoms = store.copy(), set(atoms)
+            self.change(store, atoms, 15)
+            added, removed = store.diff(before)
+            self.assertEqual(added, atoms - beforeAtoms)
+            self.assertEqual(removed, beforeAtoms - atoms)
+            #stores without a shared base are compared as sets
+            added, removed = store.diff(atomstore.AtomStore(beforeAtoms))
+            self.assertEqual(added, atoms - beforeAtoms)
+            self.assertEqual(removed, beforeAtoms - atoms)
+
+    def test_compaction(self):
+        atoms = set(self.atoms[:20])
+        store = atomstore.AtomStore(atoms)
+        copy = store.copy()
+        self.change(store, atoms, 3000)
+        self.assertSame(store, atoms)
+        store.compact()
+        self.assertEqual(store.delta(), (set(), set()))
+        self.assertSame(store, atoms)
+        self.assertSame(copy, set(self.atoms[:20]))
+
+    def test_update(self):
+        store = atomstore.AtomStore(self.atoms[:5])
+        store.update(self.atoms[3:100])
+        self.assertSame(store, set(self.atoms[:100]))
+
+    def test_lookups(self):
+        atoms = set(self.atoms[:80])
+        store = atomstore.AtomStore(atoms)
+        self.change(store, atoms, 200)
+        self.assertEqual(set(store.by_predicate("clear")),
+                         {atom for atom in atoms if atom.predicate.name == "clear"})
+        self.assertEqual(set(store.by_object("o3")),
+                         {atom for atom in atoms if any(arg.name == "o3" for arg in atom.args)})
+        for atom in self.atoms[:30]:
+            found = store.get_exact(atom.predicate.name, [arg.name for arg in atom.args])
+            self.assertEqual(found is not None, atom in atoms)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+'''
+Checks that the .sim parser builds the same domains as the line-by-line reader it
+replaced, for every domain file shipped with MIDCA. data/sim_domains.json holds summaries
+of the domains that reader built. Run with python midca/tests/test_domainread.py.
+'''
+
+import glob
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from midca.worldsim import domainread
+
+MIDCA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXPECTED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sim_domains.json")
+
+def domain_files():
+    return sorted(glob.glob(os.path.join(MIDCA_DIR, "domains", "*", "domains", "*.sim")))
+
+def summary(world):
+    '''
+    Returns the types, predicates, operators, objects and atoms of world as JSON-ready
+    lists, in a canonical order.
+    '''
+    operators = sorted([name, list(op.objnames),
+                        [str(condition.atom) for condition in op.precondorder], list(op.prePos),
+                        [str(condition.atom) for condition in op.resultorder], list(op.postPos)]
+                       for name, op in world.operators.items())
+    predicates = sorted([name, list(pred.argnames), [type.name for type in pred.argtypes]]
+                        for name, pred in world.predicates.items())
+    types = sorted([name, sorted(ancestor.name for ancestor in type.ancestors())]
+                   for name, type in world.types.items())
+    objects = sorted([name, obj.type.name] for name, obj in world.objects.items())
+    atoms = sorted(str(atom) for atom in world.atoms)
+    return {"operators": operators, "predicates": predicates, "types": types,
+            "objects": objects, "atoms": atoms}
+
+def load_summary(path):
+    try:
+        return summary(domainread.load_domain(path))
+    except Exception as e:
+        return {"error": str(e)}
+
+class DomainReadTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(EXPECTED) as f:
+            self.expected = json.load(f)
+        self.cacheDir = domainread.CACHE_DIR
+        domainread.CACHE_DIR = tempfile.mkdtemp()
+        domainread._compiled.clear()
+
+    def tearDown(self):
+        shutil.rmtree(domainread.CACHE_DIR)
+        domainread.CACHE_DIR = self.cacheDir
+
+    def check(self):
+        names = []
+        for path in domain_files():
+            name = os.path.relpath(path, MIDCA_DIR)
+            names.append(name)
+            expected = self.expected[name]
+            if "error" in expected:
+                self.assertRaises(Exception, domainread.load_domain, path)
+            else:
+                self.assertEqual(json.loads(json.dumps(load_summary(path))), expected, name)
+        self.assertEqual(sorted(names), sorted(self.expected))
+
+    def test_same_domains(self):
+        self.check()
+
+    def test_same_domains_from_cache(self):
+        self.check()
+        self.assertTrue(os.listdir(domainread.CACHE_DIR))
+        domainread._compiled.clear()
+        self.check()
+
+if __name__ == "__main__":
+    unittest.main()
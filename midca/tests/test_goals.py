@@ -0,0 +1,121 @@
+'''
+Checks Goal keys, ids and replace(), and how GoalGraph finds goals and stored plans. Run
+with python midca/tests/test_goals.py.
+'''
+
+import copy
+import pickle
+import unittest
+
+from midca import goals, plans
+from midca.goals import Goal
+
+class GoalTest(unittest.TestCase):
+
+    def test_equal_goals(self):
+        goal = Goal("A_", "B_", predicate = "on")
+        same = Goal("A_", "B_", predicate = "on")
+        self.assertEqual(goal, same)
+        self.assertEqual(hash(goal), hash(same))
+        self.assertEqual(goal.key, same.key)
+        self.assertEqual(len({goal, same}), 1)
+        self.assertNotEqual(goal, Goal("B_", "A_", predicate = "on"))
+        self.assertNotEqual(goal, Goal("A_", "B_", predicate = "on", negate = True))
+
+    def test_kwarg_order(self):
+        self.assertEqual(Goal("A_", predicate = "onfire", negate = True).key,
+                         Goal("A_", negate = True, predicate = "onfire").key)
+
+    def test_ids(self):
+        goal = Goal("A_", "B_", predicate = "on")
+        same = Goal("A_", "B_", predicate = "on")
+        self.assertNotEqual(goal.id, same.id)
+        self.assertEqual(Goal("A_", id = 7).id, 7)
+
+    def test_immutable(self):
+        goal = Goal("A_", "B_", predicate = "on")
+        self.assertRaises(TypeError, goal.__setitem__, "predicate", "clear")
+        self.assertRaises(TypeError, goal.kwargs.__setitem__, "predicate", "clear")
+        self.assertRaises(AttributeError, setattr, goal, "args", ())
+
+    def test_replace(self):
+        goal = Goal("A_", "B_", predicate = "on")
+        changed = goal.replace("predicate", "stable-on")
+        self.assertEqual(changed, Goal("A_", "B_", predicate = "stable-on"))
+        self.assertEqual(changed.id, goal.id)
+        self.assertEqual(goal["predicate"], "on")
+        self.assertEqual(goal.replace(1, "C_"), Goal("A_", "C_", predicate = "on"))
+        self.assertEqual(goal.replace("id", 3).id, 3)
+        self.assertRaises(IndexError, goal.replace, 2, "C_")
+
+    def test_items(self):
+        goal = Goal("A_", "B_", predicate = "on")
+        self.assertEqual(goal[0], "A_")
+        self.assertEqual(goal["predicate"], "on")
+        self.assertTrue("predicate" in goal)
+        self.assertFalse("negate" in goal)
+        self.assertRaises(KeyError, goal.__getitem__, "negate")
+
+    def test_copies(self):
+        goal = Goal("A_", "B_", predicate = "on")
+        self.assertTrue(copy.copy(goal) is goal)
+        self.assertTrue(copy.deepcopy(goal) is goal)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            loaded = pickle.loads(pickle.dumps(goal, protocol))
+            self.assertEqual(loaded, goal)
+            self.assertEqual(loaded.id, goal.id)
+
+class GoalGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = goals.GoalGraph()
+        self.on = Goal("A_", "B_", predicate = "on")
+        self.fire = Goal("C_", predicate = "onfire", negate = True)
+        for goal in (self.on, self.fire):
+            self.graph.insert(goal)
+
+    def test_contains(self):
+        self.assertTrue(Goal("A_", "B_", predicate = "on") in self.graph)
+        self.assertFalse(Goal("B_", "A_", predicate = "on") in self.graph)
+        self.assertFalse(self.graph.insert(Goal("A_", "B_", predicate = "on")))
+        self.graph.remove(Goal("A_", "B_", predicate = "on"))
+        self.assertFalse(self.on in self.graph)
+
+    def test_matching_plan(self):
+        both = plans.Plan([], [self.on, self.fire])
+        one = plans.Plan([], [self.on])
+        self.graph.addPlan(both)
+        self.graph.addPlan(one)
+        self.assertTrue(self.graph.getMatchingPlan([self.on]) is one)
+        self.assertTrue(self.graph.getMatchingPlan([self.on, self.fire]) is both)
+        self.assertTrue(self.graph.getMatchingPlan([Goal("?", "B_", predicate = "on")]) is one)
+        self.assertTrue(self.graph.getMatchingPlan([Goal("B_", predicate = "clear")]) is None)
+        self.assertEqual(self.graph.allMatchingPlans([self.on, self.fire]), [both, one])
+
+    def test_removed_plan(self):
+        plan = plans.Plan([], [self.on])
+        self.graph.addPlan(plan)
+        self.graph.removePlan(plan)
+        self.assertTrue(self.graph.getMatchingPlan([self.on]) is None)
+
+    def test_plan_goals_shortened(self):
+        #a plan's goal list is often the list of current goals, which modules change in place
+        goalList = [self.on]
+        plan = plans.Plan([], goalList)
+        self.graph.addPlan(plan)
+        del goalList[-1]
+        self.assertTrue(self.graph.getMatchingPlan([self.on]) is None)
+        self.graph.removePlan(plan)
+        self.assertEqual(len(self.graph.planIndex), 0)
+        self.assertTrue(self.graph.getMatchingPlan([self.on]) is None)
+
+    def test_old_plans(self):
+        plan = plans.Plan([], [self.on, self.fire])
+        self.graph.addPlan(plan)
+        self.graph.remove(self.fire)
+        self.graph.removeOldPlans()
+        self.assertEqual(self.graph.plans, set())
+        self.assertTrue(self.graph.getMatchingPlan([self.on]) is None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+'''
+Checks PlanCache keys, lookups and saving to and loading from disk. Run with
+python midca/tests/test_plancache.py.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from midca.goals import Goal
+from midca.modules._plan.plancache import PlanCache
+from midca.worldsim import domainread, stateread
+
+BLOCKSWORLD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "domains", "blocksworld")
+
+class PlanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.world = domainread.load_domain(os.path.join(BLOCKSWORLD, "domains", "arsonist_extinguish.sim"))
+        stateread.apply_state_file(self.world, os.path.join(BLOCKSWORLD, "states", "extinguisher_state.sim"))
+        self.goals = [Goal("A_", "B_", predicate = "on"), Goal("C_", predicate = "onfire", negate = True)]
+        self.plan = [("unstack", "D_", "B_"), ("putdown", "D_")]
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "plans.cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_keys(self):
+        cache = PlanCache()
+        key = cache.key(self.goals, self.world)
+        self.assertEqual(cache.key(list(reversed(self.goals)), self.world), key)
+        self.assertEqual(cache.key([Goal("A_", "B_", predicate = "on", id = 3), self.goals[1]], self.world), key)
+        self.assertEqual(cache.key(self.goals, self.world.copy()), key)
+        self.assertNotEqual(cache.key(self.goals[:1], self.world), key)
+        changed = self.world.copy()
+        changed.remove_atom(list(changed.atoms)[0])
+        self.assertNotEqual(cache.key(self.goals, changed), key)
+        self.assertTrue(cache.key(self.goals, object()) is None)
+
+    def test_get_and_put(self):
+        cache = PlanCache(size = 2)
+        key = cache.key(self.goals, self.world)
+        self.assertTrue(cache.get(key) is None)
+        cache.put(key, self.plan)
+        plan = cache.get(key)
+        self.assertEqual(plan, self.plan)
+        plan.append(("pickup", "C_"))
+        self.assertEqual(cache.get(key), self.plan)
+        cache.put(("a", "b"), [])
+        cache.get(key)
+        cache.put(("c", "d"), [])
+        self.assertTrue(cache.get(("a", "b")) is None)
+        self.assertEqual(cache.get(key), self.plan)
+        self.assertEqual(cache.stats(), {"size": 2, "hits": 4, "misses": 2, "evictions": 1})
+
+    def test_save_and_load(self):
+        cache = PlanCache(path = self.path)
+        key = cache.key(self.goals, self.world)
+        cache.put(key, self.plan)
+        cache.put(("a", "b"), [])
+        self.assertFalse(os.path.exists(self.path))
+        cache.flush()
+        self.assertTrue(os.path.exists(self.path))
+        loaded = PlanCache(path = self.path)
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual(loaded.get(key), self.plan)
+        self.assertEqual(loaded.get(("a", "b")), [])
+        #keys do not depend on the objects of a run, so a new world finds the plan
+        world = domainread.load_domain(os.path.join(BLOCKSWORLD, "domains", "arsonist_extinguish.sim"))
+        stateread.apply_state_file(world, os.path.join(BLOCKSWORLD, "states", "extinguisher_state.sim"))
+        self.assertEqual(loaded.get(loaded.key(self.goals, world)), self.plan)
+        self.assertEqual(os.listdir(self.dir), ["plans.cache"])
+
+    def test_save_every(self):
+        cache = PlanCache(path = self.path, saveEvery = 2)
+        cache.put(("a", "b"), [])
+        self.assertFalse(os.path.exists(self.path))
+        cache.put(("c", "d"), [])
+        self.assertEqual(len(PlanCache(path = self.path)), 2)
+
+    def test_bad_file_ignored(self):
+        with open(self.path, "w") as f:
+            f.write("not a plan cache")
+        cache = PlanCache(path = self.path)
+        self.assertEqual(len(cache), 0)
+        self.assertFalse(cache.load())
+        cache.put(("a", "b"), [])
+        cache.close()
+        self.assertEqual(len(PlanCache(path = self.path)), 1)
+
+if __name__ == "__main__":
+    unittest.main()
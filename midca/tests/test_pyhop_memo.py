@@ -0,0 +1,136 @@
+'''
+Checks pyhop's TranspositionTable and the _freeze function it builds its keys with. Run
+with python midca/tests/test_pyhop_memo.py.
+'''
+
+import unittest
+
+from midca.modules._plan import pyhop
+
+def memotest_step(state, k):
+    if state.pos + k <= state.limit:
+        state.pos += k
+        return state
+    return False
+
+def memotest_never(state):
+    return False
+
+def memotest_done(state, target):
+    if state.pos == target:
+        return []
+    return False
+
+def memotest_two(state, target):
+    return [("memotest_step", 2), ("memotest_go", target)]
+
+def memotest_one(state, target):
+    return [("memotest_step", 1), ("memotest_go", target)]
+
+pyhop.declare_operators(memotest_step, memotest_never)
+pyhop.declare_methods("memotest_go", memotest_done, memotest_two, memotest_one)
+
+def make_state(pos = 0, limit = 20):
+    state = pyhop.State("state")
+    state.pos = pos
+    state.limit = limit
+    return state
+
+class FreezeTest(unittest.TestCase):
+
+    def test_containers(self):
+        freeze = pyhop._freeze
+        self.assertEqual(freeze({"a": [1, 2], "b": set([3])}), freeze({"b": set([3]), "a": [1, 2]}))
+        self.assertNotEqual(freeze([1, 2]), freeze([2, 1]))
+        self.assertEqual(freeze(set([1, 2])), freeze(frozenset([2, 1])))
+        self.assertEqual(freeze((1, [2, (3, {4: 5})])), freeze((1, [2, (3, {4: 5})])))
+        hash(freeze({"a": [{"b": set([1])}]}))
+
+    def test_states_and_goals_by_value(self):
+        freeze = pyhop._freeze
+        self.assertEqual(freeze(make_state(3)), freeze(make_state(3)))
+        self.assertNotEqual(freeze(make_state(3)), freeze(make_state(4)))
+        goal, same, other = pyhop.Goal("goal"), pyhop.Goal("goal"), pyhop.Goal("goal")
+        goal.on = same.on = {"a": "b"}
+        other.on = {"a": "c"}
+        self.assertEqual(freeze(("achieve", goal)), freeze(("achieve", same)))
+        self.assertNotEqual(freeze(("achieve", goal)), freeze(("achieve", other)))
+        #a goal and a state with the same bindings are different things
+        state = pyhop.State("goal")
+        state.on = {"a": "b"}
+        self.assertNotEqual(freeze(goal), freeze(state))
+
+    def test_unhashable(self):
+        class Unhashable(object):
+            __hash__ = None
+        self.assertRaises(TypeError, pyhop._freeze, [Unhashable()])
+
+class TranspositionTableTest(unittest.TestCase):
+
+    def test_store_and_get(self):
+        table = pyhop.TranspositionTable()
+        key = table.key(make_state(), [("memotest_go", 5)])
+        self.assertEqual(table.key(make_state(), [("memotest_go", 5)]), key)
+        self.assertNotEqual(table.key(make_state(1), [("memotest_go", 5)]), key)
+        self.assertTrue(table.get(key) is None)
+        table.store(key, [("a",), ("b",), ("c",)], [("a",)])
+        self.assertEqual(table.get(key), [("b",), ("c",)])
+        table.store(key, False, [])
+        self.assertTrue(table.get(key) is False)
+        self.assertEqual(table.stats(), {"size": 1, "hits": 2, "misses": 1, "evictions": 0})
+
+    def test_no_plans(self):
+        table = pyhop.TranspositionTable(plans = False)
+        key = table.key(make_state(), [("memotest_go", 5)])
+        table.store(key, [("a",)], [])
+        self.assertTrue(table.get(key) is None)
+        table.store(key, False, [])
+        self.assertTrue(table.get(key) is False)
+
+    def test_variables(self):
+        table = pyhop.TranspositionTable(variables = ["pos"])
+        self.assertEqual(table.key(make_state(2, 10), []), table.key(make_state(2, 30), []))
+
+    def test_unkeyable(self):
+        table = pyhop.TranspositionTable()
+        state = make_state()
+        state.items = [[]]
+        state.bad = object.__new__(type("Unhashable", (object,), {"__hash__": None}))
+        self.assertTrue(table.key(state, []) is None)
+        table.store(None, False, [])
+        self.assertEqual(len(table), 0)
+
+    def test_least_recently_used_dropped(self):
+        table = pyhop.TranspositionTable(size = 2)
+        keys = [table.key(make_state(i), []) for i in range(3)]
+        table.store(keys[0], False, [])
+        table.store(keys[1], False, [])
+        table.get(keys[0])
+        table.store(keys[2], False, [])
+        self.assertTrue(table.get(keys[1]) is None)
+        self.assertTrue(table.get(keys[0]) is False)
+        self.assertTrue(table.get(keys[2]) is False)
+        self.assertEqual(table.evictions, 1)
+
+    def test_same_plans(self):
+        for undo in (False, True):
+            plain = pyhop.pyhop(make_state(), [("memotest_go", 19)], undo = undo)
+            table = pyhop.TranspositionTable()
+            self.assertEqual(pyhop.pyhop(make_state(), [("memotest_go", 19)], undo = undo, memo = table), plain)
+            self.assertEqual(pyhop.pyhop(make_state(), [("memotest_go", 19)], undo = undo, memo = table), plain)
+            self.assertTrue(table.hits > 0)
+            #a dead end is only searched once
+            table = pyhop.TranspositionTable()
+            self.assertEqual(pyhop.pyhop(make_state(), [("memotest_go", 19), ("memotest_never",)],
+                                         undo = undo, memo = table), False)
+            self.assertTrue(table.hits > 0)
+
+    def test_iterative(self):
+        table = pyhop.TranspositionTable()
+        plan, stats = pyhop.pyhop_iter(make_state(), [("memotest_go", 19)], memo = table)
+        self.assertEqual(plan, pyhop.pyhop(make_state(), [("memotest_go", 19)]))
+        again, stats = pyhop.pyhop_iter(make_state(), [("memotest_go", 19)], memo = table)
+        self.assertEqual(again, plan)
+
+if __name__ == "__main__":
+    unittest.main()
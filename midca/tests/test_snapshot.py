@@ -0,0 +1,125 @@
+'''
+Checks that worldsim.snapshot restores the worlds it saved, from full and delta records.
+Run with python midca/tests/test_snapshot.py.
+'''
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from midca.worldsim import domainread, snapshot, stateread
+
+BLOCKSWORLD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "domains", "blocksworld")
+
+def load_domain():
+    return domainread.load_domain(os.path.join(BLOCKSWORLD, "domains", "arsonist_extinguish.sim"))
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.domain = load_domain()
+        self.world = self.domain.copy()
+        stateread.apply_state_file(self.world, os.path.join(BLOCKSWORLD, "states", "extinguisher_state.sim"))
+        self.random = random.Random(0)
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "run.snap")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertSameWorld(self, world, expected):
+        self.assertEqual(set(world.atoms), set(expected.atoms))
+        self.assertEqual(sorted(world.objects), sorted(expected.objects))
+        for name, obj in world.objects.items():
+            self.assertEqual(obj.type.name, expected.objects[name].type.name)
+        for atom in world.atoms:
+            self.assertTrue(world.predicates[atom.predicate.name] is atom.predicate)
+            for arg in atom.args:
+                self.assertTrue(world.objects[arg.name] is arg)
+
+    def step(self, world):
+        '''
+        Makes a few random changes to world's atoms and objects.
+        '''
+        blocks = sorted(name for name, obj in world.objects.items() if obj.type.name == "BLOCK")
+        for i in range(3):
+            block = self.random.choice(blocks)
+            if world.is_true("onfire", [block]):
+                world.remove_fact("onfire", [block])
+            else:
+                world.add_fact("onfire", [block])
+        name = "X" + str(self.random.randint(0, 3))
+        if name in world.objects:
+            world.remove_object(name)
+        else:
+            world.add_object_by_type(name, "BLOCK")
+            world.add_fact("clear", [name])
+
+    def record(self, writer, num):
+        worlds = []
+        for i in range(num):
+            self.step(self.world)
+            writer.write(self.world)
+            worlds.append(self.world.copy())
+        return worlds
+
+    def test_deltas(self):
+        with snapshot.SnapshotWriter(self.path) as writer:
+            worlds = self.record(writer, 20)
+        with snapshot.Snapshot(self.path) as snap:
+            self.assertEqual(len(snap), 20)
+            self.assertEqual([record[0] for record in snap.records], [snapshot.FULL] + [snapshot.DELTA] * 19)
+            for i, world in enumerate(worlds):
+                self.assertSameWorld(snap.world(self.domain, i), world)
+            self.assertSameWorld(snap.world(self.domain), worlds[-1])
+            self.assertRaises(IndexError, snap.world, self.domain, 20)
+
+    def test_full_every(self):
+        with snapshot.SnapshotWriter(self.path, fullEvery = 4) as writer:
+            worlds = self.record(writer, 10)
+            writer.write(self.world, full = True)
+        with snapshot.Snapshot(self.path) as snap:
+            kinds = [record[0] for record in snap.records]
+            self.assertEqual([i for i, kind in enumerate(kinds) if kind == snapshot.FULL], [0, 4, 8, 10])
+            for i, world in enumerate(worlds):
+                self.assertSameWorld(snap.world(self.domain, i), world)
+            self.assertSameWorld(snap.world(self.domain), self.world)
+
+    def test_save_and_load(self):
+        snapshot.save(self.world, self.path)
+        world = snapshot.load(self.path, load_domain())
+        self.assertSameWorld(world, self.world)
+        self.assertEqual(world.atoms.state_hash(), self.world.atoms.state_hash())
+
+    def test_restored_world_is_independent(self):
+        snapshot.save(self.world, self.path)
+        world = snapshot.load(self.path, self.domain)
+        world.add_object_by_type("Y", "BLOCK")
+        world.add_fact("clear", ["Y"])
+        self.assertFalse("Y" in self.domain.objects)
+        self.assertFalse("Y" in self.world.objects)
+
+    def test_type_change(self):
+        with snapshot.SnapshotWriter(self.path) as writer:
+            writer.write(self.world)
+            world = self.world.copy()
+            world.remove_object("B_")
+            world.add_object_by_type("B_", "SQUARE")
+            for atom in self.world.atoms:
+                if any(arg.name == "B_" for arg in atom.args):
+                    world.add_fact(atom.predicate.name, [arg.name for arg in atom.args])
+            writer.write(world)
+        restored = snapshot.load(self.path, self.domain)
+        self.assertEqual(restored.objects["B_"].type.name, "SQUARE")
+        self.assertSameWorld(restored, world)
+
+    def test_not_a_snapshot(self):
+        with open(self.path, "w") as f:
+            f.write("something else")
+        self.assertRaises(Exception, snapshot.Snapshot, self.path)
+
+if __name__ == "__main__":
+    unittest.main()
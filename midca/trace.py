@@ -1,25 +1,33 @@
 from __future__ import print_function
 import copy
+import itertools
 import shlex, subprocess # used for generating a pdf of the trace
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
 """
 How-To:
 1. In each module, before storing data into the trace call add_module() then
 2. for each piece of data you want to add into the trace, call add_data()
+
+Worlds (data of the types in WORLD_TYPES) should be passed to add_data() as they are,
+without copying them: the trace records a snapshot of each (see CogTrace.snapshot).
 """
 
 MAX_TRACE_SIZE = 100
 
+WORLD_TYPES = ("WORLD", "PREV WORLD", "CURR WORLD")
+
 class CogTrace:
     # trace[<cycle>][<module-id>] returns a list of what happened in
     # that module in that cycle
 
     def __init__(self):
         self.trace = {}
+        self.cycles = deque() # cycles in self.trace, oldest first
         self.cycle = -1 # current cycle
         self.module = "" # current module
         self.all_modules = OrderedDict() # alternative structure of the same data as self.trace
+        self.lastWorld = None # most recent world snapshot
 
     def add_module(self, cycle, module):
         """args:
@@ -31,22 +39,13 @@ class CogTrace:
             for j in range(i):
                 self.all_modules.popitem(last=False)
         
-        trace_cycle_keys = self.trace.keys()
-        if len(trace_cycle_keys) > MAX_TRACE_SIZE:
-            min_key = min(trace_cycle_keys)
-            del self.trace[min_key]
+        if len(self.cycles) > MAX_TRACE_SIZE:
+            del self.trace[self.cycles.popleft()]
              
-        if cycle in self.trace.keys():
-            if len(self.trace[cycle]) > 0 and module in self.trace[cycle].keys():
-                #print("Changing data for module "+str(module)+" in cycle "+str(cycle)+ " to " + str(data))
-                self.trace[cycle][module] = []
-            else:
-                #print("Fresh insert of data for module "+str(module)+" in cycle "+str(cycle)+ " to " + str(data))
-                self.trace[cycle][module] = []
-        else:
+        if cycle not in self.trace:
             self.trace[cycle] = OrderedDict()
-            #print("Fresh insert of data for module "+str(module)+" in cycle "+str(cycle)+ " to " + str(data))
-            self.trace[cycle][module] = []
+            self.cycles.append(cycle)
+        self.trace[cycle][module] = []
 
         self.cycle = cycle
         self.module = module
@@ -59,9 +58,39 @@ class CogTrace:
         """
         
         if self.cycle != -1 and self.module != "":
+            if data_type in WORLD_TYPES:
+                data = self.snapshot(data)
             self.trace[self.cycle][self.module].append([data_type,data])
             self.all_modules[(self.cycle,self.module)].append([data_type,data])
         
+    def snapshot(self, world):
+        """
+        Returns an unchanging snapshot of world. MIDCA worlds are snapshotted with
+        World.copy(), which shares the world's atoms copy-on-write, and a world that is
+        unchanged since the last snapshot gets that same snapshot, so recording the world
+        in every module costs little time or memory. Other world representations are
+        deep copied.
+        """
+        if world is None or not hasattr(world, "state_hash"):
+            return copy.deepcopy(world)
+        last = self.lastWorld
+        if last is not None and last.objects == world.objects and last.fast_equal(world):
+            return last
+        self.lastWorld = world.copy()
+        return self.lastWorld
+
+    def get_world(self, cycle, phase, data_type = "WORLD"):
+        """
+        Returns the world recorded as data_type in the given cycle and phase, or None.
+        Worlds are shared snapshots: copy() one before changing it.
+        """
+        if cycle not in self.trace:
+            return None
+        for datum in self.trace[cycle].get(phase, ()):
+            if datum[0] == data_type:
+                return datum[1]
+        return None
+
     def get_data(self, cycle, phase):
         if cycle < 0:
             return [] # if not initialized, no data to return
@@ -91,7 +120,8 @@ class CogTrace:
         '''
         try:
             if len(self.all_modules) > n:
-                return self.all_modules.items()[-(n+1)]
+                key = next(itertools.islice(reversed(self.all_modules), n, None))
+                return (key, self.all_modules[key])
         
         except :
             print("problem in get_n_prev_phase")
@@ -0,0 +1,364 @@
+import collections, copy
+
+WILDCARD = "?"
+
+#a store rebuilds its shared base once its own changes outgrow this fraction of the base
+COMPACT_FRACTION = 0.25
+COMPACT_MIN = 64
+
+def _exact_key(atom):
+	return (atom.predicate.name, tuple([arg.name for arg in atom.args]))
+
+def _matches_filters(atom, filters):
+	parts = [atom.predicate.name] + [arg.name for arg in atom.args]
+	for filter_str in filters:
+		if not any(filter_str in part for part in parts):
+			return False
+	return True
+
+class FrozenAtoms:
+	'''
+	An immutable set of atoms with secondary indexes by predicate name, by (predicate name,
+	argument position, object name) and by object name. The indexes are built the first
+	time they are needed. Because a FrozenAtoms never changes, any number of AtomStores
+	(and therefore World snapshots) can share one, indexes included.
+	'''
+
+	def __init__(self, atoms = ()):
+		self.atoms = frozenset(atoms)
+		self.indexed = False
+
+	def __getstate__(self):
+		return {'atoms': self.atoms, 'indexed': False}
+
+	def _build_index(self):
+		self.exact = {}
+		self.pred = {}
+		self.arg = {}
+		self.obj = {}
+		self.name_matches = {}
+		for atom in self.atoms:
+			predname, argnames = key = _exact_key(atom)
+			self.exact[key] = atom
+			self.pred.setdefault(predname, set()).add(atom)
+			for i in range(len(argnames)):
+				self.arg.setdefault((predname, i, argnames[i]), set()).add(atom)
+				self.obj.setdefault(argnames[i], set()).add(atom)
+		self.indexed = True
+
+	def get_exact(self, key):
+		if not self.indexed:
+			self._build_index()
+		return self.exact.get(key)
+
+	def by_predicate(self, predname):
+		if not self.indexed:
+			self._build_index()
+		return self.pred.get(predname, frozenset())
+
+	def by_arg(self, predname, position, objname):
+		if not self.indexed:
+			self._build_index()
+		return self.arg.get((predname, position, objname), frozenset())
+
+	def by_object(self, objname):
+		if not self.indexed:
+			self._build_index()
+		return self.obj.get(objname, frozenset())
+
+	def match(self, predname, bound, numargs):
+		if not self.indexed:
+			self._build_index()
+		candidates = self.pred.get(predname, ())
+		for i, name in bound:
+			argset = self.arg.get((predname, i, name), ())
+			if len(argset) < len(candidates):
+				candidates = argset
+		return [atom for atom in candidates if len(atom.args) == numargs and
+				all(atom.args[i].name == name for i, name in bound)]
+
+	def matching_names(self, substring):
+		'''
+		Returns (predicate names, object names) that contain substring.
+		'''
+		if not self.indexed:
+			self._build_index()
+		if substring not in self.name_matches:
+			self.name_matches[substring] = ([name for name in self.pred if substring in name],
+				[name for name in self.obj if substring in name])
+		return self.name_matches[substring]
+
+	def filter_names(self, filters):
+		#start from the filter with the fewest candidate atoms and check the others per atom
+		best = None
+		bestSize = None
+		for filter_str in filters:
+			prednames, objnames = self.matching_names(filter_str)
+			sources = [self.pred[name] for name in prednames] + [self.obj[name] for name in objnames]
+			size = sum([len(source) for source in sources])
+			if best is None or size < bestSize:
+				best = (filter_str, sources)
+				bestSize = size
+		if best is None:
+			return set(self.atoms)
+		candidates = set()
+		for source in best[1]:
+			candidates.update(source)
+		rest = [filter_str for filter_str in filters if filter_str != best[0]]
+		if not rest:
+			return candidates
+		return set([atom for atom in candidates if _matches_filters(atom, rest)])
+
+class AtomStore(collections.MutableSet):
+	'''
+	Set of atoms with indexed lookups by predicate, by argument and by object. Behaves like
+	a python set, so it can be iterated over and modified with add/remove/discard as
+	World.atoms always could.
+
+	A store is a shared, immutable FrozenAtoms base plus the atoms this store has added to
+	or removed from it. copy() is O(1): the copy shares both the base and the delta, and
+	whichever store is modified first copies the delta, so snapshots only cost memory
+	proportional to their changes. When the delta grows past COMPACT_FRACTION of the base,
+	the store folds it into a new base of its own.
+	'''
+
+	def __init__(self, atoms = ()):
+		self._base = FrozenAtoms(atoms)
+		self._added = set()
+		self._addedKeys = {}
+		self._removed = set()
+		self._shared = False
+		self._hash = 0
+		for atom in self._base.atoms:
+			self._hash ^= hash(atom)
+
+	def _own(self):
+		if self._shared:
+			self._added = set(self._added)
+			self._addedKeys = self._addedKeys.copy()
+			self._removed = set(self._removed)
+			self._shared = False
+
+	def _maybe_compact(self):
+		if len(self._added) + len(self._removed) > COMPACT_MIN + COMPACT_FRACTION * len(self._base.atoms):
+			self.compact()
+
+	def compact(self):
+		'''
+		Folds this store's delta into a new base.
+		'''
+		self._base = FrozenAtoms(self)
+		self._added = set()
+		self._addedKeys = {}
+		self._removed = set()
+		self._shared = False
+
+	def __contains__(self, atom):
+		return atom in self._added or (atom in self._base.atoms and atom not in self._removed)
+
+	def __iter__(self):
+		if not self._added and not self._removed:
+			return iter(self._base.atoms)
+		return self._iter_delta()
+
+	def _iter_delta(self):
+		removed = self._removed
+		for atom in self._base.atoms:
+			if atom not in removed:
+				yield atom
+		for atom in list(self._added):
+			yield atom
+
+	def __len__(self):
+		return len(self._base.atoms) - len(self._removed) + len(self._added)
+
+	def __eq__(self, other):
+		if isinstance(other, AtomStore) and other._base is self._base:
+			#relative to one base, the delta of a store is unique to its contents
+			return self._added == other._added and self._removed == other._removed
+		return collections.MutableSet.__eq__(self, other)
+	
+	def __ne__(self, other):
+		return not self == other
+	
+	def __reduce__(self):
+		return (AtomStore, (list(self),))
+
+	def __deepcopy__(self, memo):
+		return AtomStore(copy.deepcopy(list(self), memo))
+
+	def add(self, atom):
+		if atom in self:
+			return
+		self._own()
+		if atom in self._removed:
+			self._removed.discard(atom)
+		else:
+			self._added.add(atom)
+			self._addedKeys[_exact_key(atom)] = atom
+		self._hash ^= hash(atom)
+		self._maybe_compact()
+
+	def discard(self, atom):
+		if atom in self._added:
+			self._own()
+			self._added.discard(atom)
+			del self._addedKeys[_exact_key(atom)]
+			self._hash ^= hash(atom)
+		elif atom in self._base.atoms and atom not in self._removed:
+			self._own()
+			self._removed.add(atom)
+			self._hash ^= hash(atom)
+			self._maybe_compact()
+
+	def remove(self, atom):
+		if atom not in self:
+			raise KeyError(atom)
+		self.discard(atom)
+
+	def clear(self):
+		self._base = FrozenAtoms()
+		self._added = set()
+		self._addedKeys = {}
+		self._removed = set()
+		self._shared = False
+		self._hash = 0
+
+	def update(self, atoms):
+		'''
+		Adds atoms. When they would outgrow the delta anyway, they are folded into a new
+		base at once instead of being added one by one.
+		'''
+		atoms = set(atoms)
+		if len(atoms) <= COMPACT_MIN + COMPACT_FRACTION * len(self._base.atoms):
+			for atom in atoms:
+				self.add(atom)
+			return
+		for atom in atoms:
+			if atom not in self:
+				self._hash ^= hash(atom)
+		atoms.update(self)
+		self._base = FrozenAtoms(atoms)
+		self._added = set()
+		self._addedKeys = {}
+		self._removed = set()
+		self._shared = False
+
+	def copy(self):
+		'''
+		Returns an O(1) copy-on-write snapshot of this store. Deltas are kept small by the
+		changes that grow them (see COMPACT_FRACTION), not here.
+		'''
+		new = AtomStore.__new__(AtomStore)
+		new._base = self._base
+		new._added = self._added
+		new._addedKeys = self._addedKeys
+		new._removed = self._removed
+		new._shared = self._shared = True
+		new._hash = self._hash
+		return new
+	
+	def state_hash(self):
+		'''
+		Returns a hash of the atoms in this store that does not depend on the order they
+		were added in. It is kept up to date on every change, so this is O(1); stores
+		with the same atoms always have the same state_hash.
+		'''
+		return self._hash
+
+	def delta(self):
+		'''
+		Returns (added, removed): the atoms this store adds to and removes from its base.
+		'''
+		return (set(self._added), set(self._removed))
+
+	def diff(self, other):
+		'''
+		Returns (added, removed): the atoms in this store and not in other, and those in
+		other and not in this store. Stores that share a base (e.g. a store and an earlier
+		copy of it) are compared through their deltas only.
+		'''
+		if isinstance(other, AtomStore) and other._base is self._base:
+			added = (self._added - other._added) | (other._removed - self._removed)
+			removed = (other._added - self._added) | (self._removed - other._removed)
+			return (added, removed)
+		mine = set(self)
+		theirs = set(other)
+		return (mine - theirs, theirs - mine)
+
+	def _apply_delta(self, baseatoms, test):
+		if not self._added and not self._removed:
+			return baseatoms
+		result = set(baseatoms)
+		if self._removed:
+			result.difference_update(self._removed)
+		for atom in self._added:
+			if test(atom):
+				result.add(atom)
+		return result
+
+	def get_exact(self, predname, argnames = []):
+		'''
+		Returns the atom with the given predicate name and argument names, or None.
+		'''
+		key = (predname, tuple(argnames))
+		atom = self._base.get_exact(key)
+		if atom is not None and atom not in self._removed:
+			return atom
+		return self._addedKeys.get(key)
+
+	def by_predicate(self, predname):
+		'''
+		Returns the set of atoms whose predicate is named predname. Do not modify it.
+		'''
+		return self._apply_delta(self._base.by_predicate(predname),
+			lambda atom: atom.predicate.name == predname)
+
+	def by_arg(self, predname, position, objname):
+		'''
+		Returns the set of atoms of predicate predname whose argument at the given
+		position is the object named objname. Do not modify it.
+		'''
+		return self._apply_delta(self._base.by_arg(predname, position, objname),
+			lambda atom: atom.predicate.name == predname and len(atom.args) > position and atom.args[position].name == objname)
+
+	def by_object(self, objname):
+		'''
+		Returns the set of atoms that have the object named objname as any argument.
+		Do not modify it.
+		'''
+		return self._apply_delta(self._base.by_object(objname),
+			lambda atom: any(arg.name == objname for arg in atom.args))
+
+	def match(self, predname, argnames):
+		'''
+		Returns a list of the atoms of predicate predname whose arguments match argnames.
+		Any entry of argnames that is WILDCARD ("?") or None matches any object, e.g.
+		match("on", ["?", "B"]) returns every atom on(x, B). The candidates are taken
+		from the smallest index set involved, so the cost is close to the result size.
+		'''
+		bound = [(i, name) for i, name in enumerate(argnames) if name is not None and name != WILDCARD]
+		if len(bound) == len(argnames):
+			atom = self.get_exact(predname, argnames)
+			if atom is not None:
+				return [atom]
+			return []
+		numargs = len(argnames)
+		result = [atom for atom in self._base.match(predname, bound, numargs) if atom not in self._removed]
+		for atom in self._added:
+			if atom.predicate.name == predname and len(atom.args) == numargs and \
+					all(atom.args[i].name == name for i, name in bound):
+				result.append(atom)
+		return result
+
+	def filter_names(self, filters):
+		'''
+		Returns the set of atoms for which every filter string is a substring of the
+		predicate name or of some argument name. This is what World.get_atoms() computes.
+		'''
+		filters = set(filters)
+		return self._apply_delta(self._base.filter_names(filters),
+			lambda atom: _matches_filters(atom, filters))
+
+	def __str__(self):
+		return "{" + ", ".join([str(atom) for atom in self]) + "}"
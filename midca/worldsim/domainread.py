@@ -1,207 +1,453 @@
 import worldsim
+import hashlib, marshal, os, re, sys, tempfile
 
-types = {"obj": worldsim.Type("obj", [])}
-objects = {}
-predicates = {}
-atoms = []
-operators = {}
-cltree = {"rootnode": "" , "allnodes" : [] , "checked" : [] } 
-obtree = {"rootnode": "" , "allnodes" : [] , "checked" : [] }
-
-def type(name, parentnames = ["obj"]):
-	temp = [name]
-	if not parentnames == ["obj"]:
-		temp.append(parentnames)
-	if isinstance(parentnames, basestring):
-		parentnames = [parentnames]
-	parents = []
-	for parent in parentnames:
-		if parent not in types:
-			raise Exception("parent type DNE.")
-		parents.append(types[parent])
-	types[name] = worldsim.Type(name, parents)	
-	otree = worldsim.ObjectTree(obtree['rootnode'] , 
-				    obtree['allnodes'], 
-				    obtree['checked'] , 
-				    temp)
-	obtree['rootnode'] = otree.rootnode
-	obtree['allnodes'] = otree.allnodes
-	obtree['checked'] = otree.checked
+class Cond:
+	
+	def __init__(self, predicate, argnames, positive):
+		self.predicate = predicate
+		self.argnames = argnames
+		self.positive = positive
 
+class DomainLoader:
 
-def ptype(*args):
 	'''
-	Create a class hierarchy tree and get the result into cltree,
-        which is a global variable inorder to store previous nodes of tree.
+	Builds a domain. The functions of the .sim language (type, predicate, operator...)
+	are methods that add to this loader's own types, objects, predicates, atoms and
+	operators, so every loader builds an independent world and nothing is kept between
+	loads. If world is given, the loader starts with its types, objects, predicates and
+	class trees, e.g. to build new operators for it.
 	'''
-	temp = list(args)
-	tree = worldsim.Tree(cltree['rootnode'] , cltree['allnodes'], cltree['checked'] , temp)
-	cltree['rootnode'] = tree.rootnode
-	cltree['allnodes'] = tree.allnodes
-	cltree['checked'] = tree.checked
 
+	def __init__(self, world = None):
+		self.types = {"obj": worldsim.Type("obj", [])}
+		self.objects = {}
+		self.predicates = {}
+		self.atoms = []
+		self.operators = {}
+		self.cltree = {"rootnode": "" , "allnodes" : [] , "checked" : [] } 
+		self.obtree = {"rootnode": "" , "allnodes" : [] , "checked" : [] }
+		if world is not None:
+			self.types = dict(world.types)
+			self.objects.update(world.objects)
+			self.predicates.update(world.predicates)
+			if world.cltree:
+				self.cltree = world.cltree
+			if world.obtree:
+				self.obtree = world.obtree
+
+	def functions(self):
+		'''
+		Returns the functions .sim text can call, by name.
+		'''
+		return {"type": self.type, "ptype": self.ptype, "instance": self.instance,
+			"predicate": self.predicate, "statement": self.statement,
+			"condition": self.condition, "operator": self.operator,
+			"operator_no_side_effect": self.operator_no_side_effect}
+
+	def type(self, name, parentnames = ["obj"]):
+		temp = [name]
+		if not parentnames == ["obj"]:
+			temp.append(parentnames)
+		if isinstance(parentnames, basestring):
+			parentnames = [parentnames]
+		parents = []
+		for parent in parentnames:
+			if parent not in self.types:
+				raise Exception("parent type DNE.")
+			parents.append(self.types[parent])
+		#a new type never changes the ancestors of existing ones, so cached ancestor sets stay valid
+		self.types[name] = worldsim.Type(name, parents)	
+		otree = worldsim.ObjectTree(self.obtree['rootnode'] , 
+					    self.obtree['allnodes'], 
+					    self.obtree['checked'] , 
+					    temp)
+		self.obtree['rootnode'] = otree.rootnode
+		self.obtree['allnodes'] = otree.allnodes
+		self.obtree['checked'] = otree.checked
+
+	def ptype(self, *args):
+		'''
+		Create a class hierarchy tree and get the result into cltree,
+		which stores the previous nodes of the tree.
+		'''
+		temp = list(args)
+		tree = worldsim.Tree(self.cltree['rootnode'] , self.cltree['allnodes'], self.cltree['checked'] , temp)
+		self.cltree['rootnode'] = tree.rootnode
+		self.cltree['allnodes'] = tree.allnodes
+		self.cltree['checked'] = tree.checked
+
+	def instance(self, name, typename):
+		if typename not in self.types:
+			raise Exception("object type DNE.")
+		self.objects[name] = self.types[typename].instantiate(name)
+
+	def predicate(self, name, argnames, argtypenames = []):
+		argtypes = []
+		for typename in argtypenames:
+			if typename not in self.types:
+				raise Exception("object type DNE.")
+			argtypes.append(self.types[typename])
+		self.predicates[name] = worldsim.Predicate(name, argnames, argtypes)
+
+	def statement(self, predicatename, argnames):
+		if predicatename not in self.predicates:
+			raise Exception("predciate DNE.")
+		args = []
+		for argname in argnames:
+			if argname not in self.objects:
+				raise Exception("object DNE.")
+			args.append(self.objects[argname])
+		self.atoms.append(self.predicates[predicatename].instantiate(args))
+
+	def condition(self, predicatename, args = [], negate = False):
+		if predicatename not in self.predicates:
+			raise Exception("predicate "+str(predicatename)+" DNE.")
+		return Cond(self.predicates[predicatename], args, not negate)
+
+	#args is a list of (argname, argtypename)
+	def operator(self, name, args = [], preconditions = [], results = []):
+		self.operators[name] = self.operator_no_side_effect(name, args, preconditions, results)
+
+	def operator_no_side_effect(self, name, args = [], preconditions = [], results = []):
+		'''
+		Just like operator above, except doesn't save the operator into the loader's
+		operators, instead returns the operator
+		'''
+		objnames = []
+		argtypes = {}
+		for argname, argtype in args:
+			objnames.append(argname)	
+			if argtype not in self.types:
+				raise Exception("object type DNE.")
+			argtypes[argname] = self.types[argtype]
+		prepredicates = []
+		preobjnames = []
+		preobjtypes = []
+		prePositive = []
+		for condition in preconditions:
+			for argname in condition.argnames:
+				if argname not in objnames:
+					raise Exception("condition argument not listed as an object for this operator")
+			prepredicates.append(condition.predicate)
+			preobjnames.append(condition.argnames)
+			objtypes = []
+			for objname in preobjnames[-1]:
+				objtypes.append(argtypes[objname])
+			preobjtypes.append(objtypes)
+			prePositive.append(condition.positive)
+		postpredicates = []
+		postobjnames = []
+		postobjtypes = []
+		postPositive = []
+		for condition in results:
+			for argname in condition.argnames:
+				if argname not in objnames:
+					raise Exception("condition argument not listed as an object for this operator")
+			postpredicates.append(condition.predicate)
+			postobjnames.append(condition.argnames)
+			objtypes = []
+			for objname in postobjnames[-1]:
+				objtypes.append(argtypes[objname])
+			postobjtypes.append(objtypes)
+			postPositive.append(condition.positive)
+		return worldsim.Operator(name, objnames, prepredicates, preobjnames, preobjtypes, prePositive, postpredicates, postobjnames, postobjtypes, postPositive)
+
+	def world(self):
+		'''
+		Returns a new World with everything built by this loader.
+		'''
+		worldsim.freeze_type_lattice(self.types.values())
+		return worldsim.World(self.operators.values(), self.predicates.values(), self.atoms, self.types, self.objects.values(), self.cltree, self.obtree)
+
+	def load_domain(self, filename):
+		f = open(filename)
+		run(compile_domain(f.read()), self)
+		f.close()
+		return self.world()
+
+	def load_domain_str(self, str):
+		run(compile_domain(str), self)
+		return self.world()
+
+#The module-level functions and variables below are those of the loader of the last
+#domain loaded with load_domain or load_domain_str (or of an empty one), as they were when
+#this module kept a single domain in its globals.
+
+def _use(loader):
+	global _current, types, objects, predicates, atoms, operators, cltree, obtree
+	_current = loader
+	types = loader.types
+	objects = loader.objects
+	predicates = loader.predicates
+	atoms = loader.atoms
+	operators = loader.operators
+	cltree = loader.cltree
+	obtree = loader.obtree
+
+_use(DomainLoader())
+
+def type(name, parentnames = ["obj"]):
+	_current.type(name, parentnames)
+
+def ptype(*args):
+	_current.ptype(*args)
 
 def instance(name, typename):
-	if typename not in types:
-		raise Exception("object type DNE.")
-	objects[name] = types[typename].instantiate(name)
+	_current.instance(name, typename)
 
 def predicate(name, argnames, argtypenames = []):
-	argtypes = []
-	for typename in argtypenames:
-		if typename not in types:
-			raise Exception("object type DNE.")
-		argtypes.append(types[typename])
-	predicates[name] = worldsim.Predicate(name, argnames, argtypes)
+	_current.predicate(name, argnames, argtypenames)
 
 def statement(predicatename, argnames):
-	if predicatename not in predicates:
-		raise Exception("predciate DNE.")
-	args = []
-	for argname in argnames:
-		if argname not in objects:
-			raise Exception("object DNE.")
-		args.append(objects[argname])
-	atoms.append(predicates[predicatename].instantiate(args))
-
-class Cond:
-	
-	def __init__(self, predicate, argnames, positive):
-		self.predicate = predicate
-		self.argnames = argnames
-		self.positive = positive
+	_current.statement(predicatename, argnames)
 
 def condition(predicatename, args = [], negate = False):
-	if predicatename not in predicates:
-		raise Exception("predicate "+str(predicatename)+" DNE.")
-	return Cond(predicates[predicatename], args, not negate)
-	
-#args is a dict: {argname: argtypename}
+	return _current.condition(predicatename, args, negate)
+
 def operator(name, args = [], preconditions = [], results = []):
-	objnames = []
-	argtypes = {}
-	for argname, argtype in args:
-		objnames.append(argname)	
-		if argtype not in types:
-			raise Exception("object type DNE.")
-		argtypes[argname] = types[argtype]
-	prepredicates = []
-	preobjnames = []
-	preobjtypes = []
-	prePositive = []
-	for condition in preconditions:
-		for argname in condition.argnames:
-			if argname not in objnames:
-				raise Exception("condition argument not listed as an object for this operator")
-		prepredicates.append(condition.predicate)
-		preobjnames.append(condition.argnames)
-		objtypes = []
-		for objname in preobjnames[-1]:
-			objtypes.append(argtypes[objname])
-		preobjtypes.append(objtypes)
-		prePositive.append(condition.positive)
-	postpredicates = []
-	postobjnames = []
-	postobjtypes = []
-	postPositive = []
-	for condition in results:
-		for argname in condition.argnames:
-			if argname not in objnames:
-				raise Exception("condition argument not listed as an object for this operator")
-		postpredicates.append(condition.predicate)
-		postobjnames.append(condition.argnames)
-		objtypes = []
-		for objname in postobjnames[-1]:
-			objtypes.append(argtypes[objname])
-		postobjtypes.append(objtypes)
-		postPositive.append(condition.positive)
-	operators[name] = worldsim.Operator(name, objnames, prepredicates, preobjnames, preobjtypes, prePositive, postpredicates, postobjnames, postobjtypes, postPositive)
-
-def preprocess(text):
-	i = 0
-	corrected = ""
-	endChars = [",", ")", "]"]
-	startChars = ["\n", " ", "\t", "[", "(", ","]
-	while True:
-		newI = len(text)
-		for char in endChars:		
-			if char in text[i:]:
-				newI = min(text.index(char, i), newI)
-		newI
-		if newI == len(text):
-			break
-		backI = newI - 1
-		while text[backI] not in startChars and backI > i - 1:
-			backI -= 1
-		if text[backI] not in startChars:
-			corrected += text[i:newI + 1]
-			i = newI + 1
-			continue
-		if text[backI] != "[" or newI != backI + 1:
-			corrected += text[i:backI + 1] + "\"" + text[backI + 1:newI] + "\"" + text[newI]
+	_current.operator(name, args, preconditions, results)
+
+def operator_no_side_effect(name, args = [], preconditions = [], results = []):
+	return _current.operator_no_side_effect(name, args, preconditions, results)
+
+#.sim parsing. A domain file is a sequence of calls such as
+#	predicate(on, [x, y], [BLOCK, BLOCK])
+#	operator(stack, args = [(x, BLOCK)], preconditions = [condition(clear, [x])], results = [])
+#whose arguments are unquoted words, True, False, lists, tuples and nested calls; # starts a
+#comment. parse() turns the text into a list of calls in a form that can be marshaled (see
+#parse_call), and run() makes the calls. load_domain caches the parsed calls on disk, by
+#the hash of the text, so a domain file is only parsed once on each machine.
+
+_TOKENS = re.compile(r"(\s+|#[^\n]*)|([()\[\],=])|([^\s()\[\],=#]+)")
+
+def _default_cache_dir():
+	'''
+	Returns the user's own cache folder: $XDG_CACHE_HOME/midca or ~/.cache/midca, or, if
+	there is no home folder, a folder named after the user id in the temp folder.
+	'''
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(os.path.join("~", ".cache"))
+	if not base.startswith("~"):
+		return os.path.join(base, "midca")
+	uid = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+	return os.path.join(tempfile.gettempdir(), "midca-sim-cache-" + str(uid))
+
+#compiled domains are stored here; set to None to disable the disk cache.
+CACHE_DIR = os.environ.get("MIDCA_SIM_CACHE") or _default_cache_dir()
+#bump when the parse() output changes, to ignore older cached files.
+PARSER_VERSION = 1
+
+_compiled = {} #parsed calls by text hash, in this process
+
+def scan(text):
+	'''
+	Returns the tokens of a .sim text (words and the characters ()[],=) and the line
+	each is on.
+	'''
+	tokens = []
+	lines = []
+	line = 1
+	for match in _TOKENS.finditer(text):
+		space, punct, word = match.groups()
+		if space is not None:
+			line += space.count("\n")
 		else:
-			corrected += "[]"
-		i = newI + 1
-	return corrected.replace("\"False\"", "False").replace("\"True\"", "True") 
+			tokens.append(punct or word)
+			lines.append(line)
+	return tokens, lines
+
+class _Parser:
+
+	def __init__(self, text):
+		self.tokens, self.lines = scan(text)
+		self.i = 0
+
+	def error(self, msg):
+		if self.i < len(self.tokens):
+			raise SyntaxError(msg + " at line " + str(self.lines[self.i]) + ", near '" + self.tokens[self.i] + "'")
+		raise SyntaxError(msg + " at end of text")
+
+	def peek(self):
+		if self.i < len(self.tokens):
+			return self.tokens[self.i]
+		return None
+
+	def expect(self, token):
+		if self.peek() != token:
+			self.error("expected '" + token + "'")
+		self.i += 1
+
+	def value(self):
+		token = self.peek()
+		if token == "[":
+			self.i += 1
+			return self.sequence("]")[0]
+		if token == "(":
+			self.i += 1
+			items, comma = self.sequence(")")
+			if len(items) == 1 and not comma:
+				return items[0]
+			return tuple(items)
+		if token is None or token in "()[],=":
+			self.error("expected a value")
+		self.i += 1
+		if self.peek() == "(":
+			return self.call(token)
+		if token == "True":
+			return True
+		if token == "False":
+			return False
+		return token
+
+	def sequence(self, end):
+		items = []
+		comma = False
+		while self.peek() != end:
+			items.append(self.value())
+			comma = self.peek() == ","
+			if comma:
+				self.i += 1
+			elif self.peek() != end:
+				self.error("expected ',' or '" + end + "'")
+		self.i += 1
+		return items, comma
+
+	def call(self, name):
+		self.expect("(")
+		args = []
+		kwargs = {}
+		while self.peek() != ")":
+			if self.i + 1 < len(self.tokens) and self.tokens[self.i + 1] == "=":
+				key = self.tokens[self.i]
+				self.i += 2
+				kwargs[key] = self.value()
+			else:
+				if kwargs:
+					self.error("positional argument after keyword argument")
+				args.append(self.value())
+			if self.peek() == ",":
+				self.i += 1
+			elif self.peek() != ")":
+				self.error("expected ',' or ')'")
+		self.i += 1
+		return parse_call(name, args, kwargs)
+
+def parse_call(name, args, kwargs):
+	'''
+	Returns the parsed form of a call: a dict, as calls are the only dicts in parsed text.
+	'''
+	return {"call": name, "args": args, "kwargs": kwargs}
+
+def parse(text):
+	'''
+	Parses a .sim text into a list of calls.
+	'''
+	parser = _Parser(text)
+	calls = []
+	while parser.peek() is not None:
+		call = parser.value()
+		if not isinstance(call, dict):
+			parser.i -= 1
+			parser.error("expected a call")
+		calls.append(call)
+	return calls
+
+def _evaluate(value, functions):
+	if isinstance(value, dict):
+		if value["call"] not in functions:
+			raise Exception("unknown function " + str(value["call"]) + " in domain")
+		args = [_evaluate(arg, functions) for arg in value["args"]]
+		kwargs = {key: _evaluate(arg, functions) for key, arg in value["kwargs"].items()}
+		return functions[value["call"]](*args, **kwargs)
+	if isinstance(value, list):
+		return [_evaluate(item, functions) for item in value]
+	if isinstance(value, tuple):
+		return tuple([_evaluate(item, functions) for item in value])
+	return value
+
+def run(calls, loader = None):
+	'''
+	Makes the parsed calls on loader (by default, the current module-level loader),
+	adding types, predicates, operators etc. to it. Returns the value of the last call.
+	'''
+	functions = (loader or _current).functions()
+	result = None
+	for call in calls:
+		result = _evaluate(call, functions)
+	return result
+
+def _cache_path(digest):
+	return os.path.join(CACHE_DIR, digest + ".simc")
+
+def _cache_dir_safe():
+	'''
+	Creates CACHE_DIR (readable by its owner only) if it does not exist, and returns True
+	if it is a folder that only this user can write to. Cached files are trusted as
+	parsed domains, so a folder that someone else could plant files in is not used.
+	'''
+	try:
+		if not os.path.isdir(CACHE_DIR):
+			os.makedirs(CACHE_DIR, 0o700)
+		st = os.stat(CACHE_DIR)
+	except OSError:
+		return False
+	if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o022):
+		return False
+	return True
+
+def compile_domain(text):
+	'''
+	Returns the parsed calls of a .sim text, from the in-process or disk cache if it has
+	been parsed before. The disk cache can be shared by any number of processes: files
+	are named by a hash of the text and written in one step.
+	'''
+	digest = hashlib.sha1("%d %s\n" % (PARSER_VERSION, sys.version) + text).hexdigest()
+	if digest in _compiled:
+		return _compiled[digest]
+	calls = None
+	useCache = bool(CACHE_DIR) and _cache_dir_safe()
+	if useCache:
+		try:
+			with open(_cache_path(digest), "rb") as f:
+				calls = marshal.load(f)
+		except (IOError, EOFError, ValueError, TypeError):
+			calls = None
+	if calls is None:
+		calls = parse(text)
+		if useCache:
+			try:
+				tmp = _cache_path(digest) + "." + str(os.getpid()) + ".tmp"
+				with open(tmp, "wb") as f:
+					marshal.dump(calls, f)
+				os.rename(tmp, _cache_path(digest))
+			except (IOError, OSError):
+				pass #the cache is only an optimization
+	_compiled[digest] = calls
+	return calls
 
 def load_domain(filename):
-	f = open(filename)
-	exec preprocess(f.read())
-	f.close()
-	world = worldsim.World(operators.values(), predicates.values(), atoms, types, objects.values(),cltree,obtree)
+	'''
+	Returns a new World built from a .sim domain file. Every call builds an independent
+	world; nothing is carried over from earlier loads.
+	'''
+	loader = DomainLoader()
+	world = loader.load_domain(filename)
+	_use(loader)
 	return world
 
 def load_domain_str(str):
-	exec preprocess(str)
-	world = worldsim.World(operators.values(), predicates.values(), atoms, types, objects.values())
+	loader = DomainLoader()
+	world = loader.load_domain_str(str)
+	_use(loader)
 	return world
 
-def operator_no_side_effect(name, args = [], preconditions = [], results = []):
+def load_operator_str(op_str, world = None):
 	'''
-	Just like operator function above, except doesn't save the operator into the global operators, instead
-	returns the operator
+	Returns the operator built by op_str, a call of operator_no_side_effect, using the
+	types and predicates of world (by default, those of the last domain loaded).
 	'''
-	objnames = []
-	argtypes = {}
-	for argname, argtype in args:
-		objnames.append(argname)	
-		if argtype not in types:
-			raise Exception("object type DNE.")
-		argtypes[argname] = types[argtype]
-	prepredicates = []
-	preobjnames = []
-	preobjtypes = []
-	prePositive = []
-	for condition in preconditions:
-		for argname in condition.argnames:
-			if argname not in objnames:
-				raise Exception("condition argument not listed as an object for this operator")
-		prepredicates.append(condition.predicate)
-		preobjnames.append(condition.argnames)
-		objtypes = []
-		for objname in preobjnames[-1]:
-			objtypes.append(argtypes[objname])
-		preobjtypes.append(objtypes)
-		prePositive.append(condition.positive)
-	postpredicates = []
-	postobjnames = []
-	postobjtypes = []
-	postPositive = []
-	for condition in results:
-		for argname in condition.argnames:
-			if argname not in objnames:
-				raise Exception("condition argument not listed as an object for this operator")
-		postpredicates.append(condition.predicate)
-		postobjnames.append(condition.argnames)
-		objtypes = []
-		for objname in postobjnames[-1]:
-			objtypes.append(argtypes[objname])
-		postobjtypes.append(objtypes)
-		postPositive.append(condition.positive)
-	return worldsim.Operator(name, objnames, prepredicates, preobjnames, preobjtypes, prePositive, postpredicates, postobjnames, postobjtypes, postPositive)
-
-def load_operator_str(op_str):
-	return eval(preprocess(op_str))
+	if world is not None:
+		return run(compile_domain(op_str), DomainLoader(world))
+	return run(compile_domain(op_str))
 
 def to_shop2_domain(world, name):
 	strs = ["(in-package :shop2)\n\n"]
@@ -0,0 +1,299 @@
+'''
+Binary snapshots of worldsim.World states.
+
+A snapshot file is a header followed by records. Each record holds the names (object,
+type and predicate names) it uses for the first time, which are added to a string table
+shared by the whole file, and then objects as (name, type) index pairs and atoms as
+arrays of name indexes, grouped by predicate. A full record holds a whole state; a delta
+record only holds the objects and atoms added and removed since the previous record, so
+a long run can checkpoint its world every cycle for about the cost of its changes:
+
+	writer = snapshot.SnapshotWriter("run.snap")
+	writer.write(world)		#each cycle
+	...
+	snap = snapshot.Snapshot("run.snap")
+	world = snap.world(domainWorld, 10)	#the world as of the 11th record
+
+Snapshots only hold the state. Loading one needs a world of the same domain (e.g. a
+freshly loaded domain), whose operators, predicates and types the loaded world shares.
+Files are memory-mapped when read, and records before the one restored that are not
+needed (those before the last full record) are never read.
+'''
+
+import array, mmap, struct, sys
+import worldsim, atomstore
+
+MAGIC = "MIDCAWS"
+VERSION = 1
+HEADER = MAGIC + chr(VERSION)
+
+FULL = "F"
+DELTA = "D"
+
+_RECORD = struct.Struct("<cI")
+_COUNT = struct.Struct("<I")
+_GROUP = struct.Struct("<III")
+
+def _ints(values):
+	a = array.array("i", values)
+	if sys.byteorder == "big":
+		a.byteswap()
+	return a.tostring()
+
+def _read_ints(buf, offset, count):
+	'''
+	Returns (array of count ints at offset in buf, offset after them).
+	'''
+	a = array.array("i")
+	end = offset + count * a.itemsize
+	a.fromstring(buf[offset:end])
+	if sys.byteorder == "big":
+		a.byteswap()
+	return a, end
+
+class SnapshotWriter:
+
+	def __init__(self, path, fullEvery = 0):
+		'''
+		Creates (or overwrites) the snapshot file path. If fullEvery is positive, every
+		fullEvery-th record is written in full, which bounds the number of records that
+		restoring a state has to replay.
+		'''
+		self.path = path
+		self.fullEvery = fullEvery
+		self.strings = {}
+		self.records = 0
+		self.last = None
+		self.f = open(path, "wb")
+		self.f.write(HEADER)
+		self.f.flush()
+
+	def _index(self, name, new):
+		i = self.strings.get(name)
+		if i is None:
+			i = self.strings[name] = len(self.strings)
+			new.append(name)
+		return i
+
+	def _atoms(self, atoms, new):
+		groups = {}
+		for atom in atoms:
+			groups.setdefault(atom.predicate.name, []).append(atom)
+		chunks = [_COUNT.pack(len(groups))]
+		for predname, group in groups.items():
+			arity = len(group[0].args)
+			indexes = [self._index(arg.name, new) for atom in group for arg in atom.args]
+			chunks.append(_GROUP.pack(self._index(predname, new), arity, len(group)))
+			chunks.append(_ints(indexes))
+		return chunks
+
+	def write(self, world, full = False):
+		'''
+		Appends a record of world's current state and returns its index. The record is a
+		delta from the previous record, unless full is True, this is the first record or
+		fullEvery says otherwise.
+		'''
+		if self.f is None:
+			raise Exception("Snapshot file " + self.path + " is closed")
+		if self.last is None or full or (self.fullEvery and self.records % self.fullEvery == 0):
+			kind = FULL
+			objsAdded = world.objects.values()
+			objsRemoved = []
+			atomsAdded, atomsRemoved = world.atoms, ()
+		else:
+			kind = DELTA
+			before = self.last.objects
+			if world.objects == before:
+				objsAdded, objsRemoved = [], []
+			else:
+				objsAdded = [obj for name, obj in world.objects.iteritems()
+							if name not in before or before[name].type is not obj.type]
+				objsRemoved = [name for name in before if name not in world.objects]
+			atomsAdded, atomsRemoved = world.atoms.diff(self.last.atoms)
+		new = []
+		body = [_COUNT.pack(len(objsAdded))]
+		body.append(_ints([i for obj in objsAdded for i in
+						(self._index(obj.name, new), self._index(obj.type.name, new))]))
+		body.append(_COUNT.pack(len(objsRemoved)))
+		body.append(_ints([self._index(name, new) for name in objsRemoved]))
+		body.extend(self._atoms(atomsAdded, new))
+		body.extend(self._atoms(atomsRemoved, new))
+		strings = [_COUNT.pack(len(new))]
+		for name in new:
+			strings.append(_COUNT.pack(len(name)))
+			strings.append(name)
+		payload = "".join(strings + body)
+		self.f.write(_RECORD.pack(kind, len(payload)))
+		self.f.write(payload)
+		self.f.flush()
+		self.last = world.copy()
+		self.records += 1
+		return self.records - 1
+
+	def close(self):
+		if self.f:
+			self.f.close()
+			self.f = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class Snapshot:
+
+	def __init__(self, path):
+		'''
+		Opens the snapshot file path. Only the string tables and record headers are read
+		until a world is restored.
+		'''
+		self.path = path
+		self.f = open(path, "rb")
+		self.buf = mmap.mmap(self.f.fileno(), 0, access = mmap.ACCESS_READ)
+		if self.buf[:len(HEADER)] != HEADER:
+			self.close()
+			raise Exception(path + " is not a MIDCA world snapshot (version " + str(VERSION) + ")")
+		self.strings = []
+		self.records = [] #(kind, offset of the objects section, end offset)
+		offset = len(HEADER)
+		while offset + _RECORD.size <= len(self.buf):
+			kind, length = _RECORD.unpack_from(self.buf, offset)
+			offset += _RECORD.size
+			end = offset + length
+			if end > len(self.buf):
+				break #a record still being written
+			(count,) = _COUNT.unpack_from(self.buf, offset)
+			offset += _COUNT.size
+			for i in range(count):
+				(size,) = _COUNT.unpack_from(self.buf, offset)
+				offset += _COUNT.size
+				self.strings.append(self.buf[offset:offset + size])
+				offset += size
+			self.records.append((kind, offset, end))
+			offset = end
+
+	def __len__(self):
+		return len(self.records)
+
+	def _read_atoms(self, offset):
+		'''
+		Returns ([(predicate name, arity, number of atoms, array of name indexes)], offset
+		after them).
+		'''
+		(count,) = _COUNT.unpack_from(self.buf, offset)
+		offset += _COUNT.size
+		groups = []
+		for i in range(count):
+			pred, arity, num = _GROUP.unpack_from(self.buf, offset)
+			indexes, offset = _read_ints(self.buf, offset + _GROUP.size, arity * num)
+			groups.append((self.strings[pred], arity, num, indexes))
+		return groups, offset
+
+	def _read_record(self, index):
+		'''
+		Returns (kind, objects added as (name, type name) pairs, names of objects removed,
+		atom groups added, atom groups removed).
+		'''
+		kind, offset, end = self.records[index]
+		strings = self.strings
+		(count,) = _COUNT.unpack_from(self.buf, offset)
+		pairs, offset = _read_ints(self.buf, offset + _COUNT.size, 2 * count)
+		objsAdded = [(strings[pairs[i]], strings[pairs[i + 1]]) for i in range(0, len(pairs), 2)]
+		(count,) = _COUNT.unpack_from(self.buf, offset)
+		names, offset = _read_ints(self.buf, offset + _COUNT.size, count)
+		objsRemoved = [strings[i] for i in names]
+		atomsAdded, offset = self._read_atoms(offset)
+		atomsRemoved, offset = self._read_atoms(offset)
+		return kind, objsAdded, objsRemoved, atomsAdded, atomsRemoved
+
+	def _atoms(self, groups, world, checked):
+		predicates = world.predicates
+		objects = world.objects
+		interned = worldsim.Atom._interned
+		strings = self.strings
+		for predname, arity, num, indexes in groups:
+			if predname not in predicates:
+				raise Exception("Predicate " + predname + " DNE in the world the snapshot is loaded into")
+			predicate = predicates[predname]
+			for n in range(num):
+				start = n * arity
+				argnames = tuple([strings[i] for i in indexes[start:start + arity]])
+				args = [objects[name] for name in argnames]
+				atom = interned.get((predicate, tuple(args)))
+				if atom is None:
+					signature = (predicate, tuple([arg.type for arg in args]))
+					if signature in checked:
+						atom = worldsim.Atom._make(predicate, args, (predname, argnames))
+					else:
+						atom = predicate.instantiate(args)
+						checked.add(signature)
+				yield atom
+
+	def world(self, domain, index = -1):
+		'''
+		Returns a new World in the state of record index (by default the last one), with
+		the operators, predicates and types of the world domain.
+		'''
+		if not self.records:
+			raise Exception("Snapshot " + self.path + " has no records")
+		if index < 0:
+			index += len(self.records)
+		if index < 0 or index >= len(self.records):
+			raise IndexError("Snapshot " + self.path + " has " + str(len(self.records)) + " records")
+		start = index
+		while self.records[start][0] != FULL:
+			start -= 1
+		world = domain.copy()
+		world.objects = {}
+		world._objectsByType = None
+		atoms = set()
+		checked = set()
+		for i in range(start, index + 1):
+			kind, objsAdded, objsRemoved, atomsAdded, atomsRemoved = self._read_record(i)
+			atoms.difference_update(self._atoms(atomsRemoved, world, checked))
+			for name in objsRemoved:
+				del world.objects[name]
+			retyped = set()
+			for name, typename in objsAdded:
+				if typename not in world.types:
+					raise Exception("Type " + typename + " DNE in the world the snapshot is loaded into")
+				if name in world.objects:
+					retyped.add(name)
+				world.objects[name] = world.types[typename].instantiate(name)
+			if retyped:
+				#atoms equal their rebuilt versions, so the old ones must be taken out first
+				stale = [atom for atom in atoms if any(arg.name in retyped for arg in atom.args)]
+				atoms.difference_update(stale)
+				atoms.update([atom.predicate.instantiate([world.objects[arg.name] for arg in atom.args])
+							for atom in stale])
+			atoms.update(self._atoms(atomsAdded, world, checked))
+		world.atoms = atomstore.AtomStore(atoms)
+		return world
+
+	def close(self):
+		if self.buf is not None:
+			self.buf.close()
+			self.buf = None
+		self.f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def save(world, path):
+	'''
+	Writes world's state to path as a snapshot with a single full record.
+	'''
+	with SnapshotWriter(path) as writer:
+		writer.write(world)
+
+def load(path, domain, index = -1):
+	'''
+	Returns a new World in the state saved in path (record index, by default the last),
+	with the operators, predicates and types of the world domain.
+	'''
+	with Snapshot(path) as snap:
+		return snap.world(domain, index)
@@ -1,67 +1,117 @@
-import worldsim as plan, domainread as domain_read
+import worldsim as plan, domainread as domain_read, atomstore
+
+#number of atoms collected before they are added to the world at once
+CHUNK_SIZE = 10000
+
+def _lines(s):
+	'''
+	Yields the lines of s one by one, without splitting it all at once.
+	'''
+	start = 0
+	while True:
+		end = s.find("\n", start)
+		if end == -1:
+			yield s[start:]
+			return
+		yield s[start:end]
+		start = end + 1
 
 #Note: this algorithm does not handle many potential user errors.
-def _apply_state(world, lines):
+def _apply_state(world, lines, chunkSize = CHUNK_SIZE):
+	'''
+	Applies the state declarations in lines (any iterable of lines, e.g. an open file) to
+	world. New atoms are collected and added in chunks of chunkSize, and argument types
+	are only checked once for each predicate and combination of argument types, so large
+	generated states load quickly and can be streamed.
+	'''
+	predicates = world.predicates
+	objects = world.objects
+	types = world.types
+	interned = plan.Atom._interned
+	checked = set() #(predicate, argument types) known to fit
+	pending = []
 	lineNum = 1
 	for line in lines:
 		if "#" in line:
 			line = line[:line.index("#")] #comments
-		if "(" in line:
-			if ")" not in line:
+		paren = line.find("(")
+		if paren != -1:
+			close = line.find(")")
+			if close == -1:
 				raise Exception("Line " + str(lineNum) + ": Declarations must be contained on single line: " + line)
-			call = line[:line.index("(")].strip()
-			argnames = line[line.index("(") + 1:line.index(")")].split(",")
-			for i in range(len(argnames)):
-				argnames[i] = argnames[i].strip()
+			call = line[:paren].strip()
+			argnames = [name.strip() for name in line[paren + 1:close].split(",")]
 			if call.startswith("!"):
 				negate = True
 				call = call[1:]
 			else:
 				negate = False
-			if call in world.predicates:
+			if call in predicates:
+				predicate = predicates[call]
 				args = []
 				for name in argnames:
 					if not name:
 						continue
-					if name not in world.objects:
-						
+					if name not in objects:
 						raise Exception("Line " + str(lineNum) + ": Object - " + name + " DNE " + line)
-					args.append(world.objects[name])
-				atom = world.predicates[call].instantiate(args)
-				#if len(args) > 0:
-				#	print("just instantiated atom: "+str(atom)+" args[0]: "+str(args[0]))
+					args.append(objects[name])
+				atom = interned.get((predicate, tuple(args)))
+				if atom is None:
+					signature = (predicate, tuple([arg.type for arg in args]))
+					if signature in checked:
+						atom = plan.Atom._make(predicate, args, (call, tuple([arg.name for arg in args])))
+					else:
+						atom = predicate.instantiate(args)
+						checked.add(signature)
 				if negate:
+					if pending:
+						world.atoms.update(pending)
+						pending = []
 					world.remove_atom(atom)
 				else:
-					world.add_atom(atom)
-			elif call in world.types:
+					pending.append(atom)
+					if len(pending) >= chunkSize:
+						world.atoms.update(pending)
+						pending = []
+			elif call in types:
 				name = argnames[0]
 				if negate:
+					if pending:
+						world.atoms.update(pending)
+						pending = []
 					if not world.remove_object(name):
 						raise Exception("Line " + str(lineNum) + ": Tried to remove object " + name + " but there is no such object - " + line)
 				else:
-					world.add_object(world.types[call].instantiate(name))
+					world.add_object(types[call].instantiate(name))
+				objects = world.objects #the world may have replaced a shared dict
 			elif len(line) > 0:
 				raise Exception("Line " + str(lineNum) + ": invalid command " + line)
 		elif line.startswith("!"):
-			name = line[1:]
+			if pending:
+				world.atoms.update(pending)
+				pending = []
+			name = line[1:].strip()
 			if not world.remove_object(name):
 				raise Exception("Line " + str(lineNum) + ": Tried to remove object " + name + " but there is no such object - " + line)
+			objects = world.objects
 		elif line.strip() != "":
 			raise Exception("Line " + str(lineNum) + ": invalid command - " + line)
 		lineNum += 1
+	if pending:
+		world.atoms.update(pending)
 
-def apply_state_str(world, s):
-	lines = s.split("\n")
-	_apply_state(world, lines)
+def apply_state_str(world, s, chunkSize = CHUNK_SIZE):
+	_apply_state(world, _lines(s), chunkSize)
 
-def apply_state_file(world, filename):
-	lines = open(filename).readlines()
-	_apply_state(world, lines)				
+def apply_state_file(world, filename, chunkSize = CHUNK_SIZE):
+	'''
+	Applies the state in filename to world. The file is read line by line, so states of
+	any size can be loaded.
+	'''
+	with open(filename) as f:
+		_apply_state(world, f, chunkSize)
 
 def set_state(world, filename):
-	world.atoms = []
+	world.atoms = atomstore.AtomStore()
 	world.objects = {}
 	apply_state_file(world, filename)
-
-
@@ -1,4 +1,6 @@
-import copy
+import copy, itertools, weakref
+import atomstore
+
 class Obj:
 	
 	def __init__(self, name, type):
@@ -16,21 +18,34 @@ class Obj:
 
 class Type:
 	
+	#incremented whenever the type lattice may have changed; older cached ancestor sets are rebuilt
+	latticeVersion = 0
+	
 	def __init__(self, name, parents = []):
 		self.parents = parents
 		self.name = name
+		self._ancestorSet = None
+		self._ancestorVersion = -1
+	
+	def ancestor_set(self):
+		'''
+		Returns a frozenset of all ancestors of this type. It is computed once and cached
+		until invalidate_type_lattice() is called.
+		'''
+		if self._ancestorVersion != Type.latticeVersion:
+			ancestors = set()
+			for parent in self.parents:
+				ancestors.add(parent)
+				ancestors.update(parent.ancestor_set())
+			self._ancestorSet = frozenset(ancestors)
+			self._ancestorVersion = Type.latticeVersion
+		return self._ancestorSet
 	
-	#optimize (i.e. save ancestor set) if necessary
 	def ancestors(self):
-		ancestors = {}
-		for parent in self.parents:
-			ancestors[parent] = True
-			for ancestor in parent.ancestors():
-				ancestors[ancestor] = True
-		return ancestors
+		return dict.fromkeys(self.ancestor_set(), True)
 
 	def is_a_(self, type):
-		return type == self or type in self.ancestors()
+		return type is self or type in self.ancestor_set()
 	
 	def instantiate(self, name):
 		return Obj(name, self)
@@ -38,9 +53,43 @@ class Type:
 	def __str__(self):
 		return "Type: " + self.name
 
-class Atom:
+def invalidate_type_lattice():
+	'''
+	Call after changing any Type's parents. Cached ancestor sets are rebuilt on next use.
+	'''
+	Type.latticeVersion += 1
+
+def freeze_type_lattice(types):
+	'''
+	Precomputes the ancestor set of every given type so that later subtype checks are
+	constant time lookups.
+	'''
+	for type in types:
+		type.ancestor_set()
+
+class Atom(object):
+	
+	'''
+	A ground predicate. Atoms are interned per predicate and argument objects: building an
+	atom of the same Predicate and the same Obj instances as a live one returns that same
+	object, so comparisons between atoms of one world are identity checks, and argument
+	types are only checked the first time a given atom is built. Atoms built from other
+	Predicate or Obj instances with the same names (e.g. from a reloaded domain or a deep
+	copied world) are distinct objects but still equal: every atom has a small int id,
+	shared by all atoms with the same names, which is its hash and what it is compared by.
+	args is a tuple.
+	'''
+	
+	__slots__ = ["predicate", "args", "key", "id", "__weakref__"]
+	
+	_interned = weakref.WeakValueDictionary()
+	_ids = {}
+	_nextId = itertools.count()
 	
-	def __init__(self, predicate, args):
+	def __new__(cls, predicate, args):
+		atom = Atom._interned.get((predicate, tuple(args)))
+		if atom is not None:
+			return atom
 		if len(predicate.argnames) != len(args):
 			raise Exception("Wrong number of args for " + predicate.name)
 		i = 0
@@ -51,10 +100,23 @@ class Atom:
 					raise Exception("Instantiating argument " + predicate.argnames[i] + " with " + arg.name + ", which is the wrong type of object")
 				i += 1
 		
-		self.predicate = predicate
-		self.args = args
-		self.hash = hash(predicate.name + str(map(str,args))) # little expensive because of map, but only
-															  # happens at initialization
+		return Atom._make(predicate, args, (predicate.name, tuple([arg.name for arg in args])))
+	
+	@staticmethod
+	def _make(predicate, args, key):
+		'''
+		Builds and interns a new atom without any checks. The caller must have checked
+		that there is no live atom of predicate and args and that args fit predicate.
+		'''
+		atom = object.__new__(Atom)
+		atom.predicate = predicate
+		atom.args = tuple(args)
+		atom.key = key
+		atom.id = Atom._ids.get(key)
+		if atom.id is None:
+			atom.id = Atom._ids.setdefault(key, next(Atom._nextId))
+		Atom._interned[(predicate, atom.args)] = atom
+		return atom
 		
 	def __getitem__(self, item):
 		if item in self.predicate.argnames:
@@ -73,13 +135,24 @@ class Atom:
 		return s + ")"
 	
 	def __hash__(self):
-		return self.hash
+		return self.id
 	
 	def __eq__(self, other):
-		return self.hash == other.hash
+		return self is other or (isinstance(other, Atom) and self.id == other.id)
 	
 	def __ne__(self, other):
-		return self.hash != other.hash
+		return not self == other
+	
+	#atoms are immutable, so a shallow copy is the atom itself
+	def __copy__(self):
+		return self
+	
+	#a deep copy is built from the copied predicate and objects, so it fits the copied world
+	def __deepcopy__(self, memo):
+		return Atom(copy.deepcopy(self.predicate, memo), copy.deepcopy(self.args, memo))
+	
+	def __reduce__(self):
+		return (Atom, (self.predicate, self.args))
 	
 class Predicate:
 	
@@ -452,7 +525,9 @@ class Node:
                 return self
 
 		
-class World:
+class World(object):
+	
+	_SHARED = ("operators", "predicates", "types", "objects")
 	
 	def __init__(self,operators, predicates, atoms, types, objects = [],cltree = [] , obtree = []):
 		self.operators = {}
@@ -470,7 +545,20 @@ class World:
 				self.objects[arg.name] = arg
 		for object in objects:
 			self.objects[object.name] = object
-		self.atoms = set(atoms)
+		self.atoms = atomstore.AtomStore(atoms)
+		self._shared = set()
+	
+	def _get_atoms_store(self):
+		return self._atoms
+	
+	def _set_atoms_store(self, atoms):
+		# modules sometimes assign a plain list or set here; keep it indexed either way
+		if isinstance(atoms, atomstore.AtomStore):
+			self._atoms = atoms
+		else:
+			self._atoms = atomstore.AtomStore(atoms)
+	
+	atoms = property(_get_atoms_store, _set_atoms_store)
 	
 	def get_atoms(self,filters=[]):
 		'''
@@ -482,26 +570,26 @@ class World:
 		if len(filters) == 0:
 			return self.atoms
 		
-		# record which filters have matched
-		filter_matches = {k:False for k in filters}
-		#print("filter matches = "+str(filter_matches))
-		relevant_atoms = []
-		if len(filters) > 0:
-			for atom in self.atoms:
-				atom_parts = [atom.predicate]+atom.args
-				for filter_str in filters: # assuming there shouldn't be more than 3-4 filters
-					for part in atom_parts: # assuming shouldn't be atoms with more than 4-5 parts
-						#print "type(part) == "+str(part.name)
-						if (not filter_matches[filter_str]) and filter_str in part.name:
-							filter_matches[filter_str] = True
-							
-				if not (False in filter_matches.values()): # check to see they are all True
-					relevant_atoms.append(atom)
-					#print("Just added "+str(atom)+" to relevant atoms")
-				# reset filter matches
-				filter_matches = {k:False for k in filters}
-				
-		return relevant_atoms
+		return list(self.atoms.filter_names(filters))
+	
+	def get_atoms_by_predicate(self, predname):
+		'''
+		Returns a list of all true atoms of the named predicate.
+		'''
+		return list(self.atoms.by_predicate(predname))
+	
+	def get_atoms_by_object(self, objname):
+		'''
+		Returns a list of all true atoms that have the named object as an argument.
+		'''
+		return list(self.atoms.by_object(objname))
+	
+	def query(self, predname, argnames = []):
+		'''
+		Returns a list of all true atoms of the named predicate whose argument names match
+		argnames, where "?" matches any object. E.g. query("on", ["?", "B"]).
+		'''
+		return self.atoms.match(predname, argnames)
 
 	def get_objects_names_by_type(self, typename):
 		objs = []
@@ -536,26 +624,64 @@ class World:
 		return  diff_result == ([],[])
 	
 	def fast_equal(self,otherworld):
-		pass
+		'''
+		Same as equal(), but compares state hashes first, so worlds that differ are
+		usually told apart in constant time.
+		'''
+		if self.state_hash() != otherworld.state_hash():
+			return False
+		return self.atoms == otherworld.atoms
+	
+	def state_hash(self):
+		'''
+		Returns an order-independent hash of the atoms true in this world. Worlds with
+		the same atoms have the same state hash.
+		'''
+		return self.atoms.state_hash()
+	
+	def fingerprint(self):
+		'''
+		Returns a hashable value that is equal for worlds with the same atoms. Unlike
+		state_hash(), two worlds with equal fingerprints are sure to have the same atoms.
+		'''
+		return frozenset(self.atoms)
+	
+	def _own(self, name):
+		'''
+		Replaces the dict attribute name with a copy this world can change, if it is shared
+		with a copy of this world.
+		'''
+		shared = getattr(self, "_shared", None)
+		if shared and name in shared:
+			setattr(self, name, dict(getattr(self, name)))
+			shared.discard(name)
 	
 	def copy(self):
-		# safety check, in case a list is passed for atoms instead of a set
-		if not type(self.atoms) is set:
-			self.atoms = set(self.atoms)
-			
-		return World(self.operators.values(), self.predicates.values(), self.atoms.copy(), self.types.copy(), self.objects.values())
+		'''
+		Returns a snapshot of this world in O(1). Everything is copy-on-write: the copy
+		shares its atoms with this world and only stores what changes in either of them
+		afterwards, and the two worlds share their operators, predicates, types and objects
+		dicts until either one changes them, which must be done through World's methods
+		(add_object(), remove_object(), add_operator(), remove_operator()).
+		'''
+		new = World.__new__(World)
+		new.operators = self.operators
+		new.predicates = self.predicates
+		new.objects = self.objects
+		if getattr(self, "_objectsByType", None) is not None and \
+				self._objectsByTypeKey == (id(self.objects), len(self.objects), Type.latticeVersion):
+			new._objectsByType = self._objectsByType
+			new._objectsByTypeKey = self._objectsByTypeKey
+		new.types = self.types
+		new._shared = set(World._SHARED)
+		self._shared = set(World._SHARED)
+		new.cltree = self.cltree
+		new.obtree = self.obtree
+		new.atoms = self.atoms.copy()
+		return new
 	
 	def is_true(self, predname, argnames = []):
-		for atom in self.atoms:
-			if atom.predicate.name == predname:
-				if len(atom.args) == len(argnames):
-					namesCorrect = True
-					for i in range(len(atom.args)):
-						if atom.args[i].name != argnames[i]:
-							namesCorrect = False
-					if namesCorrect:
-						return True
-		return False
+		return self.atoms.get_exact(predname, argnames) is not None
 	
 	def atom_true(self, atom):
 		# this is very fast, because atom objects have hashes and self.atoms is a set, not a list
@@ -572,22 +698,14 @@ class World:
 		self.atoms.remove(atom)
 				
 	def remove_fact(self, predname, argnames = []):
-		toRemove = None
-		for atom in self.atoms:
-			if atom.predicate.name == predname:
-				if len(atom.args) == len(argnames):
-					namesCorrect = True
-					for i in range(len(atom.args)):
-						if atom.args[i].name != argnames[i]:
-							namesCorrect = False
-					if namesCorrect:
-						toRemove = atom
-						break
+		toRemove = self.atoms.get_exact(predname, argnames)
 		if toRemove:
 			self.remove_atom(toRemove)
 	
 	def add_object(self, object):
+		self._own("objects")
 		self.objects[object.name] = object
+		self._objectsByType = None
 	
 	def add_object_by_type(self, name, type):
 		if type in self.types:
@@ -599,19 +717,26 @@ class World:
 		return self.objects[objname].type.name
 	
 	def remove_object(self, object):
+		self._objectsByType = None
+		self._own("objects")
 		if object in self.objects:
 			actualObject = self.objects[object]
 			del(self.objects[object])
-			self.atoms = [atom for atom in self.atoms if actualObject not in atom.args]
+			self._remove_atoms_with(actualObject)
 			return True
 		else:
 			for key in self.objects:
 				if self.objects[key] == object:
 					del(self.objects[key])
-					self.atoms = [atom for atom in self.atoms if object not in atom.args]
+					self._remove_atoms_with(object)
 					return True
 		return False
 	
+	def _remove_atoms_with(self, object):
+		#by name: atoms added from another world can hold a different object of the same name
+		for atom in list(self.atoms.by_object(object.name)):
+			self.atoms.discard(atom)
+	
 	def get_possible_objects(self, predicate, arg):
 		return self.objects.values() #not, obviously, a good implementation
 	
@@ -623,12 +748,19 @@ class World:
 			if some_type.name not in self.get_types():
 				raise Exception("Trying to get object of type "+str(some_type)+" but not a valid type")
 			
-		objs = []
-		for obj in self.objects.values():
-			if obj.is_a(some_type):
-				objs.append(obj)
+		# cached per objects dict; copies share the cache until either changes its objects
+		key = (id(self.objects), len(self.objects), Type.latticeVersion)
+		if getattr(self, "_objectsByType", None) is None or self._objectsByTypeKey != key:
+			self._objectsByType = {}
+			self._objectsByTypeKey = key
+		if some_type not in self._objectsByType:
+			objs = []
+			for obj in self.objects.values():
+				if obj.is_a(some_type):
+					objs.append(obj)
+			self._objectsByType[some_type] = objs
 		
-		return objs
+		return list(self._objectsByType[some_type])
 	
 	def get_types(self):
 		return self.types
@@ -765,23 +897,26 @@ class World:
 	def get_operators(self):
 		return self.operators
 	
+	def add_operator(self, operator):
+		self._own("operators")
+		self.operators[operator.name] = operator
+	
 	def remove_operator(self, opname):
 		if opname in self.operators.keys():
+			self._own("operators")
 			del self.operators[opname]
 			return True
 		return False
 	
 	def __str__(self):
-		s = "[\n"
+		lines = ["["]
 		for name in sorted(self.objects.keys()):
 			object = self.objects[name]
-			s += object.name + " (" + object.type.name + ") : "
-			for atom in self.atoms:
-				if object in atom.args:
-					s += str(atom) + " and "
-			if s[-2:] == "d ":
-				s = s[:-5] + "\n"
-			else:
-				s = s[:-3] + "\n"
-		return s + "]\n"
+			line = object.name + " (" + object.type.name + ")"
+			atoms = [str(atom) for atom in self.atoms.by_object(object.name) if object in atom.args]
+			if atoms:
+				line += " : " + " and ".join(atoms)
+			lines.append(line)
+		lines.append("]\n")
+		return "\n".join(lines)
 